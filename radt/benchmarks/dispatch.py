@@ -0,0 +1,66 @@
+"""Per-call cost of RADTBenchmark attribute dispatch
+
+Measures `run.log_metric` and an mlflow passthrough function with tracking enabled and
+disabled (RADT_MAX_EPOCH unset), against a plain bound method call as baseline.
+Tracking is done against a throwaway local file store.
+
+Usage: python benchmarks/dispatch.py [-n CALLS]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+tmp = tempfile.TemporaryDirectory(prefix="radt-dispatch-")
+os.environ["MLFLOW_TRACKING_URI"] = f"file://{tmp.name}/mlruns"
+os.environ["RADT_JOURNAL_DIR"] = f"{tmp.name}/journal"
+os.environ["RADT_SNAPSHOT_DIR"] = f"{tmp.name}/snapshots"
+os.environ.pop("RADT_MAX_EPOCH", None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from radt.run import RADTBenchmark  # noqa: E402
+
+
+class Baseline:
+    def log_metric(self, name, value, epoch=0):
+        return
+
+    def passthrough(self, *args, **kwargs):
+        return
+
+
+def measure(label: str, stmt, calls: int):
+    ns = min(timeit.repeat(stmt, number=calls, repeat=5)) / calls * 1e9
+    print(f"{label:<40}{ns:>10.0f} ns/call")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--calls", type=int, default=200000)
+    calls = parser.parse_args().calls
+
+    baseline = Baseline()
+    measure("baseline bound method", lambda: baseline.log_metric("a", 1.0), calls)
+    measure("baseline bound method (*args)", lambda: baseline.passthrough("a", 1.0), calls)
+    measure("baseline attribute access", lambda: baseline.log_metric, calls)
+
+    disabled = RADTBenchmark()
+    measure("disabled log_metric", lambda: disabled.log_metric("a", 1.0), calls)
+    measure("disabled passthrough (set_tag)", lambda: disabled.set_tag("a", "b"), calls)
+    measure("disabled attribute access", lambda: disabled.log_metric, calls)
+
+    os.environ["RADT_MAX_EPOCH"] = str(sys.maxsize)
+    os.environ["RADT_MAX_TIME"] = str(10**9)
+    with RADTBenchmark() as run:
+        # Let the environment snapshot finish, it competes for the interpreter
+        run.snapshot.join()
+        measure("enabled attribute access", lambda: run.log_metric, calls)
+        measure("enabled passthrough attribute access", lambda: run.set_tag, calls)
+        measure("enabled log_metric", lambda: run.log_metric("a", 1.0), calls // 10)
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Import time of the radT entry points
+
+Runs every entry point in a fresh interpreter with `-X importtime`, reports the cumulative
+import time of its modules and checks that no heavy dependency is loaded that it does not need.
+Exits with status 1 when a target is missed.
+
+Usage: python benchmarks/import_time.py [-n REPEATS]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs the command line with the given arguments, without printing the usage
+HELP = (
+    "import contextlib, io, sys; sys.argv = {!r}; from radt import cli\n"
+    "with contextlib.suppress(SystemExit), contextlib.redirect_stdout(io.StringIO()): cli()"
+)
+
+# Statement, maximum import time (s), modules that must not be imported
+ENTRY_POINTS = {
+    "radt": ("import radt", 0.1, ["mlflow", "pandas", "numpy", "migedit"]),
+    "radt run": ("from radt.run import start_run", 2.0, ["pandas", "migedit"]),
+    "radt sync": ("from radt.run.journal import sync", 2.0, ["pandas", "migedit"]),
+    "radt (schedule)": ("from radt.schedule import start_schedule", 4.0, []),
+    "radt --help": (HELP.format(["radt", "--help"]), 0.1, ["mlflow", "pandas", "numpy", "migedit"]),
+    "radt plan --help": (
+        HELP.format(["radt", "plan", "--help"]),
+        0.1,
+        ["mlflow", "pandas", "numpy", "migedit"],
+    ),
+}
+
+
+def import_time(statement: str, forbidden: list):
+    """Import a statement in a fresh interpreter
+
+    Args:
+        statement (str): Import statement, or statements
+        forbidden (list): Modules that must not be imported
+
+    Returns:
+        float, list: Cumulative import time (s), forbidden modules that were imported
+    """
+    check = f"{statement}\nimport sys; print(','.join(m for m in {forbidden!r} if m in sys.modules))"
+    env = os.environ | {"PYTHONPATH": os.pathsep.join([ROOT, os.getenv("PYTHONPATH", "")])}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.splitlines()[-1])
+
+    # Lines are "import time: self [us] | cumulative | imported package", top-level imports are not indented
+    total = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith("  "):
+            total += int(cumulative)
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return total / 1e6, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=5)
+    repeats = parser.parse_args().repeats
+
+    failed = False
+    print(f"{'Entry point':<20}{'Import (s)':>12}{'Target (s)':>12}  Unneeded modules")
+    for name, (statement, target, forbidden) in ENTRY_POINTS.items():
+        try:
+            runs = [import_time(statement, forbidden) for _ in range(repeats)]
+        except RuntimeError as e:
+            print(f"{name:<20}{'failed':>12}{target:>12.2f}  {e}")
+            failed = True
+            continue
+        seconds = min(t for t, _ in runs)
+        loaded = runs[0][1]
+        failed |= seconds > target or bool(loaded)
+        print(f"{name:<20}{seconds:>12.3f}{target:>12.2f}  {' '.join(loaded) or '-'}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Listener parsers and samplers against recorded fixtures
+
+Runs the parsing and metric code of the listeners on recorded output in
+radt/run/listeners/fixtures, without the tools or devices they normally sample.
+Exits with status 1 when a check fails.
+
+Usage: python benchmarks/listeners.py
+"""
+
+import math
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from radt import constants  # noqa: E402
+from radt.run.listeners import dcgmi_listener, iostat_listener, nvml, smi_listener  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "..", "radt", "run", "listeners", "fixtures")
+
+
+class Collector:
+    def __init__(self):
+        """Sink keeping the metrics logged to it, with the time they arrived"""
+        self.logged = []
+
+    def log_metrics(self, metrics: dict, timestamp: float = None):
+        self.logged.append((time.monotonic(), metrics))
+
+
+def collect(listener, duration: float):
+    """Run the monitor loop of a listener for a while
+
+    Args:
+        listener (Listener): Listener, not started
+        duration (float): Seconds to run for
+
+    Returns:
+        list: Arrival time and metrics of every sample
+    """
+    collector = Collector()
+    listener.attach(collector)
+    threading.Thread(target=listener.monitor, daemon=True).start()
+    time.sleep(duration)
+    return list(collector.logged)
+
+
+def expect(metrics: dict, expected: dict):
+    """Compare metrics to their expected values
+
+    Args:
+        metrics (dict): Metrics
+        expected (dict): Expected metrics, a subset of the metrics
+
+    Raises:
+        AssertionError: A metric is missing or differs
+    """
+    for name, value in expected.items():
+        assert name in metrics, f"missing {name}"
+        assert math.isclose(metrics[name], value), f"{name} is {metrics[name]}, expected {value}"
+
+
+def check_iostat():
+    """Device filters and counter deltas of two recorded /proc/diskstats samples, 2s apart"""
+    fixture = os.path.join(FIXTURES, "diskstats.{}")
+
+    # Lines with too few fields (pre-2.6.25 partitions) are skipped
+    stats = iostat_listener.read_diskstats(fixture.format(0))
+    assert "sda1" not in stats and "nvme0n1p1" in stats, sorted(stats)
+
+    # Explicit include, partitions do not match it
+    listener = iostat_listener.IOstatThread(
+        "fixture", include=r"sd[a-z]+|nvme\d+n\d+", path=fixture.format(0)
+    )
+    previous = listener.sample()
+    assert sorted(previous) == ["nvme0n1", "sda"], sorted(previous)
+    listener.path = fixture.format(1)
+    current = listener.sample()
+    assert sorted(current) == ["nvme0n1", "sda", "sdb"], sorted(current)
+
+    # sdb appeared between the samples and has no delta yet
+    metrics = iostat_listener.diskstats_metrics(previous, current, 2.0)
+    assert not any(name.startswith("sdb") for name in metrics), "sdb without previous sample"
+    expect(
+        metrics,
+        {
+            "sda - tps": 75,
+            "sda - MB read/s": 5,
+            "sda - MB written/s": 1,
+            "sda - MB read": 10,
+            "sda - await ms": 500 / 150,
+            "sda - queue depth": 0.5,
+            "sda - util %": 25,
+            "nvme0n1 - tps": 500,
+            "nvme0n1 - MB read/s": 50,
+            "nvme0n1 - MB written": 0,
+            "nvme0n1 - await ms": 0.4,
+            "nvme0n1 - util %": 50,
+            "iostat - Total tps": 575,
+            "iostat - Total MB read/s": 55,
+            "iostat - Total MB written/s": 1,
+            "iostat - Total await ms": 900 / 1150,
+            "iostat - Total queue depth": 0.7,
+            "iostat - Total util %": 37.5,
+        },
+    )
+
+    # The default exclude drops RAM disks, an explicit exclude replaces it and wins over the include
+    listener = iostat_listener.IOstatThread("fixture", include=".*", path=fixture.format(0))
+    devices = sorted(listener.sample())
+    assert devices == ["loop0", "nvme0n1", "nvme0n1p1", "sda"], devices
+    listener = iostat_listener.IOstatThread(
+        "fixture", include=".*", exclude=r"loop\d+|.*p\d+", path=fixture.format(0)
+    )
+    devices = sorted(listener.sample())
+    assert devices == ["nvme0n1", "ram0", "sda"], devices
+
+
+def check_smi():
+    """Sample rate and metric names of the SMI listener on the fake NVML provider"""
+    os.environ["RADT_SMI_BACKEND"] = "fake"
+    names = [f"{{}} - {name}" for name in smi_listener.NVML_METRICS.values()]
+
+    # Requested intervals below SMI_MIN_INTERVAL are clamped
+    listener = smi_listener.SMIThread("fixture", interval=0.001, devices="0+1")
+    assert listener.interval == constants.SMI_MIN_INTERVAL, listener.interval
+    logged = collect(listener, 1.0)
+    rate = (len(logged) - 1) / (logged[-1][0] - logged[0][0]) * constants.SMI_MIN_INTERVAL
+    assert 0.7 <= rate <= 1.1, f"{rate:.2f} samples per interval"
+    expected = sorted(n.format(f"SMI {gpu}") for gpu in ("0", "1") for n in names)
+    assert sorted(logged[0][1]) == expected, sorted(logged[0][1])
+
+    # A single device keeps the original metric names
+    listener = smi_listener.SMIThread("fixture", interval=0.2, devices="0")
+    logged = collect(listener, 1.0)
+    assert 4 <= len(logged) <= 6, f"{len(logged)} samples in 1s"
+    assert sorted(logged[0][1]) == sorted(n.format("SMI") for n in names), sorted(logged[0][1])
+
+    # Queries a device does not support are logged as -1 without stopping the listener
+    listener = smi_listener.SMIThread("fixture", interval=0.2, devices="0")
+    provider = nvml.FakeNVMLProvider(unsupported=["power", "throttle"])
+    listener.make_provider = lambda: provider
+    logged = collect(listener, 0.5)
+    assert len(logged) >= 2, f"{len(logged)} samples in 0.5s"
+    expect(
+        logged[-1][1],
+        {"SMI - Power Draw": -1, "SMI - Throttle Reasons": -1, "SMI - Mem Used": 4096},
+    )
+
+
+def check_dcgmi():
+    """Ticks, names and timestamps of recorded `dcgmi dmon` output of a group of two GPUs"""
+    with open(os.path.join(FIXTURES, "dcgmi_dmon.txt")) as f:
+        lines = f.readlines()
+
+    # Two header lines, then one line per GPU every second, 10ms apart
+    arrivals = [0.0, 0.0] + [1 + i // 2 + (i % 2) / 100 for i in range(len(lines) - 2)]
+    parser = dcgmi_listener.DmonParser(dcgmi_listener.FIELD_SETS[0])
+    ticks = [tick for line, t in zip(lines, arrivals) for tick in parser.feed(line, t)]
+
+    # Ticks are stamped with the arrival of their first line, not with when they completed
+    assert [t for _, t in ticks] == [1.0, 2.0, 3.0], [t for _, t in ticks]
+    metrics = ticks[0][0]
+    assert len(metrics) == 2 * len(dcgmi_listener.FIELD_SETS[0]), len(metrics)
+    expect(
+        metrics,
+        {
+            "DCGMI GPU 0 - Power Usage": 245.812,
+            "DCGMI GPU 1 - GPU Utilization": 98,
+            "DCGMI GPU 1 - PCIE TX Throughput": 0.0,  # N/A
+            "DCGMI GPU 0 - PCIE TX Bytes": 15828901,
+            "DCGMI GPU 1 - NVlink RX Bytes": 2197740122,
+        },
+    )
+    expect(ticks[2][0], {"DCGMI GPU 1 - Power Usage": 93.017, "DCGMI GPU 0 - SN Active": 0})
+
+    # Some DCGM versions separate the # from the first column of the header
+    parser = dcgmi_listener.DmonParser(dcgmi_listener.FIELD_SETS[0])
+    spaced = [lines[0].replace("#Entity", "# Entity", 1)] + lines[1:]
+    assert spaced[0].startswith("# Entity"), spaced[0]
+    ticks = [tick for line, t in zip(spaced, arrivals) for tick in parser.feed(line, t)]
+    assert len(ticks) == 3, f"{len(ticks)} ticks"
+    assert ticks[0][0] == metrics, ticks[0]
+
+    # Registered fields extend every set but the minimal fallback, which is tried last as is
+    dcgmi_listener.register_field(1013, "Integer Active")
+    try:
+        sets = dcgmi_listener.field_sets()
+        assert all(1013 in s for s in sets[:2]), sets
+        assert sets[2:] == dcgmi_listener.FIELD_SETS, sets
+    finally:
+        dcgmi_listener.CUSTOM_FIELDS.remove(1013)
+    assert dcgmi_listener.field_sets() == dcgmi_listener.FIELD_SETS
+
+    # Groups of MIG instances are left to dmon
+    listener = dcgmi_listener.DCGMIThread("fixture", group="2", entities="i:3,i:4")
+    try:
+        listener.monitor_bindings()
+    except Exception as e:
+        assert "not GPUs" in str(e), e
+    else:
+        raise AssertionError("bindings accepted MIG entities")
+
+
+CHECKS = {
+    "iostat": check_iostat,
+    "smi": check_smi,
+    "dcgmi": check_dcgmi,
+}
+
+
+def main():
+    failed = False
+    print(f"{'Check':<12}Result")
+    for name, check in CHECKS.items():
+        try:
+            check()
+            print(f"{name:<12}ok")
+        except AssertionError as e:
+            print(f"{name:<12}failed: {e}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
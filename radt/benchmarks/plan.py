@@ -0,0 +1,118 @@
+"""Planning of experiments with blank cells and sweeps
+
+Plans small experiments the way `radt plan` does, without running or staging anything.
+Exits with status 1 when a check fails.
+
+Usage: python benchmarks/plan.py
+"""
+
+import io
+import os
+import sys
+from argparse import Namespace
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from radt.schedule import plan, sweep  # noqa: E402
+
+ARGS = Namespace(
+    rerun=False,
+    no_raw="",
+    useconda=False,
+    max_epoch=5,
+    max_time=10,
+    manual=False,
+    deadband=None,
+    heartbeat=60.0,
+    rollup="",
+    reorder=False,
+)
+
+
+def experiment(csv: str):
+    """Read an experiment the way `radt` reads a .csv
+
+    Args:
+        csv (str): Contents of the .csv
+
+    Returns:
+        pd.DataFrame: Experiment
+    """
+    df = pd.read_csv(io.StringIO(csv), delimiter=",", header=0, skipinitialspace=True)
+    df["Collocation"] = df["Collocation"].astype(str)
+    return df
+
+
+def planned(df: pd.DataFrame, reorder: bool = False):
+    """Plan an experiment
+
+    Args:
+        df (pd.DataFrame): Experiment
+        reorder (bool, optional): Run workloads with the same devices back-to-back. Defaults to False.
+
+    Returns:
+        pd.DataFrame: Plan of every run
+    """
+    args = Namespace(**vars(ARGS) | {"reorder": reorder})
+    return pd.concat(p for p, _ in plan.plan_batches(df, args, Path("<stage>")))
+
+
+def check_blank():
+    """Blank Collocation and Params cells, which pandas 3 keeps as NaN"""
+    df = experiment(
+        "Experiment,Workload,Status,Run,Devices,Collocation,Listeners,File,Params\n"
+        "1,0,,,0,,smi,a.py,\n"
+        '1,1,,,1,-,smi,a.py,"--x {1,2}"\n'
+        "1,2,,,2,,smi,a.py,--y 1\n"
+    )
+    assert list(sweep.is_sweep(df)) == [False, True, False], list(sweep.is_sweep(df))
+
+    for reorder in (False, True):
+        runs = planned(df, reorder)
+        assert len(runs) == 4, runs
+        first = runs.loc[0]
+        assert first["Params"] == "" and first["Letter"] == "0", first[["Params", "Letter"]]
+        assert "params=" in first["Command"] and '-p ""' in first["MLproject"], first["MLproject"]
+        assert sorted(runs["Params"]) == ["", "--x 1", "--x 2", "--y 1"], list(runs["Params"])
+
+
+def check_sweep():
+    """Sweeps expand into one configuration per combination, planned in batches"""
+    df = experiment(
+        "Experiment,Workload,Status,Run,Devices,Collocation,Listeners,File,Params\n"
+        '1,0,,,"{0,1}",-,smi,a.py,"--bs {64..256..64} --model {a,b}"\n'
+    )
+    batches = list(sweep.expand(df, 3))
+    assert [len(b) for b in batches] == [3, 3, 3, 3, 3, 1], [len(b) for b in batches]
+    configs = pd.concat(batches)
+    assert configs["Config"].is_unique and (configs["Sweep"] == 16).all(), configs
+
+    runs = planned(df)
+    assert len(runs) == 16 and runs["Workload_Unique"].is_unique, runs
+    assert set(runs["Letter"]) == {"0", "1"}, set(runs["Letter"])
+
+
+CHECKS = {
+    "blank": check_blank,
+    "sweep": check_sweep,
+}
+
+
+def main():
+    failed = False
+    print(f"{'Check':<12}Result")
+    for name, check in CHECKS.items():
+        try:
+            check()
+            print(f"{name:<12}ok")
+        except AssertionError as e:
+            print(f"{name:<12}failed: {e}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
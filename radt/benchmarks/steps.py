@@ -0,0 +1,108 @@
+"""Step and phase timing of the RADTBenchmark context
+
+Times phases of a StepTimer nested and from several threads, against a sink that keeps
+the reports in memory. Exits with status 1 when a check fails.
+
+Usage: python benchmarks/steps.py
+"""
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from radt.run.steps import StepTimer  # noqa: E402
+
+
+class Collector:
+    def __init__(self):
+        """Sink keeping the metrics logged to it"""
+        self.logged = []
+
+    def log_metrics(self, metrics: dict, timestamp: float = None, step: int = 0):
+        self.logged.append(metrics)
+
+
+def elapsed(timer: StepTimer, name: str):
+    """Seconds recorded for a phase in the current window
+
+    Args:
+        timer (StepTimer): Timer
+        name (str): Phase name
+
+    Returns:
+        float: Seconds
+    """
+    return timer.phases.get(name, 0) / 1e9
+
+
+def check_nested():
+    """A phase nested in a phase of the same name, both are timed in full"""
+    timer = StepTimer(Collector(), 10)
+    with timer.phase("forward"):
+        time.sleep(0.05)
+        with timer.phase("forward"):
+            time.sleep(0.05)
+    # 0.1s of the outer phase and 0.05s of the inner one
+    assert 0.15 <= elapsed(timer, "forward") < 0.2, f"{elapsed(timer, 'forward'):.3f}s"
+    timer.close()
+
+
+def check_threads():
+    """Overlapping phases of the same name in several threads"""
+    timer = StepTimer(Collector(), 10)
+
+    def load(delay: float):
+        time.sleep(delay)
+        with timer.phase("dataload"):
+            time.sleep(0.1)
+
+    threads = [threading.Thread(target=load, args=(i * 0.03,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert 0.3 <= elapsed(timer, "dataload") < 0.35, f"{elapsed(timer, 'dataload'):.3f}s"
+    timer.close()
+
+
+def check_report():
+    """Phase shares of a window of steps"""
+    sink = Collector()
+    timer = StepTimer(sink, 4)
+    timer.step()
+    for _ in range(4):
+        with timer.phase("forward"):
+            time.sleep(0.01)
+        time.sleep(0.01)
+        timer.step(batch_size=8)
+    timer.close()
+    assert len(sink.logged) == 1, sink.logged
+    share = sink.logged[0]["RADT - steps/phase forward share"]
+    assert 0.4 <= share <= 0.6, f"forward share {share:.2f}"
+
+
+CHECKS = {
+    "nested": check_nested,
+    "threads": check_threads,
+    "report": check_report,
+}
+
+
+def main():
+    failed = False
+    print(f"{'Check':<12}Result")
+    for name, check in CHECKS.items():
+        try:
+            check()
+            print(f"{name:<12}ok")
+        except AssertionError as e:
+            print(f"{name:<12}failed: {e}")
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,20 @@
-import numpy as np
-
 COLOURS = [31, 32, 34, 35, 36, 33]
 
-CSV_FORMAT = np.dtype(
-    [
-        ("Experiment", int),
-        ("Workload", int),
-        ("Status", str),
-        ("Run", str),
-        ("Devices", str),
-        ("Collocation", str),
-        ("Listeners", str),
-        ("File", str),
-        ("Params", str),
-    ]
-)
+# Columns of an experiment CSV, a numpy dtype specification
+CSV_FORMAT = [
+    ("Experiment", int),
+    ("Workload", int),
+    ("Status", str),
+    ("Run", str),
+    ("Devices", str),
+    ("Collocation", str),
+    ("Listeners", str),
+    ("File", str),
+    ("Params", str),
+]
 
 COMMAND = (
-    "mlflow run {Filepath} --env-manager={Envmanager} "
+    "mlflow run {Stagepath} --env-manager={Envmanager} "
     "-P letter={Letter} "
     "-P workload={Workload} "
     "-P listeners={Listeners} "
@@ -54,5 +51,59 @@ entry_points:
 """
 
 MLFLOW_COMMAND = (
-    '''{WorkloadListener}python -m radt run -l {Listeners} -c {File} -p "{Params}"'''
+    '''cd "{Workdir}" && {WorkloadListener}python -m radt run -l {Listeners} -c {File} -p "{Params}"'''
 )
+
+# Metric sink defaults, overridable via RADT_SINK_* environment variables
+SINK_BATCH_SIZE = 500
+SINK_MAX_BATCH_SIZE = 1000  # MLFlow limit for log_batch
+SINK_FLUSH_INTERVAL = 5.0
+SINK_QUEUE_SIZE = 100000
+SINK_POLICY = "drop"
+SINK_FLUSH_TIMEOUT = 30.0  # Seconds to wait for listeners to flush on exit
+
+# Device filters for the iostat listener (regex), overridable via RADT_IOSTAT_INCLUDE/EXCLUDE
+IOSTAT_INCLUDE = ""
+IOSTAT_EXCLUDE = r"(ram|zram)\d+"
+
+# GPU sampling backend for the SMI listener: auto (NVML, falling back to nvidia-smi), nvml, smi or fake
+SMI_BACKEND = "auto"
+SMI_MIN_INTERVAL = 0.05
+
+# Shortest delay supported by dcgmi dmon
+DCGMI_MIN_INTERVAL = 0.1
+
+# Seconds between reports of the listeners' own CPU and memory usage
+OVERHEAD_INTERVAL = 10.0
+
+# Rollup windows in seconds separated by +, e.g. "10+60", overridable via RADT_ROLLUP. Disabled when empty.
+ROLLUP = ""
+
+# Default seconds between listener samples, overridable per listener via RADT_LISTENER_<NAME>_INTERVAL
+LISTENER_INTERVAL = 1.0
+# Maximum seconds between logged values of an unchanged metric when a dead-band is set
+HEARTBEAT = 60.0
+
+# Local metric journals awaiting upload, overridable via RADT_JOURNAL_DIR
+JOURNAL_DIR = "~/.radt/journal"
+SINK_MAX_BACKOFF = 60.0
+
+# Steps aggregated per report of run.step(), overridable via RADT_STEP_WINDOW
+STEP_WINDOW = 100
+
+# Cached environment snapshots (pip, conda, nvidia-smi), overridable via RADT_SNAPSHOT_DIR
+SNAPSHOT_DIR = "~/.radt/snapshots"
+
+# Run log spooling, overridable via RADT_LOG_ROTATE_BYTES and RADT_LOG_ROTATE_INTERVAL
+LOG_ROTATE_BYTES = 16 * 1024**2
+LOG_ROTATE_INTERVAL = 300.0  # Seconds after which a log chunk is uploaded, even if small
+LOG_ROTATE_CHECK = 1.0  # Seconds between checks of the uploader for chunks to rotate by age
+
+# Seconds between regenerations of an experiment CSV from its state journal, overridable via RADT_STATE_EXPORT_INTERVAL
+STATE_EXPORT_INTERVAL = 300.0
+
+# Pending workloads the concurrent scheduler looks ahead at, overridable via RADT_SCHEDULE_WINDOW
+SCHEDULE_WINDOW = 64
+
+# Runs planned at once when expanding sweeps, and per batch written by `radt plan`
+PLAN_CHUNK_SIZE = 10000
@@ -0,0 +1 @@
+from .overhead import start_overhead
@@ -0,0 +1,167 @@
+"""Benchmark the overhead of radT listeners on a synthetic CPU-bound workload"""
+
+import os
+import statistics
+import tempfile
+import time
+from argparse import Namespace
+from multiprocessing import Pool
+
+from mlflow.tracking import MlflowClient
+
+from .. import constants
+from ..run.listeners import (
+    dcgmi_listener,
+    iostat_listener,
+    parse_listener,
+    proc,
+    ps_listener,
+    smi_listener,
+    top_listener,
+)
+from ..run.listeners.listener import ListenerHost
+
+LISTENERS = {
+    "ps": ps_listener.PSThread,
+    "smi": smi_listener.SMIThread,
+    "dcgmi": dcgmi_listener.DCGMIThread,
+    "top": top_listener.TOPThread,
+    "iostat": iostat_listener.IOstatThread,
+}
+
+# Two-sided 95% t-values by degrees of freedom, normal approximation beyond
+T_VALUES = {
+    1: 12.71, 2: 4.30, 3: 3.18, 4: 2.78, 5: 2.57, 6: 2.45, 7: 2.36, 8: 2.31, 9: 2.26, 10: 2.23,
+    11: 2.20, 12: 2.18, 13: 2.16, 14: 2.14, 15: 2.13, 16: 2.12, 17: 2.11, 18: 2.10, 19: 2.09,
+    20: 2.09, 21: 2.08, 22: 2.07, 23: 2.07, 24: 2.06, 25: 2.06, 26: 2.06, 27: 2.05, 28: 2.05,
+    29: 2.05, 30: 2.04, 40: 2.02, 60: 2.00, 120: 1.98,
+}  # fmt: skip
+
+
+def t_value(df: int):
+    """Two-sided 95% t-value, rounded towards fewer degrees of freedom between tabulated values
+
+    Args:
+        df (int): Degrees of freedom
+
+    Returns:
+        float: t-value
+    """
+    tabulated = [d for d in T_VALUES if d <= df]
+    if df > max(T_VALUES):
+        return 1.96
+    return T_VALUES[max(tabulated)]
+
+
+def synthetic_workload(duration: float):
+    """CPU-bound workload
+
+    Args:
+        duration (float): Seconds to run for
+
+    Returns:
+        float: Iterations per second
+    """
+    iterations = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        sum(i * i for i in range(1000))
+        iterations += 1
+    return iterations / duration
+
+
+def confidence_interval(samples: list):
+    """Mean and half-width of the 95% confidence interval
+
+    Args:
+        samples (list): Samples
+
+    Returns:
+        float, float: Mean, half-width
+    """
+    mean = statistics.mean(samples)
+    if len(samples) < 2:
+        return mean, float("nan")
+    df = len(samples) - 1
+    return mean, t_value(df) * statistics.stdev(samples) / len(samples) ** 0.5
+
+
+def run_trial(pool: Pool, jobs: int, duration: float, listener_set: str, run_id: str):
+    """Measure workload throughput with a set of listeners running
+
+    Args:
+        pool (Pool): Workload processes
+        jobs (int): Number of workload processes
+        duration (float): Seconds per trial
+        listener_set (str): Listeners separated by +, or "none"
+        run_id (str): Run to log listener metrics to
+
+    Returns:
+        float, float: Throughput (iterations/s), listener CPU time (s)
+    """
+    host = None
+    if listener_set != "none":
+        listeners = []
+        for entry in listener_set.split("+"):
+            name, interval, _ = parse_listener(entry)
+            listeners.append(
+                LISTENERS[name](run_id, interval=float(interval) if interval else None)
+            )
+        host = ListenerHost(run_id, listeners)
+        host.start()
+        # Let listeners reach their steady state
+        time.sleep(1)
+        cpu_start = proc.read_stat(f"/proc/{host.pid}/stat")["jiffies"]
+
+    throughput = sum(pool.map(synthetic_workload, [duration] * jobs))
+
+    cpu = 0.0
+    if host:
+        cpu = (proc.read_stat(f"/proc/{host.pid}/stat")["jiffies"] - cpu_start) / proc.CLOCK_TICKS
+        host.terminate()
+        host.join(constants.SINK_FLUSH_TIMEOUT)
+    return throughput, cpu
+
+
+def start_overhead(parsed_args: Namespace):
+    """Compare workload throughput with and without each listener set
+
+    Args:
+        parsed_args (Namespace): Overhead arguments
+    """
+    listener_sets = ["none"] + parsed_args.listener_sets
+
+    # Log to a throwaway local store unless a tracking server is given
+    tmp = tempfile.TemporaryDirectory(prefix="radt-overhead-")
+    os.environ["MLFLOW_TRACKING_URI"] = parsed_args.tracking_uri or f"file://{tmp.name}/mlruns"
+    os.environ["RADT_JOURNAL_DIR"] = f"{tmp.name}/journal"
+    client = MlflowClient()
+    run_id = client.create_run(client.get_experiment_by_name("Default").experiment_id).info.run_id
+
+    results = {s: ([], []) for s in listener_sets}
+    with Pool(parsed_args.jobs) as pool:
+        # Interleave listener sets so drift affects all of them equally
+        for trial in range(parsed_args.trials):
+            for listener_set in listener_sets:
+                throughput, cpu = run_trial(
+                    pool, parsed_args.jobs, parsed_args.duration, listener_set, run_id
+                )
+                results[listener_set][0].append(throughput)
+                results[listener_set][1].append(cpu / parsed_args.duration)
+                print(f"Trial {trial + 1}/{parsed_args.trials} {listener_set}: {throughput:.1f} it/s")
+
+    client.set_terminated(run_id)
+    tmp.cleanup()
+
+    base, base_ci = confidence_interval(results["none"][0])
+    print()
+    print(f"{'Listeners':<30}{'Throughput (it/s)':>24}{'Delta (%)':>20}{'Listener CPU (%)':>20}")
+    for listener_set, (throughputs, cpus) in results.items():
+        mean, ci = confidence_interval(throughputs)
+        # Standard errors of independent means add in quadrature
+        delta = 100 * (mean - base) / base
+        delta_ci = 100 * (ci**2 + base_ci**2) ** 0.5 / base
+        print(
+            f"{listener_set:<30}{f'{mean:.1f} ± {ci:.1f}':>24}"
+            f"{f'{delta:+.2f} ± {delta_ci:.2f}':>20}{100 * statistics.mean(cpus):>20.2f}"
+        )
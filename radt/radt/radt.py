@@ -1,33 +1,47 @@
 import argparse
+import os
 import sys
 from pathlib import Path
 
 from . import constants
-from .run import start_run
-from .schedule import start_schedule
+from .run.listeners import parse_listener
 
+# Subcommands are imported once their arguments are parsed, so each only loads what it needs
+# and --help or invalid arguments do not load anything
 
-def schedule_split_arguments():
+
+def schedule_split_arguments(sysargs: list = None):
     """Split arguments for `radt` into parsed arguments and passthrough arguments
 
+    Args:
+        sysargs (list, optional): Raw arguments. Defaults to sys.argv[1:].
+
     Returns:
         list, Path, list: Split arguments
     """
-    sysargs = sys.argv[1:]
+    if sysargs is None:
+        sysargs = sys.argv[1:]
 
     for i, arg in enumerate(sysargs):
+        if i and sysargs[i - 1] in ("-o", "--output"):
+            # Output file of `radt plan`
+            continue
         if arg.strip()[-3:] == ".py" or arg.strip()[-4:] == ".csv":
             return sysargs[:i], Path(arg), sysargs[i + 1 :]
     else:
+        if "-h" in sysargs or "--help" in sysargs:
+            # Leave printing the usage to argparse
+            return sysargs, None, []
         print("Please supply a python or csv file.")
         exit()
 
 
-def schedule_parse_arguments(args: list):
-    """Argparse for `radt`
+def schedule_parse_arguments(args: list, plan: bool = False):
+    """Argparse for `radt` and `radt plan`
 
     Args:
         args (list): List of raw arguments
+        plan (bool, optional): Parse arguments for `radt plan`. Defaults to False.
 
     Returns:
         argparse.Namespace: Parsed arguments
@@ -35,6 +49,15 @@ def schedule_parse_arguments(args: list):
     parser = argparse.ArgumentParser(
         description="RADt Automatic Tracking and Benchmarking"
     )
+    if plan:
+        parser.add_argument(
+            "-o",
+            "--output",
+            type=Path,
+            dest="output",
+            default=None,
+            help="Export the full plan as .csv instead of printing a summary",
+        )
     parser.add_argument(
         "-e",
         "--experiment",
@@ -68,7 +91,7 @@ def schedule_parse_arguments(args: list):
         type=str,
         dest="listeners",
         default="smi+top+dcgmi",
-        help=f"Metric collectors separated by +, available: {' '.join(constants.RUN_LISTENERS + list(constants.WORKLOAD_LISTENERS.keys()))}",
+        help=f"Metric collectors separated by +, optionally with a sampling interval and dead-band as name:interval:deadband, available: {' '.join(constants.RUN_LISTENERS + list(constants.WORKLOAD_LISTENERS.keys()))}",
     )
     parser.add_argument(
         "-r",
@@ -115,6 +138,55 @@ def schedule_parse_arguments(args: list):
         default=False,
         help="Only start tracking run when context is initialised",
     )
+    parser.add_argument(
+        "--deadband",
+        type=float,
+        dest="deadband",
+        default=None,
+        help="Only log listener metrics that changed by more than this fraction, 0 logs any change",
+    )
+    parser.add_argument(
+        "--heartbeat",
+        type=float,
+        dest="heartbeat",
+        default=constants.HEARTBEAT,
+        help="Maximum seconds between logged values of unchanged metrics when using --deadband",
+    )
+    parser.add_argument(
+        "--rollup",
+        type=str,
+        dest="rollup",
+        default=constants.ROLLUP,
+        help="Log min/max/mean/p95/count of listener metrics over windows of these lengths in seconds separated by +, e.g. 10+60",
+    )
+    parser.add_argument(
+        "--no-raw",
+        type=str,
+        dest="no_raw",
+        default="",
+        help="Listeners separated by + that only log rollups and no raw samples, requires --rollup",
+    )
+    parser.add_argument(
+        "--no-daemon",
+        action="store_false",
+        dest="daemon",
+        default=True,
+        help="Let every run sample machine-wide metrics itself instead of sharing a node-wide sampling daemon",
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        dest="concurrent",
+        default=False,
+        help="Run workloads of a .csv that claim different devices at the same time",
+    )
+    parser.add_argument(
+        "--reorder",
+        action="store_true",
+        dest="reorder",
+        default=False,
+        help="Run workloads of a .csv with the same devices and collocation back-to-back to reuse their setup",
+    )
 
     return parser.parse_args(args)
 
@@ -149,6 +221,57 @@ def run_parse_arguments(args: list):
     return parser.parse_args(args)
 
 
+def overhead_parse_arguments(args: list):
+    """Argparse for `radt overhead`
+
+    Args:
+        args (list): List of raw arguments
+
+    Returns:
+        argparse.Namespace: Parsed arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="RADt overhead benchmark, compares the throughput of a synthetic workload with and without listeners"
+    )
+    parser.add_argument(
+        "-l",
+        "--listeners",
+        type=str,
+        nargs="+",
+        dest="listener_sets",
+        default=["ps", "top", "iostat", "smi", "ps+top+iostat+smi"],
+        help=f"Listener sets to compare, each separated by +, available: {' '.join(constants.RUN_LISTENERS)}",
+    )
+    parser.add_argument(
+        "-n", "--trials", type=int, dest="trials", default=5, help="Trials per listener set"
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        dest="duration",
+        default=10.0,
+        help="Seconds per trial",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        dest="jobs",
+        default=os.cpu_count(),
+        help="Number of workload processes",
+    )
+    parser.add_argument(
+        "--tracking-uri",
+        type=str,
+        dest="tracking_uri",
+        default=None,
+        help="Tracking server to upload listener metrics to, a temporary local store by default",
+    )
+
+    return parser.parse_args(args)
+
+
 def check_run_listeners(l):
     """Check whether all run listeners are registered
 
@@ -161,7 +284,7 @@ def check_run_listeners(l):
     if len(l) == 1 and l[0] == "none":
         return
     for entry in l:
-        if entry not in constants.RUN_LISTENERS:
+        if parse_listener(entry)[0] not in constants.RUN_LISTENERS:
             raise Exception(f"Unavailable listener: {entry}")
 
 
@@ -169,19 +292,70 @@ def cli_schedule():
     args, file, args_passthrough = schedule_split_arguments()
     parsed_args = schedule_parse_arguments(args)
 
+    from .schedule import start_schedule
+
     start_schedule(parsed_args, file, args_passthrough)
 
 
+def cli_plan():
+    args, file, args_passthrough = schedule_split_arguments(sys.argv[2:])
+    parsed_args = schedule_parse_arguments(args, plan=True)
+
+    from .schedule import start_plan
+
+    start_plan(parsed_args, file, args_passthrough)
+
+
 def cli_run():
     args = run_parse_arguments(sys.argv[2:])
     listeners = args.listeners.lower().split("+")
     check_run_listeners(listeners)
+
+    from .run import start_run
+
     start_run(args, listeners)
 
 
+def cli_overhead():
+    args = overhead_parse_arguments(sys.argv[2:])
+    for listener_set in args.listener_sets:
+        check_run_listeners(listener_set.lower().split("+"))
+
+    from .overhead import start_overhead
+
+    start_overhead(args)
+
+
+def cli_sync():
+    from .run.journal import sync
+
+    synced, failed = sync()
+    print(f"Synced {synced} metric journals, {failed} failed.")
+    if failed:
+        exit(1)
+
+
+def cli_export():
+    from .schedule.state import export
+
+    if len(sys.argv) < 3 or Path(sys.argv[2]).suffix != ".csv":
+        print("Please supply a csv file.")
+        exit(1)
+    restored = export(Path(sys.argv[2]))
+    print(f"Restored {restored} rows from the journal.")
+
+
 def cli():
-    """Entrypoint for `radt` and `radt run`"""
+    """Entrypoint for `radt`, `radt run`, `radt plan`, `radt sync`, `radt export` and `radt overhead`"""
     if sys.argv[1].strip() == "run":
         cli_run()
+    elif sys.argv[1].strip() == "plan":
+        cli_plan()
+    elif sys.argv[1].strip() == "sync":
+        cli_sync()
+    elif sys.argv[1].strip() == "export":
+        cli_export()
+    elif sys.argv[1].strip() == "overhead":
+        cli_overhead()
     else:
         cli_schedule()
@@ -1,2 +1,11 @@
-from .run import start_run
-from .benchmark import RADTBenchmark
+def __getattr__(name):
+    """Import the runner and RADTBenchmark on first use, both load mlflow"""
+    if name == "start_run":
+        from .run import start_run
+
+        return start_run
+    if name == "RADTBenchmark":
+        from .benchmark import RADTBenchmark
+
+        return RADTBenchmark
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,125 +1,143 @@
 import os
 import sys
+import threading
 import types
-from time import time
-from subprocess import PIPE, Popen
+from contextlib import nullcontext
+from time import perf_counter, time
 import mlflow
 
+from .. import constants
 from .listeners import dcgmi_listener, ps_listener, smi_listener, top_listener, iostat_listener
+from .listeners import daemon
+from .listeners.listener import ListenerHost
+from .sink import MetricSink
+from . import snapshot
+from .steps import StepTimer
+
+NULL_PHASE = nullcontext()
 
 
 def dummy(*args, **kwargs):
     return
 
 
-def execute_command(cmd: str):
-    """Execute a command
-
-    Args:
-        cmd (str or list): Command to run
-
-    Returns:
-        str: stdout output of the command
-    """
-
-    if isinstance(cmd, str):
-        cmd = cmd.split()
-
-    env = os.environ.copy()
-
-    result = []
-    with Popen(cmd, stdout=PIPE, bufsize=1, universal_newlines=True, env=env) as p:
-        result.extend(p.stdout)
-
-        if p.returncode != 0:
-            pass
-
-    return result
+def dummy_phase(*args, **kwargs):
+    return NULL_PHASE
 
 
 class RADTBenchmark:
+    def __new__(cls):
+        # Decide once whether RADT has been loaded, untracked runs get a class of no-ops
+        if cls is RADTBenchmark and "RADT_MAX_EPOCH" not in os.environ:
+            cls = DisabledBenchmark
+        return super().__new__(cls)
+
     def __init__(self):
         """
         Context manager for a run.
         Will track ML operations while active.
         """
-        if "RADT_MAX_EPOCH" not in os.environ:
-            return
-
         try:
             run = mlflow.start_run(run_id=os.getenv("RADT_RUN_ID"))
         except Exception as e:
             run = mlflow.active_run()
         self.run_id = run.info.run_id
 
-        # Capture (package) versions for pip, conda, smi
-        try:
-            self.log_text("".join(execute_command("pip freeze")), "pip.txt")
-        except FileNotFoundError as e:
-            pass
-
-        try:
-            self.log_text("".join(execute_command("conda list")), "conda.txt")
-        except FileNotFoundError as e:
-            pass
-
-        try:
-            self.log_text("".join(execute_command("nvidia-smi")), "smi.txt")
-        except FileNotFoundError as e:
-            pass
-
     def __dir__(self):
         return dir(super()) + dir(mlflow)
 
-    def __getattribute__(self, name):
-        """Get attribute, overwrites methods and functions
-        if RADT has not been loaded"""
-        try:
-            att = super().__getattribute__(name)
-        except AttributeError:
-            att = getattr(mlflow, name)
-
-        if "RADT_MAX_EPOCH" not in os.environ:
-            if isinstance(att, types.MethodType) or isinstance(att, types.FunctionType):
-                return dummy
-        return att
+    def __getattr__(self, name):
+        """Pass through to mlflow attributes missing from the table below, e.g. flavor modules
+        imported later. Only called when regular lookup fails."""
+        return getattr(mlflow, name)
 
     def __enter__(self):
-        if "RADT_MAX_EPOCH" not in os.environ:
-            return self
-
         self.threads = []
         self.max_epoch = int(os.getenv("RADT_MAX_EPOCH"))
         self.max_time = time() + int(os.getenv("RADT_MAX_TIME"))
 
-        # Spawn threads for listeners
+        # Collect listeners enabled for this run
+        listeners = []
         if os.getenv("RADT_LISTENER_PS") == "True":
             os.environ["RADT_LISTENER_PS"] = "False"
-            self.threads.append(ps_listener.PSThread(self.run_id))
+            listeners.append(ps_listener.PSThread(self.run_id))
         if os.getenv("RADT_LISTENER_SMI") == "True":
             os.environ["RADT_LISTENER_SMI"] = "False"
-            self.threads.append(smi_listener.SMIThread(self.run_id))
+            listeners.append(smi_listener.SMIThread(self.run_id))
         if os.getenv("RADT_LISTENER_DCGMI") == "True":
             os.environ["RADT_LISTENER_DCGMI"] = "False"
-            self.threads.append(dcgmi_listener.DCGMIThread(self.run_id))
+            listeners.append(dcgmi_listener.DCGMIThread(self.run_id))
         if os.getenv("RADT_LISTENER_TOP") == "True":
             os.environ["RADT_LISTENER_TOP"] = "False"
-            self.threads.append(top_listener.TOPThread(self.run_id))
+            listeners.append(top_listener.TOPThread(self.run_id))
         if os.getenv("RADT_LISTENER_IOSTAT") == "True":
             os.environ["RADT_LISTENER_IOSTAT"] = "False"
-            self.threads.append(iostat_listener.IOstatThread(self.run_id))
-
+            listeners.append(iostat_listener.IOstatThread(self.run_id))
+
+        # Machine-wide listeners are served by the node's sampling daemon when available
+        self.subscription = None
+        if path := os.getenv("RADT_DAEMON_SOCKET"):
+            scopes = daemon.shared_scopes(listeners)
+            if scopes and (conn := daemon.subscribe(path, self.run_id, list(scopes))):
+                self.subscription = conn
+                listeners = [l for l in listeners if l not in scopes.values()]
+
+        # Host all listeners in a single process, unless separate processes are requested
+        if os.getenv("RADT_LISTENER_HOST", "True") == "True":
+            if listeners:
+                self.threads.append(ListenerHost(self.run_id, listeners))
+        else:
+            self.threads.extend(listeners)
+
+        # Listener processes are forked before this process starts any threads of its own, locks
+        # held by threads at the time of the fork would stay locked in the listeners
         for thread in self.threads:
             thread.start()
 
+        # Metrics logged by the workload are journaled locally and uploaded in the background
+        self.sink = MetricSink(self.run_id, policy="block")
+        self.log_calls = 0
+        self.log_time = 0.0
+        self.timer = StepTimer(
+            self.sink, int(os.getenv("RADT_STEP_WINDOW") or constants.STEP_WINDOW)
+        )
+
+        # Capture (package) versions for pip, conda, smi in the background, cached per environment
+        self.snapshot = threading.Thread(
+            target=snapshot.capture, args=(self.sink.client, self.run_id), daemon=True
+        )
+        self.snapshot.start()
+
         return self
 
     def __exit__(self, type, value, traceback):
         # Terminate listeners and run
-        if "RADT_MAX_EPOCH" not in os.environ:
-            return
         for thread in self.threads:
             thread.terminate()
+
+        # Listeners flush their metric sink on termination, wait for the uploads to finish
+        for thread in self.threads:
+            thread.join(constants.SINK_FLUSH_TIMEOUT)
+            if thread.is_alive():
+                thread.kill()
+        if self.subscription:
+            daemon.unsubscribe(self.subscription, constants.SINK_FLUSH_TIMEOUT)
+
+        self.timer.close()
+
+        # Overhead of the run wrapper within the training process
+        overhead = {
+            "RADT - overhead/run log calls": self.log_calls,
+            "RADT - overhead/run log time ms": 1000 * self.log_time,
+            "RADT - overhead/run sink CPU time s": self.sink.cpu_time(),
+        }
+        if self.sink.uploads:
+            overhead["RADT - overhead/run upload latency ms"] = (
+                1000 * self.sink.upload_time / self.sink.uploads
+            )
+        self.sink.log_metrics(overhead)
+        self.sink.close()
+        self.snapshot.join(constants.SINK_FLUSH_TIMEOUT)
         mlflow.end_run()
 
     def log_metric(self, name, value, epoch=0):
@@ -134,9 +152,10 @@ class RADTBenchmark:
         :param epoch: Integer training step (epoch) at which was the metric calculated.
                      Defaults to 0.
         """
-        if "RADT_MAX_EPOCH" not in os.environ:
-            return
-        mlflow.log_metric(name, value, epoch)
+        started = perf_counter()
+        self.sink.log_metric(name, value, step=epoch)
+        self.log_time += perf_counter() - started
+        self.log_calls += 1
         if epoch >= self.max_epoch or time() > self.max_time:
             print("Maximum epoch reached")
             sys.exit()
@@ -149,9 +168,66 @@ class RADTBenchmark:
         :param epoch: Integer training step (epoch) at which was the metric calculated.
                      Defaults to 0.
         """
-        if "RADT_MAX_EPOCH" not in os.environ:
-            return
-        mlflow.log_metrics(metrics, epoch)
+        started = perf_counter()
+        self.sink.log_metrics(metrics, step=epoch)
+        self.log_time += perf_counter() - started
+        self.log_calls += 1
         if epoch >= self.max_epoch or time() > self.max_time:
             print("Maximum epoch reached")
             sys.exit()
+
+    def step(self, batch_size=0):
+        """
+        Mark the end of a training step. Throughput, step time percentiles and the share of
+        every phase are logged every RADT_STEP_WINDOW steps.
+
+        :param batch_size: Number of samples processed in the step. Defaults to 0.
+        """
+        self.timer.step(batch_size)
+
+    def phase(self, name):
+        """
+        Time a phase of the current step, e.g. ``with run.phase("dataload"):``.
+
+        :param name: Phase name (string).
+        :return: Context manager
+        """
+        return self.timer.phase(name)
+
+
+class DisabledBenchmark(RADTBenchmark):
+    def __init__(self):
+        """
+        RADTBenchmark when RADT has not been loaded.
+        Every method and mlflow function is a no-op.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return
+
+    def __getattr__(self, name):
+        att = getattr(mlflow, name)
+        if isinstance(att, (types.FunctionType, types.MethodType)):
+            return dummy
+        return att
+
+
+for name, att in list(vars(RADTBenchmark).items()):
+    if isinstance(att, types.FunctionType) and not name.startswith("_"):
+        setattr(DisabledBenchmark, name, dummy)
+DisabledBenchmark.phase = dummy_phase
+
+# Pass through to mlflow for everything not defined here. The table is resolved once, so
+# attribute lookups are regular class lookups in both tracked and untracked runs. Attributes
+# that appear on mlflow later are resolved by __getattr__.
+for name, att in list(vars(mlflow).items()):
+    if name.startswith("_") or hasattr(RADTBenchmark, name):
+        continue
+    if isinstance(att, types.FunctionType):
+        setattr(RADTBenchmark, name, staticmethod(att))
+        setattr(DisabledBenchmark, name, dummy)
+    else:
+        setattr(RADTBenchmark, name, att)
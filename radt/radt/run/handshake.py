@@ -0,0 +1,135 @@
+"""Launch handshake between the scheduler and the runs of a workload"""
+
+import json
+import os
+import socket
+import threading
+
+
+def register(path: str, letter: str, run_id: str):
+    """Report a run as ready and block until the scheduler releases the workload
+
+    Args:
+        path (str): Path of the scheduler's launch socket
+        letter (str): Letter of the run within the workload
+        run_id (str): MLFlow run id
+    """
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(path)
+        conn.sendall((json.dumps({"letter": letter, "run_id": run_id}) + "\n").encode())
+        # Released by a single byte, or by the scheduler closing the socket
+        conn.recv(1)
+    except OSError as e:
+        print(f"Launch handshake failed, starting immediately ({e})")
+    finally:
+        conn.close()
+
+
+class LaunchBarrier:
+    def __init__(self, path: str):
+        """
+        Collects the run ids of a workload's runs as they become ready and releases them at once.
+        Runs connect to a unix socket, report their id and block until released.
+        The barrier is readable (see fileno) whenever a run registers, for use with selectors.
+
+        Args:
+            path (str): Path of the unix socket to listen on
+        """
+        self.path = path
+        self.runs = {}
+        self.condition = threading.Condition()
+        self.wake_r, self.wake_w = os.pipe()
+        os.set_blocking(self.wake_r, False)
+
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(path)
+        self.server.listen()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def fileno(self):
+        """File descriptor that becomes readable when a run registers, drained by `clear`"""
+        return self.wake_r
+
+    def clear(self):
+        """Drain the notifications of registered runs"""
+        try:
+            while os.read(self.wake_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._register, args=(conn,), daemon=True).start()
+
+    def _register(self, conn: socket.socket):
+        try:
+            request = json.loads(conn.makefile("r").readline())
+        except (OSError, ValueError):
+            conn.close()
+            return
+        with self.condition:
+            self.runs[request["letter"]] = (request["run_id"], conn)
+            self.condition.notify_all()
+        try:
+            os.write(self.wake_w, b"\0")
+        except OSError:
+            # Closed while registering
+            pass
+
+    def wait(self, letters: list, timeout: float = None):
+        """Wait until runs have registered
+
+        Args:
+            letters (list): Letters of the runs to wait for
+            timeout (float, optional): Maximum seconds to wait. Defaults to None.
+
+        Returns:
+            bool: Whether all runs registered
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: all(l in self.runs for l in letters), timeout
+            )
+
+    def run_id(self, letter: str):
+        """Get the run id a run registered with
+
+        Args:
+            letter (str): Letter of the run
+
+        Returns:
+            str: Run id, None if the run has not registered
+        """
+        with self.condition:
+            return self.runs[letter][0] if letter in self.runs else None
+
+    def release(self):
+        """Release all registered runs"""
+        with self.condition:
+            for _, conn in self.runs.values():
+                try:
+                    conn.sendall(b"\n")
+                except OSError:
+                    pass
+                conn.close()
+
+    def close(self):
+        """Stop accepting runs, runs still waiting are released"""
+        self.server.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.release()
+        os.close(self.wake_r)
+        os.close(self.wake_w)
@@ -0,0 +1,178 @@
+"""Append-only local journal of metrics awaiting upload to the tracking server"""
+
+import os
+import sqlite3
+import uuid
+from pathlib import Path
+from time import perf_counter
+
+from mlflow.entities import Metric
+from mlflow.tracking import MlflowClient
+
+from .. import constants
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS metrics (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    value REAL,
+    timestamp INTEGER NOT NULL,
+    step INTEGER NOT NULL
+);
+"""
+
+
+def journal_dir():
+    """Get the directory holding metric journals
+
+    Returns:
+        Path: Journal directory, RADT_JOURNAL_DIR or JOURNAL_DIR
+    """
+    return Path(os.getenv("RADT_JOURNAL_DIR") or constants.JOURNAL_DIR).expanduser()
+
+
+class MetricJournal:
+    def __init__(self, path: Path, run_id: str = None, tracking_uri: str = None):
+        """
+        SQLite journal of metrics for a single run.
+        Every connection is bound to the thread that opened it; open one journal per thread.
+
+        Args:
+            path (Path): Journal file
+            run_id (str, optional): Run the metrics belong to, required when creating a journal.
+            tracking_uri (str, optional): Tracking server to upload to. Defaults to None.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(self.path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+        if run_id is not None:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                    [("run_id", run_id), ("tracking_uri", tracking_uri or "")],
+                )
+        meta = dict(self.db.execute("SELECT key, value FROM meta"))
+        self.run_id = meta["run_id"]
+        self.tracking_uri = meta["tracking_uri"] or None
+
+    @classmethod
+    def create(cls, run_id: str, tracking_uri: str = None):
+        """Create a new journal in the journal directory
+
+        Args:
+            run_id (str): Run the metrics belong to
+            tracking_uri (str, optional): Tracking server to upload to. Defaults to None.
+
+        Returns:
+            MetricJournal: New journal
+        """
+        path = journal_dir() / f"{run_id}-{os.getpid()}-{uuid.uuid4().hex[:8]}.db"
+        return cls(path, run_id, tracking_uri)
+
+    def append(self, rows: list):
+        """Durably append metrics
+
+        Args:
+            rows (list): Tuples of key, value, timestamp (ms) and step
+        """
+        with self.db:
+            self.db.executemany(
+                "INSERT INTO metrics (key, value, timestamp, step) VALUES (?, ?, ?, ?)", rows
+            )
+
+    def pending(self, limit: int):
+        """Get the oldest metrics that have not been uploaded
+
+        Args:
+            limit (int): Maximum number of metrics
+
+        Returns:
+            int, list: Id of the last metric, metrics
+        """
+        rows = self.db.execute(
+            "SELECT id, key, value, timestamp, step FROM metrics ORDER BY id LIMIT ?",
+            (limit,),
+        ).fetchall()
+        if not rows:
+            return None, []
+        # SQLite stores NaN as NULL
+        return rows[-1][0], [
+            Metric(k, float("nan") if v is None else v, t, s) for _, k, v, t, s in rows
+        ]
+
+    def remove(self, last_id: int):
+        """Remove uploaded metrics
+
+        Args:
+            last_id (int): Id of the last uploaded metric
+        """
+        with self.db:
+            self.db.execute("DELETE FROM metrics WHERE id <= ?", (last_id,))
+
+    def replay(self, client: MlflowClient, batch_size: int, on_upload=None):
+        """Upload all pending metrics, oldest first
+
+        Args:
+            client (MlflowClient): Client to upload with
+            batch_size (int): Metrics per upload
+            on_upload (callable, optional): Called with the duration of every successful upload. Defaults to None.
+
+        Raises:
+            Exception: Upload failed, metrics that were not uploaded remain in the journal
+        """
+        while True:
+            last_id, metrics = self.pending(batch_size)
+            if not metrics:
+                return
+            started = perf_counter()
+            client.log_batch(self.run_id, metrics=metrics)
+            if on_upload:
+                on_upload(perf_counter() - started)
+            self.remove(last_id)
+
+    def close(self, delete_if_empty: bool = False):
+        """Close the journal
+
+        Args:
+            delete_if_empty (bool, optional): Delete the file if all metrics were uploaded. Defaults to False.
+        """
+        empty = self.db.execute("SELECT COUNT(*) FROM metrics").fetchone()[0] == 0
+        self.db.close()
+        if delete_if_empty and empty:
+            for suffix in ("", "-wal", "-shm"):
+                Path(f"{self.path}{suffix}").unlink(missing_ok=True)
+
+
+def sync(directory: Path = None):
+    """Upload journals left behind by runs that did not finish uploading
+
+    Args:
+        directory (Path, optional): Journal directory. Defaults to journal_dir().
+
+    Returns:
+        int, int: Journals synced, journals that failed
+    """
+    synced, failed = 0, 0
+    for path in sorted(Path(directory or journal_dir()).glob("*.db")):
+        # Skip journals whose process is still uploading them
+        pid = path.stem.rsplit("-", 2)[1]
+        if pid != str(os.getpid()) and Path(f"/proc/{pid}").exists():
+            continue
+
+        journal = MetricJournal(path)
+        try:
+            journal.replay(
+                MlflowClient(tracking_uri=journal.tracking_uri), constants.SINK_MAX_BATCH_SIZE
+            )
+            synced += 1
+        except Exception as e:
+            print(f"Failed to sync {path.name}: {e}")
+            failed += 1
+        finally:
+            journal.close(delete_if_empty=True)
+    return synced, failed
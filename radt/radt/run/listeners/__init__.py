@@ -0,0 +1,12 @@
+def parse_listener(entry: str):
+    """Split a listener entry of the form `name[:interval[:deadband]]`, e.g. `smi:0.5` or `top:2:0.05`
+
+    Args:
+        entry (str): Listener entry
+
+    Returns:
+        str, str, str: Name, interval and dead-band, the latter two empty when not given
+    """
+    name, _, options = entry.strip().partition(":")
+    interval, _, deadband = options.partition(":")
+    return name.strip(), interval.strip(), deadband.strip()
@@ -0,0 +1,189 @@
+"""Node-wide sampling daemon shared by all runs of a workload"""
+
+import json
+import os
+import signal
+import socket
+import threading
+
+from multiprocessing import Process
+
+from . import proc
+from ... import constants
+from .iostat_listener import IOstatThread
+from .smi_listener import SMIThread
+from ..sink import MetricSink, _raise_exit
+
+
+def shared_scopes(listeners: list):
+    """Determine which listeners of a run can be served by the sampling daemon
+
+    Args:
+        listeners (list): Listeners enabled for the run
+
+    Returns:
+        dict: Scopes to subscribe to and the listeners they replace
+    """
+    scopes = {}
+    for listener in listeners:
+        # The daemon samples with the defaults, listeners resolving to a custom interval, dead-band
+        # (global or per listener, the heartbeat only applies with one) or rollups are not shared
+        if listener.interval != constants.LISTENER_INTERVAL:
+            continue
+        if listener.deadband is not None or listener.windows:
+            continue
+
+        if isinstance(listener, IOstatThread):
+            scopes["iostat"] = listener
+        elif isinstance(listener, SMIThread):
+            devices = [d.strip() for d in listener.devices.split("+") if d.strip()]
+            # Runs spanning several devices keep their own listener to retain per-device names
+            if len(devices) == 1:
+                scopes[f"smi:{devices[0]}"] = listener
+    return scopes
+
+
+def subscribe(path: str, run_id: str, scopes: list):
+    """Subscribe a run to the sampling daemon
+
+    Args:
+        path (str): Path of the daemon socket
+        run_id (str): Run to receive samples
+        scopes (list): Scopes to subscribe to, e.g. "iostat" or "smi:0"
+
+    Returns:
+        socket.socket: Open subscription, None if the daemon is unreachable
+    """
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(path)
+        conn.sendall((json.dumps({"run_id": run_id, "scopes": scopes}) + "\n").encode())
+        return conn
+    except OSError as e:
+        print(f"Sampling daemon unreachable, starting listeners locally ({e})")
+        return None
+
+
+def unsubscribe(conn: socket.socket, timeout: float):
+    """End a subscription and wait for the daemon to flush the run's metrics
+
+    Args:
+        conn (socket.socket): Open subscription
+        timeout (float): Maximum seconds to wait for the flush
+    """
+    conn.shutdown(socket.SHUT_WR)
+    conn.settimeout(timeout)
+    try:
+        conn.recv(1)
+    except OSError:
+        pass
+    conn.close()
+
+
+class FanoutSink:
+    def __init__(self, daemon, scope: str):
+        """
+        Sink that forwards samples of one scope to every subscribed run.
+
+        Args:
+            daemon (SamplingDaemon): Daemon holding the subscriptions
+            scope (str): Scope of the samples
+        """
+        self.daemon = daemon
+        self.scope = scope
+
+    def log_metric(self, key: str, value: float, timestamp: float = None, step: int = 0):
+        self.log_metrics({key: value}, timestamp, step)
+
+    def log_metrics(self, metrics: dict, timestamp: float = None, step: int = 0):
+        with self.daemon.lock:
+            sinks = [self.daemon.sinks[r] for r in self.daemon.subscribers[self.scope]]
+        for sink in sinks:
+            sink.log_metrics(metrics, timestamp, step)
+
+
+class SamplingDaemon(Process):
+    def __init__(self, path: str):
+        """
+        Samples machine-wide counters once per tick and fans them out to all subscribed runs.
+        Runs subscribe over a unix socket; closing the connection ends the subscription.
+
+        Args:
+            path (str): Path of the unix socket to listen on
+        """
+        super(SamplingDaemon, self).__init__()
+        self.path = path
+        # Terminated (and flushed) together with the scheduler
+        self.daemon = True
+
+    def run(self):
+        proc.set_name(f"{proc.LISTENER_PREFIX}daemon")
+        signal.signal(signal.SIGTERM, _raise_exit)
+
+        self.lock = threading.Lock()
+        self.sinks = {}
+        self.subscribers = {}
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.path)
+        server.listen()
+        try:
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=self.serve, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            os.unlink(self.path)
+            for sink in self.sinks.values():
+                sink.close()
+
+    def start_scope(self, scope: str):
+        """Start sampling a scope
+
+        Args:
+            scope (str): "iostat" or "smi:<device>"
+        """
+        if scope == "iostat":
+            listener = IOstatThread(None)
+        elif scope.startswith("smi:"):
+            listener = SMIThread(None, devices=scope.split(":", 1)[1])
+        else:
+            print(f"Sampling daemon: unknown scope {scope}")
+            return
+        # Sample with the defaults shared_scopes assumes, whatever the environment of the daemon
+        listener.interval = constants.LISTENER_INTERVAL
+        listener.deadband = None
+        listener.windows = []
+        listener.raw = True
+
+        self.subscribers[scope] = set()
+        listener.attach(FanoutSink(self, scope))
+        threading.Thread(target=listener.monitor, name=scope, daemon=True).start()
+
+    def serve(self, conn: socket.socket):
+        """Handle a single run subscription
+
+        Args:
+            conn (socket.socket): Connection of the run
+        """
+        with conn, conn.makefile("r") as f:
+            request = json.loads(f.readline())
+            run_id = request["run_id"]
+
+            with self.lock:
+                self.sinks[run_id] = MetricSink(run_id)
+                for scope in request["scopes"]:
+                    if scope not in self.subscribers:
+                        self.start_scope(scope)
+                    if scope in self.subscribers:
+                        self.subscribers[scope].add(run_id)
+
+            # Block until the run closes its end of the connection
+            f.read()
+
+            with self.lock:
+                for subscribers in self.subscribers.values():
+                    subscribers.discard(run_id)
+                sink = self.sinks.pop(run_id)
+            sink.close()
+            conn.sendall(b"\n")
@@ -1,81 +1,261 @@
 import io
-import mlflow
 import os
 import subprocess
+import time
 
-from multiprocessing import Process
-
-DCGMI_GROUP_ID = os.getenv("RADT_DCGMI_GROUP")
-
-METRIC_NAMES = [
-    "Power Usage",
-    "Total Energy Consumption",
-    "PCIE TX Throughput",
-    "PCIE RX Throughput",
-    "GPU Utilization",
-    "Memory Copy Utilization",
-    "GR Engine Active",
-    "SN Active",
-    "SM Occupancy",
-    "Tensor Active",
-    "DRAM Active",
-    "FP64 Active",
-    "FP32 Active",
-    "FP16 Active",
-    "PCIE TX Bytes",
-    "PCIE RX Bytes",
-    "NVlink TX Bytes",
-    "NVlink RX Bytes",
+from .listener import Listener
+from ... import constants
+
+try:
+    from DcgmReader import DcgmReader
+except ImportError:
+    DcgmReader = None
+
+# DCGM field ids and the names they are logged under. Extend via register_field or RADT_DCGMI_FIELDS.
+FIELDS = {
+    155: "Power Usage",
+    156: "Total Energy Consumption",
+    200: "PCIE TX Throughput",
+    201: "PCIE RX Throughput",
+    203: "GPU Utilization",
+    204: "Memory Copy Utilization",
+    1001: "GR Engine Active",
+    1002: "SN Active",
+    1003: "SM Occupancy",
+    1004: "Tensor Active",
+    1005: "DRAM Active",
+    1006: "FP64 Active",
+    1007: "FP32 Active",
+    1008: "FP16 Active",
+    1009: "PCIE TX Bytes",
+    1010: "PCIE RX Bytes",
+    1011: "NVlink TX Bytes",
+    1012: "NVlink RX Bytes",
+}
+
+# Hierarchy of fields to monitor. Fall back in ascending order if certain fields are not available for collection.
+# The last set is the minimal fallback and never holds registered fields.
+FIELD_SETS = [
+    [155,156,200,201,203,204,1001,1002,1003,1004,1005,1006,1007,1008,1009,1010,1011,1012], # A100, H100
+    [155,156,200,201,203,204,1001,1002,1003,1004,1005,1007,1008,1009,1010,1011,1012], # A10
+    [155,156,200,201,203,204], # Rest
 ]
 
+# Fields added via register_field
+CUSTOM_FIELDS = []
+
+
+def register_field(field_id: int, name: str):
+    """Add a field to the catalogue, it will be collected in addition to the default fields
+
+    Args:
+        field_id (int): DCGM field id
+        name (str): Metric name
+    """
+    FIELDS[field_id] = name
+    if field_id not in CUSTOM_FIELDS:
+        CUSTOM_FIELDS.append(field_id)
+
+
+def field_sets():
+    """Field sets to try in order, with the registered fields first and without them after,
+    so an unsupported registered field does not cost the default fields
+
+    Returns:
+        list: Field sets
+    """
+    extended = [
+        field_set + [f for f in CUSTOM_FIELDS if f not in field_set]
+        for field_set in FIELD_SETS[:-1]
+    ]
+    return [s for s in extended if s not in FIELD_SETS] + [list(s) for s in FIELD_SETS]
+
+
+def register_fields_from_env():
+    """Register fields given as `id=name` pairs separated by commas in RADT_DCGMI_FIELDS"""
+    for entry in os.getenv("RADT_DCGMI_FIELDS", "").split(","):
+        if "=" in entry:
+            field_id, name = entry.split("=", 1)
+            register_field(int(field_id), name.strip())
+
+
+class DmonParser:
+    def __init__(self, field_ids: list):
+        """
+        Parser for `dcgmi dmon` output.
+        Columns are taken from the dmon header and mapped by position to the requested field ids.
+        Lines are grouped into ticks, one line per entity. Once the number of entities is known,
+        a tick is completed as soon as its last entity is read. Ticks are timestamped with the
+        arrival of their first line.
+
+        Args:
+            field_ids (list): Field ids passed to `dcgmi dmon -e`, in order
+        """
+        self.field_ids = field_ids
+        self.columns = None
+        self.tick = {}
+        self.started = None
+        self.entities = None
+
+    def feed(self, line: str, timestamp: float = None):
+        """Parse a line of dmon output
 
-class DCGMIThread(Process):
-    def __init__(self, run_id, experiment_id=88):
-        super(DCGMIThread, self).__init__()
-        self.run_id = run_id
-        self.experiment_id = experiment_id
+        Args:
+            line (str): Line of output
+            timestamp (float, optional): Arrival of the line in seconds since epoch. Defaults to now.
 
-        # Hierarchy of metrics to monitor. Fall back in ascending order if certain metrics are not available for collection.
-        self.dcgm_fields = [
-            [155,156,200,201,203,204,1001,1002,1003,1004,1005,1006,1007,1008,1009,1010,1011,1012], # A100, H100
-            [155,156,200,201,203,204,1001,1002,1003,1004,1005,1007,1008,1009,1010,1011,1012], # A10
-            [155,156,200,201,203,204], # Rest
+        Raises:
+            Exception: dmon reported an error
+
+        Returns:
+            list: Metrics and timestamp of every tick completed by this line
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        if "Error" in line:
+            raise Exception("DCGMI handler could not find required group!")
+        words = line.split()
+        if not words:
+            return []
+
+        if words[0].startswith("#"):
+            # Header, printed as "#Entity" or "# Entity" depending on the DCGM version.
+            # The first column is the entity (e.g. "GPU 0")
+            tags = words[2:] if words[0] == "#" else words[1:]
+            if not tags:
+                return []
+            if len(tags) != len(self.field_ids):
+                print(f"DCGMI header has {len(tags)} columns, expected {len(self.field_ids)}")
+            self.columns = [
+                FIELDS.get(f, tag) for f, tag in zip(self.field_ids, tags)
+            ] + tags[len(self.field_ids) :]
+            return self.flush()
+        if words[0] == "ID" or self.columns is None:
+            return []
+
+        # Entity names consist of a type and an id, e.g. "GPU 0" or "GPU-I 3"
+        entity, values = " ".join(words[:2]), words[2:]
+        ticks = self.flush() if entity in self.tick else []
+        if not self.tick:
+            self.started = timestamp
+        self.tick[entity] = {
+            name: 0.0 if value == "N/A" else float(value)
+            for name, value in zip(self.columns, values)
+        }
+        if len(self.tick) == self.entities:
+            ticks += self.flush()
+        return ticks
+
+    def flush(self):
+        """Complete the current tick
+
+        Returns:
+            list: Metrics and timestamp of the tick, empty if there is none
+        """
+        tick, self.tick = self.tick, {}
+        if not tick:
+            return []
+        self.entities = len(tick)
+        m = {}
+        for entity, values in tick.items():
+            # Keep the original metric names when the group has a single entity
+            prefix = "DCGMI" if len(tick) == 1 else f"DCGMI {entity}"
+            for name, value in values.items():
+                m[f"{prefix} - {name}"] = value
+        return [(m, self.started)]
+
+
+class DCGMIThread(Listener):
+    listener_name = "dcgmi"
+
+    def __init__(self, run_id, experiment_id=88, interval=None, group=None, entities=None):
+        """DCGM listener, samples via the DCGM Python bindings when available and dcgmi dmon otherwise.
+
+        Args:
+            run_id (str): Run to log to
+            experiment_id (int, optional): Experiment id. Defaults to 88.
+            interval (float, optional): Seconds between samples, at least DCGMI_MIN_INTERVAL.
+                Defaults to RADT_LISTENER_DCGMI_INTERVAL.
+            group (str, optional): DCGM group to monitor. Defaults to RADT_DCGMI_GROUP.
+            entities (str, optional): Entities of the group separated by commas, GPU ids or MIG
+                instances as `i:<id>`. Defaults to RADT_DCGMI_ENTITIES, or the devices in SMI_GPU_ID.
+        """
+        super(DCGMIThread, self).__init__(run_id, experiment_id, interval)
+        self.interval = max(self.interval, constants.DCGMI_MIN_INTERVAL)
+        self.group = group or os.getenv("RADT_DCGMI_GROUP")
+        self.entities = [
+            e.strip()
+            for e in (
+                entities
+                or os.getenv("RADT_DCGMI_ENTITIES")
+                or os.getenv("SMI_GPU_ID", "0").replace("+", ",")
+            ).split(",")
+            if e.strip()
         ]
 
+        register_fields_from_env()
+        self.dcgm_fields = field_sets()
+
     def _start_dcgm(self, idx):
-        fields = ",".join(map(str,self.dcgm_fields[idx]))
+        fields = ",".join(map(str, self.dcgm_fields[idx]))
         self.dcgm = subprocess.Popen(
-            f"dcgmi dmon -e {fields} -g {DCGMI_GROUP_ID}".split(),
+            f"dcgmi dmon -e {fields} -g {self.group} -d {int(self.interval * 1000)}".split(),
             stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
         )
 
-    def run(self):
+    def monitor(self):
+        if DcgmReader is not None:
+            try:
+                return self.monitor_bindings()
+            except Exception as e:
+                print(f"DCGM bindings unavailable, falling back to dcgmi dmon ({e})")
+
         for idx, _ in enumerate(self.dcgm_fields):
             self._start_dcgm(idx)
 
-            self.monitor()
+            self.read_output(DmonParser(self.dcgm_fields[idx]))
 
             # If advanced metrics are not available, restart the service with limited collection
             if "Error setting watches" not in str(self.dcgm.stderr.read()):
                 return
 
-    def monitor(self):
+    def read_output(self, parser: DmonParser):
         for line in io.TextIOWrapper(self.dcgm.stdout, encoding="utf-8"):
-            if "Error" in line:
-                raise Exception("DCGMI handler could not find required group!")
-            line = line.split()
+            started, arrived = time.perf_counter(), time.time()
+            for m, timestamp in parser.feed(line, arrived):
+                self.emit(m, started, timestamp)
 
-            if "POWER" in line:
+    def monitor_bindings(self):
+        """Sample the entities of the group through the DCGM Python bindings instead of parsing dmon.
+        The bindings only watch whole GPUs, groups of MIG instances are left to dmon.
+        """
+        if not all(e.isdigit() for e in self.entities):
+            raise Exception(f"entities {','.join(self.entities)} are not GPUs")
+        gpu_ids = [int(e) for e in self.entities]
+        for field_ids in self.dcgm_fields:
+            try:
+                reader = DcgmReader(
+                    fieldIds=field_ids,
+                    updateFrequency=int(self.interval * 1000000),
+                    gpuIds=gpu_ids,
+                )
+                reader.GetLatestGpuValuesAsFieldIdDict()
+                break
+            except Exception:
                 continue
+        else:
+            raise Exception("no supported field set")
 
-            if line[0].lower().strip() not in ["#", "id"]:
-                m = {}
-                for value, name in zip(
-                    line[2:], METRIC_NAMES
-                ):  # [2:] to get rid of gpu name
-                    if value.strip() == "N/A":
-                        value = 0
-                    m[f"DCGMI - {name}"] = float(value)
-
-                mlflow.log_metrics(m)
+        while True:
+            started, timestamp = time.perf_counter(), time.time()
+            m = {}
+            values = reader.GetLatestGpuValuesAsFieldIdDict()
+            for gpu, fields in values.items():
+                prefix = "DCGMI" if len(values) == 1 else f"DCGMI GPU {gpu}"
+                for field_id, value in fields.items():
+                    m[f"{prefix} - {FIELDS.get(field_id, field_id)}"] = (
+                        0.0 if value is None else float(value)
+                    )
+            self.emit(m, started, timestamp)
+            time.sleep(self.interval)
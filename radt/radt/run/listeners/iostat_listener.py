@@ -1,65 +1,162 @@
-import mlflow
-import subprocess
-import io
-
-from multiprocessing import Process
-
-class IOstatThread(Process):
-    def __init__(self, run_id, experiment_id=88):
-        super(IOstatThread, self).__init__()
-        self.run_id = run_id
-        self.experiment_id = experiment_id
-
-    def run(self):
-        ps = subprocess.Popen(
-            "iostat 1 -m".split(),
-            stdout=subprocess.PIPE,
-        )
-        total_tps, total_mb_read_s, total_mb_written_s = 0, 0, 0
-        total_mb_read, total_mb_written = 0, 0
-        devices = set()
-
-        for line in io.TextIOWrapper(ps.stdout, encoding="utf-8"):
-            m = {}
-            line = line.lstrip()
-
-            if (
-                line.startswith("nvme")
-                or line.startswith("sd")
-            ):
-                word_vector = line.strip().split()
-
-                device = word_vector[0]         # storage device
-
-                tps = word_vector[1]            # I/O transfers/s
-                mb_read_s = word_vector[2]      # MB read/s
-                mb_written_s = word_vector[3]   # MB wrtn/s
-                mb_read = word_vector[5]        # MB read since last sample
-                mb_written = word_vector[6]     # MB written since last sample
-
-                m[f"{device} - tps"] = float(tps)
-                m[f"{device} - MB read/s"] = float(mb_read_s)
-                m[f"{device} - MB written/s"] = float(mb_written_s)
-                m[f"{device} - MB read"] = float(mb_read)
-                m[f"{device} - MB written"] = float(mb_written)
-
-                mlflow.log_metrics(m)
-
-                if device in devices:
-                    mlflow.log_metrics({
-                        "iostat - Total tps": total_tps,
-                        "iostat - Total MB read/s": total_mb_read_s,
-                        "iostat - Total MB written/s": total_mb_written_s,
-                        "iostat - Total MB read": total_mb_read,
-                        "iostat - Total MB written": total_mb_written,
-                    })
-                    devices = set()
-                    total_tps, total_mb_read_s, total_mb_written_s = 0, 0, 0
-                    total_mb_read, total_mb_written = 0, 0
-                else:
-                    devices.add(device)
-                    total_tps += float(tps)
-                    total_mb_read_s += float(mb_read_s)
-                    total_mb_written_s += float(mb_written_s)
-                    total_mb_read += float(mb_read)
-                    total_mb_written += float(mb_written)
\ No newline at end of file
+import os
+import re
+import time
+
+from .listener import Listener
+from ... import constants
+
+SECTOR_SIZE = 512
+MB = 1024**2
+
+
+def read_diskstats(path: str = "/proc/diskstats"):
+    """Parse a diskstats file
+
+    Args:
+        path (str, optional): Path to the diskstats file. Defaults to "/proc/diskstats".
+
+    Returns:
+        dict: Device names and their counters
+    """
+    stats = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 14:
+                continue
+            stats[fields[2]] = {
+                "reads": int(fields[3]),
+                "sectors_read": int(fields[5]),
+                "ms_reading": int(fields[6]),
+                "writes": int(fields[7]),
+                "sectors_written": int(fields[9]),
+                "ms_writing": int(fields[10]),
+                "ms_io": int(fields[12]),
+                "ms_weighted": int(fields[13]),
+            }
+    return stats
+
+
+def diskstats_metrics(previous: dict, current: dict, elapsed: float):
+    """Compute per-device and total I/O metrics from two diskstats samples
+
+    Args:
+        previous (dict): Counters of the previous sample
+        current (dict): Counters of this sample
+        elapsed (float): Seconds between the samples
+
+    Returns:
+        dict: Metrics
+    """
+    m = {}
+    totals = dict.fromkeys(("ios", "mb_read", "mb_written", "ms_waiting", "queue", "util"), 0)
+    devices = 0
+
+    for device, cur in current.items():
+        if device not in previous:
+            continue
+        delta = {k: v - previous[device][k] for k, v in cur.items()}
+
+        ios = delta["reads"] + delta["writes"]
+        mb_read = delta["sectors_read"] * SECTOR_SIZE / MB
+        mb_written = delta["sectors_written"] * SECTOR_SIZE / MB
+        ms_waiting = delta["ms_reading"] + delta["ms_writing"]
+        queue = delta["ms_weighted"] / (elapsed * 1000)
+
+        m[f"{device} - tps"] = ios / elapsed
+        m[f"{device} - MB read/s"] = mb_read / elapsed
+        m[f"{device} - MB written/s"] = mb_written / elapsed
+        m[f"{device} - MB read"] = mb_read
+        m[f"{device} - MB written"] = mb_written
+        m[f"{device} - await ms"] = ms_waiting / ios if ios else 0
+        m[f"{device} - queue depth"] = queue
+        util = min(100 * delta["ms_io"] / (elapsed * 1000), 100)
+        m[f"{device} - util %"] = util
+
+        totals["ios"] += ios
+        totals["mb_read"] += mb_read
+        totals["mb_written"] += mb_written
+        totals["ms_waiting"] += ms_waiting
+        totals["queue"] += queue
+        totals["util"] += util
+        devices += 1
+
+    m["iostat - Total tps"] = totals["ios"] / elapsed
+    m["iostat - Total MB read/s"] = totals["mb_read"] / elapsed
+    m["iostat - Total MB written/s"] = totals["mb_written"] / elapsed
+    m["iostat - Total MB read"] = totals["mb_read"]
+    m["iostat - Total MB written"] = totals["mb_written"]
+    m["iostat - Total await ms"] = (
+        totals["ms_waiting"] / totals["ios"] if totals["ios"] else 0
+    )
+    m["iostat - Total queue depth"] = totals["queue"]
+    # Devices are busy in parallel, so utilisation is averaged rather than summed
+    m["iostat - Total util %"] = totals["util"] / devices if devices else 0
+    return m
+
+
+class IOstatThread(Listener):
+    listener_name = "iostat"
+
+    def __init__(
+        self,
+        run_id,
+        experiment_id=88,
+        interval=None,
+        include=None,
+        exclude=None,
+        path="/proc/diskstats",
+    ):
+        """I/O listener sampling diskstats directly.
+
+        Args:
+            run_id (str): Run to log to
+            experiment_id (int, optional): Experiment id. Defaults to 88.
+            interval (float, optional): Seconds between samples. Defaults to RADT_LISTENER_IOSTAT_INTERVAL.
+            include (str, optional): Regex of devices to track. Defaults to RADT_IOSTAT_INCLUDE,
+                or all whole disks (no partitions) when unset.
+            exclude (str, optional): Regex of devices to ignore. Defaults to RADT_IOSTAT_EXCLUDE.
+            path (str, optional): Path to the diskstats file. Defaults to "/proc/diskstats".
+        """
+        super(IOstatThread, self).__init__(run_id, experiment_id, interval)
+        self.include = include or os.getenv("RADT_IOSTAT_INCLUDE", constants.IOSTAT_INCLUDE)
+        self.exclude = exclude or os.getenv("RADT_IOSTAT_EXCLUDE", constants.IOSTAT_EXCLUDE)
+        self.path = path
+        self.devices = {}  # Filter result per device
+
+    def select(self, device: str):
+        """Whether a device passes the include/exclude filter
+
+        Args:
+            device (str): Device name
+
+        Returns:
+            bool: Whether the device is tracked
+        """
+        if self.exclude and re.fullmatch(self.exclude, device):
+            return False
+        if self.include:
+            return re.fullmatch(self.include, device) is not None
+        # Partitions are already accounted for by their disk
+        return not os.path.exists(f"/sys/class/block/{device}/partition")
+
+    def sample(self):
+        """Read the counters of all tracked devices
+
+        Returns:
+            dict: Device names and their counters
+        """
+        stats = read_diskstats(self.path)
+        for device in stats.keys() - self.devices.keys():
+            self.devices[device] = self.select(device)
+        return {d: c for d, c in stats.items() if self.devices[d]}
+
+    def monitor(self):
+        previous = self.sample()
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            started, now = time.perf_counter(), time.monotonic()
+            current = self.sample()
+            self.emit(diskstats_metrics(previous, current, now - last), started)
+            previous, last = current, now
@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+
+from multiprocessing import Process
+
+from . import proc
+from ... import constants
+from ..sink import DeadbandSink, MetricSink, RollupSink
+
+
+def report_overhead(
+    sink: MetricSink, name: str, interval: float, stop: threading.Event, listeners: list
+):
+    """Periodically log the overhead of the current (listener) process:
+    CPU usage, RSS, upload latency, and samples/s and parse time per listener.
+
+    Args:
+        sink (MetricSink): Sink to log to
+        name (str): Name of the listener or host
+        interval (float): Seconds between reports
+        stop (threading.Event): Stops reporting when set
+        listeners (list): Listeners running in this process
+    """
+    last_cpu, last_time = time.process_time(), time.monotonic()
+    last_uploads, last_upload_time = sink.uploads, sink.upload_time
+    last_samples = {l: (l.samples, l.parse_time) for l in listeners}
+
+    while not stop.wait(interval):
+        cpu, now = time.process_time(), time.monotonic()
+        stat = proc.read_stat("/proc/self/stat")
+
+        m = {
+            f"RADT - overhead/{name} CPU %": 100 * (cpu - last_cpu) / (now - last_time),
+            f"RADT - overhead/{name} CPU time s": cpu,
+            f"RADT - overhead/{name} RSS MB": stat["rss"] / 1024**2,
+        }
+        if sink.uploads > last_uploads:
+            m[f"RADT - overhead/{name} upload latency ms"] = (
+                1000 * (sink.upload_time - last_upload_time) / (sink.uploads - last_uploads)
+            )
+        for l in listeners:
+            samples, parse_time = l.samples - last_samples[l][0], l.parse_time - last_samples[l][1]
+            m[f"RADT - overhead/{l.listener_name} samples/s"] = samples / (now - last_time)
+            if samples:
+                m[f"RADT - overhead/{l.listener_name} parse ms"] = 1000 * parse_time / samples
+            last_samples[l] = (l.samples, l.parse_time)
+        sink.log_metrics(m)
+
+        last_cpu, last_time = cpu, now
+        last_uploads, last_upload_time = sink.uploads, sink.upload_time
+
+
+class Listener(Process):
+    listener_name = "listener"
+
+    def __init__(self, run_id, experiment_id=88, interval=None, deadband=None):
+        """
+        Base class for run listeners.
+        A listener runs in its own process, or as a thread of a ListenerHost.
+
+        Args:
+            run_id (str): Run to log to
+            experiment_id (int, optional): Experiment id. Defaults to 88.
+            interval (float, optional): Seconds between samples.
+                Defaults to RADT_LISTENER_<NAME>_INTERVAL or LISTENER_INTERVAL.
+            deadband (float, optional): Only log values that changed by this fraction, see DeadbandSink.
+                Defaults to RADT_LISTENER_<NAME>_DEADBAND or RADT_DEADBAND, disabled when unset.
+
+        Rollup windows (seconds, separated by +, see RollupSink) are read from RADT_LISTENER_<NAME>_ROLLUP
+        or RADT_ROLLUP. Raw samples are dropped when RADT_LISTENER_<NAME>_RAW is False.
+        """
+        super(Listener, self).__init__()
+        self.run_id = run_id
+        self.experiment_id = experiment_id
+        self.parent_pid = os.getpid()
+
+        prefix = f"RADT_LISTENER_{self.listener_name.upper()}"
+        self.interval = interval or float(
+            os.getenv(f"{prefix}_INTERVAL") or constants.LISTENER_INTERVAL
+        )
+        if deadband is None:
+            deadband = os.getenv(f"{prefix}_DEADBAND") or os.getenv("RADT_DEADBAND")
+        self.deadband = None if deadband in (None, "") else float(deadband)
+        self.heartbeat = float(os.getenv("RADT_HEARTBEAT") or constants.HEARTBEAT)
+
+        windows = os.getenv(f"{prefix}_ROLLUP") or os.getenv("RADT_ROLLUP") or constants.ROLLUP
+        self.windows = [float(w) for w in windows.split("+") if w.strip()]
+        self.raw = os.getenv(f"{prefix}_RAW", "True") != "False"
+        if not self.raw and not self.windows:
+            print(f"Listener {self.listener_name} has neither raw samples nor rollups, keeping raw samples")
+            self.raw = True
+        self.rollup = None
+
+        self.samples = 0
+        self.parse_time = 0.0
+
+    def attach(self, sink):
+        """Set the sink to log to, applying the dead-band filter and rollups when configured
+
+        Args:
+            sink (MetricSink): Sink to log to
+        """
+        raw = sink if self.deadband is None else DeadbandSink(sink, self.deadband, self.heartbeat)
+        if self.windows:
+            self.rollup = RollupSink(sink, self.windows, raw if self.raw else None)
+            self.sink = self.rollup
+        else:
+            self.sink = raw
+
+    def detach(self):
+        """Log rollups of the windows that are still open"""
+        if self.rollup is not None:
+            self.rollup.close()
+
+    def emit(self, metrics: dict, started: float, timestamp: float = None):
+        """Log a sample and account for the time spent producing it
+
+        Args:
+            metrics (dict): Metrics of the sample
+            started (float): `time.perf_counter()` when sampling or parsing started
+            timestamp (float, optional): Sample time in seconds since epoch. Defaults to now.
+        """
+        self.parse_time += time.perf_counter() - started
+        self.samples += 1
+        self.sink.log_metrics(metrics, timestamp)
+
+    def run(self):
+        proc.set_name(f"{proc.LISTENER_PREFIX}{self.listener_name}")
+        with MetricSink(self.run_id) as sink:
+            self.attach(sink)
+            stop = threading.Event()
+            threading.Thread(
+                target=report_overhead,
+                args=(sink, self.listener_name, constants.OVERHEAD_INTERVAL, stop, [self]),
+                daemon=True,
+            ).start()
+            try:
+                self.monitor()
+            finally:
+                stop.set()
+                self.detach()
+
+    def monitor(self):
+        """Collect metrics and write them to `self.sink` until terminated"""
+        raise NotImplementedError
+
+
+class ListenerHost(Process):
+    def __init__(self, run_id, listeners: list):
+        """
+        Single process hosting several listeners as threads.
+        All listeners share one metric sink and upload path.
+
+        Args:
+            run_id (str): Run to log to
+            listeners (list): Listeners to host, these should not be started themselves
+        """
+        super(ListenerHost, self).__init__()
+        self.run_id = run_id
+        self.listeners = listeners
+
+    def run(self):
+        proc.set_name(f"{proc.LISTENER_PREFIX}host")
+        with MetricSink(self.run_id) as sink:
+            for listener in self.listeners:
+                listener.attach(sink)
+                threading.Thread(
+                    target=listener.monitor, name=listener.listener_name, daemon=True
+                ).start()
+
+            # Report overhead from the main thread until terminated
+            try:
+                report_overhead(
+                    sink, "host", constants.OVERHEAD_INTERVAL, threading.Event(), self.listeners
+                )
+            finally:
+                for listener in self.listeners:
+                    listener.detach()
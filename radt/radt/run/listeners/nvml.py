@@ -0,0 +1,134 @@
+"""GPU sample providers for the SMI listener"""
+
+import functools
+import itertools
+import math
+
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+class Provider:
+    # Errors of a single query, e.g. power or clocks on MIG instances and some consumer GPUs
+    errors = ()
+
+    def queries(self, handle):
+        """Get the queries of a device
+
+        Args:
+            handle (object): Device handle
+
+        Returns:
+            dict: Fields and the functions reading them
+        """
+        raise NotImplementedError
+
+    def sample(self, handle):
+        """Read the current state of a device.
+        Fields the device does not support are reported as -1, like nvidia-smi does.
+
+        Args:
+            handle (object): Device handle
+
+        Returns:
+            dict: Power (W), utilisation (0-1), memory used (MiB), pstate, clocks (MHz), throttle reasons
+        """
+        m = {}
+        for field, read in self.queries(handle).items():
+            try:
+                m[field] = read()
+            except self.errors:
+                m[field] = -1.0
+        return m
+
+
+class NVMLProvider(Provider):
+    def __init__(self):
+        """
+        In-process NVML provider via pynvml.
+
+        Raises:
+            RuntimeError: pynvml is not installed or NVML could not be initialised
+        """
+        if pynvml is None:
+            raise RuntimeError("pynvml is not installed")
+        try:
+            pynvml.nvmlInit()
+        except pynvml.NVMLError as e:
+            raise RuntimeError(f"NVML could not be initialised ({e})")
+        self.errors = pynvml.NVMLError
+
+    def handle(self, index: int):
+        """Get the device handle for a device index
+
+        Args:
+            index (int): Device index
+
+        Returns:
+            object: NVML device handle
+        """
+        return pynvml.nvmlDeviceGetHandleByIndex(index)
+
+    def queries(self, handle):
+        return {
+            "power": lambda: pynvml.nvmlDeviceGetPowerUsage(handle) / 1000,
+            "gpu_util": lambda: pynvml.nvmlDeviceGetUtilizationRates(handle).gpu / 100,
+            "mem_util": lambda: pynvml.nvmlDeviceGetUtilizationRates(handle).memory / 100,
+            "mem_used": lambda: pynvml.nvmlDeviceGetMemoryInfo(handle).used / 1024**2,
+            "pstate": lambda: pynvml.nvmlDeviceGetPerformanceState(handle),
+            "sm_clock": lambda: pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_SM),
+            "mem_clock": lambda: pynvml.nvmlDeviceGetClockInfo(handle, pynvml.NVML_CLOCK_MEM),
+            "throttle": lambda: pynvml.nvmlDeviceGetCurrentClocksThrottleReasons(handle),
+        }
+
+    def shutdown(self):
+        pynvml.nvmlShutdown()
+
+
+class FakeNVMLError(Exception):
+    pass
+
+
+class FakeNVMLProvider(Provider):
+    errors = FakeNVMLError
+
+    def __init__(self, unsupported: list = ()):
+        """
+        Deterministic provider for machines without a GPU.
+        Counts reads per device so sampling rates can be verified.
+
+        Args:
+            unsupported (list, optional): Fields whose queries fail, like on MIG instances. Defaults to ().
+        """
+        self.calls = {}
+        self.unsupported = set(unsupported)
+        self._counter = itertools.count()
+
+    def handle(self, index: int):
+        self.calls[index] = 0
+        return index
+
+    def queries(self, handle):
+        self.calls[handle] += 1
+        phase = math.sin(next(self._counter) / 10)
+        values = {
+            "power": 150 + 100 * phase,
+            "gpu_util": 0.5 + 0.5 * phase,
+            "mem_util": 0.25 + 0.25 * phase,
+            "mem_used": 4096.0,
+            "pstate": 0,
+            "sm_clock": 1410,
+            "mem_clock": 1215,
+            "throttle": 0,
+        }
+        return {field: functools.partial(self.read, field, v) for field, v in values.items()}
+
+    def read(self, field: str, value: float):
+        if field in self.unsupported:
+            raise FakeNVMLError(f"{field} is not supported")
+        return value
+
+    def shutdown(self):
+        pass
@@ -0,0 +1,116 @@
+"""Helpers for sampling processes directly from /proc"""
+
+import os
+from pathlib import Path
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Listener processes name themselves with this prefix so they are not counted as part of the run
+LISTENER_PREFIX = "radt-"
+
+
+def set_name(name: str):
+    """Set the name (comm) of the current process
+
+    Args:
+        name (str): Process name, truncated to 15 characters by the kernel
+    """
+    try:
+        with open("/proc/self/comm", "w") as f:
+            f.write(name[:15])
+    except OSError:
+        pass
+
+
+def read_stat(path: str):
+    """Parse a /proc/<pid>/stat or /proc/<pid>/task/<tid>/stat file
+
+    Args:
+        path (str): Path to the stat file
+
+    Returns:
+        dict: comm, ppid, jiffies (utime + stime), rss (bytes) and processor, or None if the process is gone
+    """
+    try:
+        with open(path) as f:
+            data = f.read()
+    except (FileNotFoundError, ProcessLookupError):
+        return None
+
+    # comm may contain spaces and parentheses, split on the last closing parenthesis
+    comm = data[data.find("(") + 1 : data.rfind(")")]
+    fields = data[data.rfind(")") + 2 :].split()
+
+    # Field numbers as documented in proc(5), offset by the pid and comm fields
+    return {
+        "comm": comm,
+        "ppid": int(fields[1]),
+        "jiffies": int(fields[11]) + int(fields[12]),
+        "rss": int(fields[21]) * PAGE_SIZE,
+        "processor": int(fields[36]),
+    }
+
+
+def read_meminfo():
+    """Parse /proc/meminfo
+
+    Returns:
+        dict: Field names and values in bytes
+    """
+    meminfo = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            name, value = line.split(":", 1)
+            value = value.split()
+            meminfo[name] = int(value[0]) * (1024 if len(value) > 1 else 1)
+    return meminfo
+
+
+def children(pid: int):
+    """Get the direct children of a process
+
+    Args:
+        pid (int): Process id
+
+    Returns:
+        list: Child process ids
+    """
+    result = []
+    try:
+        for task in os.scandir(f"/proc/{pid}/task"):
+            with open(f"{task.path}/children") as f:
+                result.extend(int(child) for child in f.read().split())
+    except FileNotFoundError:
+        # Kernel without CONFIG_PROC_CHILDREN, fall back to scanning all processes
+        if not Path(f"/proc/{pid}").exists():
+            return []
+        for entry in os.scandir("/proc"):
+            if entry.name.isdigit():
+                stat = read_stat(f"{entry.path}/stat")
+                if stat and stat["ppid"] == pid:
+                    result.append(int(entry.name))
+    except ProcessLookupError:
+        pass
+    return result
+
+
+def process_tree(pid: int):
+    """Get a process and all of its descendants, excluding radT listeners
+
+    Args:
+        pid (int): Root process id
+
+    Returns:
+        list: Process ids in the tree
+    """
+    tree = []
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        stat = read_stat(f"/proc/{current}/stat")
+        if stat is None or stat["comm"].startswith(LISTENER_PREFIX):
+            continue
+        tree.append(current)
+        pending.extend(children(current))
+    return tree
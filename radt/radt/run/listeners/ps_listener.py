@@ -1,39 +1,71 @@
-import mlflow
 import os
-import subprocess
 import time
 
-from multiprocessing import Process
+from collections import defaultdict
 
-# This listener writes *a lot* of metrics and may affect performance!
-class PSThread(Process):
-    def __init__(self, run_id, experiment_id=88):
-        super(PSThread, self).__init__()
-        self.run_id = run_id
-        self.experiment_id = experiment_id
-        self.parent_pid = os.getpid()
+from . import proc
+from .listener import Listener
 
-    def run(self):
+
+class PSThread(Listener):
+    listener_name = "ps"
+
+    def sample(self, previous: dict, elapsed: float):
+        """Sample every thread of the run's process tree
+
+        Args:
+            previous (dict): Jiffies per (pid, tid) of the previous sample
+            elapsed (float): Seconds since the previous sample
+
+        Returns:
+            dict, dict: Metrics, jiffies per (pid, tid) of this sample
+        """
+        current = {}
+        cpu_per_core = defaultdict(float)
+        cpu_per_process = defaultdict(float)
+        mem_per_process = {}
+        mem_total = proc.read_meminfo()["MemTotal"]
+
+        for pid in proc.process_tree(self.parent_pid):
+            try:
+                tasks = os.listdir(f"/proc/{pid}/task")
+            except FileNotFoundError:
+                continue
+
+            for tid in tasks:
+                stat = proc.read_stat(f"/proc/{pid}/task/{tid}/stat")
+                if stat is None:
+                    continue
+                current[(pid, tid)] = stat["jiffies"]
+
+                # Threads that started since the previous sample only count from now on
+                if (pid, tid) in previous:
+                    delta = stat["jiffies"] - previous[(pid, tid)]
+                    cpu = 100 * delta / (proc.CLOCK_TICKS * elapsed)
+                    cpu_per_core[stat["processor"]] += cpu
+                    cpu_per_process[pid] += cpu
+
+                # The thread group leader carries the memory of the whole process
+                if tid == str(pid):
+                    mem_per_process[pid] = 100 * stat["rss"] / mem_total
+
+        m = {}
+        for core, cpu in cpu_per_core.items():
+            m[f"PS - CPU {core}"] = cpu
+        for pid, cpu in cpu_per_process.items():
+            m[f"PS - Process {pid} CPU"] = cpu
+        for pid, mem in mem_per_process.items():
+            m[f"PS - Process {pid} MEM"] = mem
+        m["PS - Total CPU"] = sum(cpu_per_process.values())
+        m["PS - Total MEM"] = sum(mem_per_process.values())
+        return m, current
+
+    def monitor(self):
+        _, previous = self.sample({}, self.interval)
+        last = time.monotonic()
         while True:
-            output = (
-                subprocess.run(
-                    f"ps -p {self.parent_pid} -L -o pid,tid,psr,pcpu,%mem".split(),
-                    capture_output=True,
-                )
-                .stdout.decode()
-                .splitlines()
-            )
-
-            for line in output[1:]:
-                line = line.strip().split(" ")
-                line = [x for x in line if x.strip() != ""]
-
-                pid = line[0]
-                tid = line[1]
-                psr = line[2]
-                cpu = line[3]
-                mem = line[4]
-
-                mlflow.log_metric(f"PS - CPU {psr}", float(cpu))
-                mlflow.log_metric(f"PS - MEM {psr}", float(mem))
-            time.sleep(5)
+            time.sleep(self.interval)
+            started, now = time.perf_counter(), time.monotonic()
+            m, previous = self.sample(previous, now - last)
+            last = now
+            self.emit(m, started)
@@ -1,34 +1,124 @@
 import io
-import mlflow
+import re
 import subprocess
+import time
 
 from datetime import datetime
-from multiprocessing import Process
 
 import os
 
+from .listener import Listener
+from .nvml import FakeNVMLProvider, NVMLProvider
+from ... import constants
 
-class SMIThread(Process):
-    def __init__(self, run_id, experiment_id=88):
-        super(SMIThread, self).__init__()
-        self.run_id = run_id
-        self.experiment_id = experiment_id
+NVML_METRICS = {
+    "power": "Power Draw",
+    "gpu_util": "GPU Util",
+    "mem_util": "Mem Util",
+    "mem_used": "Mem Used",
+    "pstate": "Performance State",
+    "sm_clock": "SM Clock",
+    "mem_clock": "Memory Clock",
+    "throttle": "Throttle Reasons",
+}
 
-    def run(self):
-        SMI_GPU_ID = os.getenv("SMI_GPU_ID")
+
+class SMIThread(Listener):
+    listener_name = "smi"
+
+    def __init__(self, run_id, experiment_id=88, interval=None, backend=None, devices=None):
+        """GPU listener, samples via NVML when available and nvidia-smi otherwise.
+
+        Args:
+            run_id (str): Run to log to
+            experiment_id (int, optional): Experiment id. Defaults to 88.
+            interval (float, optional): Seconds between samples, sub-second intervals require NVML.
+                Defaults to RADT_LISTENER_SMI_INTERVAL.
+            backend (str, optional): "auto", "nvml", "smi" or "fake". Defaults to RADT_SMI_BACKEND.
+            devices (str, optional): Devices to sample separated by +. Defaults to SMI_GPU_ID.
+        """
+        super(SMIThread, self).__init__(run_id, experiment_id, interval)
+        self.interval = max(self.interval, constants.SMI_MIN_INTERVAL)
+        self.backend = (backend or os.getenv("RADT_SMI_BACKEND", constants.SMI_BACKEND)).lower()
+        self.devices = devices or os.getenv("SMI_GPU_ID", "0")
+
+    def monitor(self):
+        provider = self.make_provider()
+        if provider is None:
+            self.monitor_smi()
+        else:
+            try:
+                self.monitor_nvml(provider)
+            finally:
+                provider.shutdown()
+
+    def make_provider(self):
+        """Select the sample provider for the configured backend
+
+        Returns:
+            NVMLProvider or FakeNVMLProvider: Provider, None to fall back to nvidia-smi
+        """
+        if self.backend == "fake":
+            return FakeNVMLProvider()
+        if self.backend in ("auto", "nvml"):
+            try:
+                return NVMLProvider()
+            except RuntimeError as e:
+                if self.backend == "nvml":
+                    raise
+                print(f"NVML unavailable, falling back to nvidia-smi ({e})")
+        return None
+
+    def sample_nvml(self, provider, handles: dict):
+        """Sample all devices once
+
+        Args:
+            provider (NVMLProvider): Sample provider
+            handles (dict): Device ids and their handles
+
+        Returns:
+            dict: Metrics
+        """
+        m = {}
+        for gpu, handle in handles.items():
+            # Keep the original metric names when tracking a single device
+            prefix = "SMI" if len(handles) == 1 else f"SMI {gpu}"
+            for field, value in provider.sample(handle).items():
+                m[f"{prefix} - {NVML_METRICS[field]}"] = value
+        return m
+
+    def monitor_nvml(self, provider):
+        gpu_ids = [g for g in re.split(r"[+,]", self.devices) if g.strip()]
+        handles = {gpu.strip(): provider.handle(int(gpu)) for gpu in gpu_ids}
+
+        next_sample = time.monotonic()
+        while True:
+            started, timestamp = time.perf_counter(), time.time()
+            self.emit(self.sample_nvml(provider, handles), started, timestamp)
+
+            # Skip ticks rather than bursting when sampling falls behind
+            next_sample += self.interval
+            now = time.monotonic()
+            if next_sample < now:
+                next_sample = now + self.interval
+            time.sleep(next_sample - now)
+
+    def monitor_smi(self):
+        SMI_GPU_ID = self.devices
 
         print("SMI GPU ID:", SMI_GPU_ID)
         self.dcgm = subprocess.Popen(
-            f"nvidia-smi -i {SMI_GPU_ID} -l 1 --query-gpu=power.draw,timestamp,utilization.gpu,utilization.memory,memory.used,pstate --format=csv,nounits,noheader".split(),
+            f"nvidia-smi -i {SMI_GPU_ID} -l {max(round(self.interval), 1)} --query-gpu=power.draw,timestamp,utilization.gpu,utilization.memory,memory.used,pstate --format=csv,nounits,noheader".split(),
             stdout=subprocess.PIPE,
         )
         for line in io.TextIOWrapper(self.dcgm.stdout, encoding="utf-8"):
+            started = time.perf_counter()
             line = line.split(", ")
             if len(line) > 1 and line[0] != "#":
                 try:
                     m = {}
                     m["SMI - Power Draw"] = float(line[0])
-                    m["SMI - Timestamp"] = datetime.strptime(
+                    timestamp = datetime.strptime(
                         line[1] + "000", r"%Y/%m/%d %H:%M:%S.%f"
                     ).timestamp()
                     try:
@@ -41,7 +131,7 @@ class SMIThread(Process):
                         m["SMI - Mem Util"] = float(-1)
                     m["SMI - Mem Used"] = float(line[4])
                     m["SMI - Performance State"] = int(line[5][1:])
-                    mlflow.log_metrics(m)
+                    self.emit(m, started, timestamp)
                 except ValueError as e:
-                    print("SMI Listener failed to report metrics")
-                    break
+                    # Skip malformed lines instead of stopping the listener
+                    print("SMI Listener failed to parse metrics:", e)
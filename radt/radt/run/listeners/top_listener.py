@@ -1,81 +1,63 @@
-import io
-import mlflow
-import subprocess
-from multiprocessing import Process
-
-
-class TOPThread(Process):
-    def __init__(
-        self,
-        run_id,
-        process_names=[
-            "python",
-        ],
-        experiment_id=88,
-    ):
-        super(TOPThread, self).__init__()
-        self.run_id = run_id
-        self.experiment_id = experiment_id
-
-        self.process_names = process_names
-
-    def run(self):
-        self.top = subprocess.Popen(
-            "top -i -b -n 999999999 -d 1".split(),
-            stdout=subprocess.PIPE,
+import time
+
+from . import proc
+from .listener import Listener
+
+
+class TOPThread(Listener):
+    listener_name = "top"
+
+    def sample(self, previous: dict, elapsed: float):
+        """Sample the run's process tree and system memory
+
+        Args:
+            previous (dict): Jiffies per pid of the previous sample
+            elapsed (float): Seconds since the previous sample
+
+        Returns:
+            dict, dict: Metrics, jiffies per pid of this sample
+        """
+        current = {}
+        cpu_util = 0
+        mem_util = 0
+        meminfo = proc.read_meminfo()
+
+        for pid in proc.process_tree(self.parent_pid):
+            stat = proc.read_stat(f"/proc/{pid}/stat")
+            if stat is None:
+                continue
+            current[pid] = stat["jiffies"]
+
+            if pid in previous:
+                cpu_util += (
+                    100 * (stat["jiffies"] - previous[pid]) / (proc.CLOCK_TICKS * elapsed)
+                )
+            mem_util += 100 * stat["rss"] / meminfo["MemTotal"]
+
+        # Same definition of used memory as top
+        used = (
+            meminfo["MemTotal"]
+            - meminfo["MemFree"]
+            - meminfo.get("Buffers", 0)
+            - meminfo.get("Cached", 0)
+            - meminfo.get("SReclaimable", 0)
         )
-
-        #  ======= flags and accumulative cpu% and mem% ========
-        Flag = False
-        pervFlag = True
-        CPU_util = 0
-        Mem_util = 0
-        # ============================================b==========
-
-        # =========== Going through each line ==================
-        for line in io.TextIOWrapper(self.top.stdout, encoding="utf-8"):
-            m = {}
-            line = line.lstrip()
-
-            if (
-                line.startswith("top")
-                or line.startswith("Tasks")
-                or line.startswith("%")
-                or line.startswith("PID")
-                or line.startswith(" ")
-            ):
-                pass
-            else:
-                word_vector = line.strip().split()
-                if (line.startswith("KiB") or line.startswith("MiB")) and len(
-                    word_vector
-                ) != 0:
-                    if word_vector[1] == "Mem":
-                        Flag = not (Flag)
-
-                        if Flag == pervFlag:
-                            m["TOP - CPU Utilization"] = CPU_util
-                            m["TOP - Memory Utilization"] = Mem_util
-                            pervFlag = not (Flag)
-                            CPU_util = 0
-                            Mem_util = 0
-
-                        if word_vector[8] == "used,":
-                            m["TOP - Memory Usage GB"] = float(word_vector[7]) / 1000
-                        # else:
-                        #     m["top - Memory Usage (GB)"] = float(word_vector[6])/1000)
-                    elif word_vector[1] == "Swap:":
-                        m["TOP - Swap Memory GB"] = float(word_vector[6]) / 1000
-
-                elif len(word_vector) != 0:
-                    if word_vector[11] in self.process_names:
-                        if Flag != pervFlag:
-                            CPU_util += float(word_vector[8])
-                            Mem_util += float(word_vector[9])
-            if len(m):
-                mlflow.log_metrics(m)
+        swap = meminfo.get("SwapTotal", 0) - meminfo.get("SwapFree", 0)
 
         m = {}
-        m["TOP - CPU Utilization"] = CPU_util
-        m["TOP - Memory Utilization"] = Mem_util
-        mlflow.log_metrics(m)
+        m["TOP - CPU Utilization"] = cpu_util
+        m["TOP - Memory Utilization"] = mem_util
+        # Reported in MiB / 1000, as parsed from top previously
+        m["TOP - Memory Usage GB"] = used / 1024**2 / 1000
+        m["TOP - Swap Memory GB"] = swap / 1024**2 / 1000
+        return m, current
+
+    def monitor(self):
+        _, previous = self.sample({}, self.interval)
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            started, now = time.perf_counter(), time.monotonic()
+            m, previous = self.sample(previous, now - last)
+            last = now
+            self.emit(m, started)
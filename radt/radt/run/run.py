@@ -4,11 +4,12 @@ import os
 import runpy
 import sys
 from pathlib import Path
-from time import sleep
+from time import perf_counter
 
 import mlflow
 
 from .benchmark import RADTBenchmark
+from .handshake import register
 
 
 def update_params_listing(command, params):
@@ -50,6 +51,7 @@ def update_params_listing(command, params):
 
 
 def start_run(args, listeners):
+    started = perf_counter()
     try:
         RUN_ID = mlflow.start_run().info.run_id
     except Exception:
@@ -61,11 +63,10 @@ def start_run(args, listeners):
 
     sys.argv = [sys.argv[0]] + passthrough.split()
 
-    # Clear MLproject file so next run may start
-    with open(Path("MLproject")) as file:
-        mlflow.log_text(file.read(), "MLproject")
-
-    Path("MLproject").unlink()
+    # Log the MLproject the run was started with
+    mlproject = Path(os.getenv("RADT_MLPROJECT") or "MLproject")
+    if mlproject.is_file():
+        mlflow.log_text(mlproject.read_text(), "MLproject")
 
     code = "run_path(progname, run_name='__main__')"
     globs = {"run_path": runpy.run_path, "progname": args.command}
@@ -74,9 +75,11 @@ def start_run(args, listeners):
     mlflow.log_param("max_epoch", int(os.getenv("RADT_MAX_EPOCH")))
     mlflow.log_param("max_time", int(os.getenv("RADT_MAX_TIME")))
 
-    # Wait for lock
-    while Path("radtlock").is_file():
-        sleep(0.1)
+    mlflow.log_metric("RADT - overhead/run startup s", perf_counter() - started)
+
+    # Report the run id to the scheduler and wait for the other runs of the workload
+    if path := os.getenv("RADT_LAUNCH_SOCKET"):
+        register(path, os.getenv("RADT_LAUNCH_LETTER", ""), RUN_ID)
 
     if os.getenv("RADT_MANUAL_MODE") == "True":
         try:
@@ -0,0 +1,419 @@
+import bisect
+import math
+import os
+import signal
+import threading
+from queue import Empty, Full, Queue
+from time import time
+
+import mlflow
+from mlflow.tracking import MlflowClient
+
+from .. import constants
+from .journal import MetricJournal
+from .listeners import proc
+
+_FLUSH = object()
+_CLOSE = object()
+
+
+def _raise_exit(signum, frame):
+    raise SystemExit(0)
+
+
+class MetricSink:
+    def __init__(
+        self,
+        run_id: str,
+        batch_size: int = None,
+        flush_interval: float = None,
+        queue_size: int = None,
+        policy: str = None,
+    ):
+        """
+        Batched, non-blocking metric uploader.
+        Samples are queued by the caller and written to a local MetricJournal by a background thread.
+        A second thread replays the journal to the tracking server in `log_batch` calls, retrying with
+        backoff, and keeps a single client (and connection pool) per process.
+        Journals that could not be uploaded are left behind for `radt sync`.
+
+        Args:
+            run_id (str): Run to log metrics to
+            batch_size (int, optional): Maximum number of metrics per upload. Defaults to RADT_SINK_BATCH_SIZE.
+            flush_interval (float, optional): Maximum seconds between uploads. Defaults to RADT_SINK_FLUSH_INTERVAL.
+            queue_size (int, optional): Maximum number of queued metrics. Defaults to RADT_SINK_QUEUE_SIZE.
+            policy (str, optional): "drop" discards samples when the queue is full, "block" waits for space.
+                Defaults to RADT_SINK_POLICY.
+        """
+        self.run_id = run_id
+        self.batch_size = min(
+            batch_size or int(os.getenv("RADT_SINK_BATCH_SIZE", constants.SINK_BATCH_SIZE)),
+            constants.SINK_MAX_BATCH_SIZE,
+        )
+        self.flush_interval = flush_interval or float(
+            os.getenv("RADT_SINK_FLUSH_INTERVAL", constants.SINK_FLUSH_INTERVAL)
+        )
+        self.policy = (policy or os.getenv("RADT_SINK_POLICY", constants.SINK_POLICY)).lower()
+        if self.policy not in ("drop", "block"):
+            raise ValueError(f"Unknown sink policy: {self.policy}")
+
+        self.queue = Queue(
+            queue_size or int(os.getenv("RADT_SINK_QUEUE_SIZE", constants.SINK_QUEUE_SIZE))
+        )
+        self.client = MlflowClient()
+        self.dropped = 0
+        self.uploads = 0
+        self.upload_time = 0.0
+        self.native_ids = []
+
+        journal = MetricJournal.create(run_id, mlflow.get_tracking_uri())
+        self.journal_path = journal.path
+        journal.close()
+
+        self.wake = threading.Event()
+        self.closing = threading.Event()
+        self.flushed = []
+
+        self.writer = threading.Thread(target=self._writer, daemon=True)
+        self.uploader = threading.Thread(target=self._uploader, daemon=True)
+        self.writer.start()
+        self.uploader.start()
+
+    def __enter__(self):
+        # Listeners are stopped with SIGTERM, turn it into a regular exit so the sink is flushed
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, _raise_exit)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def log_metric(self, key: str, value: float, timestamp: float = None, step: int = 0):
+        """Queue a single metric
+
+        Args:
+            key (str): Metric name
+            value (float): Metric value
+            timestamp (float, optional): Sample time in seconds since epoch. Defaults to now.
+            step (int, optional): Metric step. Defaults to 0.
+        """
+        self.log_metrics({key: value}, timestamp, step)
+
+    def log_metrics(self, metrics: dict, timestamp: float = None, step: int = 0):
+        """Queue a sample of metrics sharing one timestamp
+
+        Args:
+            metrics (dict): Metric names and values
+            timestamp (float, optional): Sample time in seconds since epoch. Defaults to now.
+            step (int, optional): Metric step. Defaults to 0.
+        """
+        timestamp = int((timestamp or time()) * 1000)
+        for key, value in metrics.items():
+            self._put((key, float(value), timestamp, step))
+
+    def _put(self, item):
+        if self.policy == "block":
+            self.queue.put(item)
+            return
+        try:
+            self.queue.put_nowait(item)
+        except Full:
+            self.dropped += 1
+
+    def flush(self, timeout: float = None):
+        """Block until every queued metric has been uploaded
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None.
+        """
+        done = threading.Event()
+        self.queue.put((_FLUSH, done))
+        done.wait(timeout)
+
+    def close(self, timeout: float = None):
+        """Journal all queued metrics, upload them and stop the background threads
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait for the upload,
+                metrics that are not uploaded by then remain in the journal. Defaults to SINK_FLUSH_TIMEOUT.
+        """
+        if not self.writer.is_alive():
+            return
+        self.queue.put(_CLOSE)
+        self.writer.join()
+        self.closing.set()
+        self.wake.set()
+        self.uploader.join(timeout or constants.SINK_FLUSH_TIMEOUT)
+        if self.dropped:
+            print(f"Metric sink dropped {self.dropped} samples for run {self.run_id}")
+
+    def cpu_time(self):
+        """Get the CPU time spent by the sink's background threads
+
+        Returns:
+            float: CPU time in seconds
+        """
+        jiffies = 0
+        for tid in self.native_ids:
+            stat = proc.read_stat(f"/proc/self/task/{tid}/stat")
+            if stat:
+                jiffies += stat["jiffies"]
+        return jiffies / proc.CLOCK_TICKS
+
+    def _count_upload(self, duration: float):
+        self.uploads += 1
+        self.upload_time += duration
+
+    def _writer(self):
+        self.native_ids.append(threading.get_native_id())
+        journal = MetricJournal(self.journal_path)
+        unannounced = 0
+        while True:
+            item = self.queue.get()
+            rows = []
+            flushes = []
+            # Drain everything that is queued into a single transaction
+            while True:
+                if item is _CLOSE:
+                    break
+                elif isinstance(item, tuple) and item[0] is _FLUSH:
+                    flushes.append(item[1])
+                else:
+                    rows.append(item)
+                try:
+                    item = self.queue.get_nowait()
+                except Empty:
+                    item = None
+                    break
+
+            if rows:
+                journal.append(rows)
+                unannounced += len(rows)
+            if flushes:
+                self.flushed.extend(flushes)
+                self.wake.set()
+            if unannounced >= self.batch_size:
+                unannounced = 0
+                self.wake.set()
+            if item is _CLOSE:
+                journal.close()
+                return
+
+    def _uploader(self):
+        self.native_ids.append(threading.get_native_id())
+        journal = MetricJournal(self.journal_path)
+        backoff = 0
+        while True:
+            self.wake.wait(backoff or self.flush_interval)
+            self.wake.clear()
+            closing = self.closing.is_set()
+            flushes, self.flushed = self.flushed, []
+
+            try:
+                journal.replay(self.client, self.batch_size, self._count_upload)
+                backoff = 0
+            except Exception as e:
+                backoff = min(max(2 * backoff, 1), constants.SINK_MAX_BACKOFF)
+                print(f"Failed to log metrics, retrying in {backoff}s:", e)
+
+            if backoff:
+                # Flushes are retried with the next attempt
+                self.flushed.extend(flushes)
+            for done in flushes if not backoff else []:
+                done.set()
+
+            if closing and not backoff:
+                journal.close(delete_if_empty=True)
+                return
+
+
+class DeadbandSink:
+    def __init__(self, sink, threshold: float, heartbeat: float):
+        """
+        Change-only wrapper around a sink.
+        A value is only forwarded when it moves by more than `threshold` relative to the last
+        forwarded value, or when `heartbeat` seconds have passed since it was last forwarded.
+
+        Args:
+            sink (MetricSink): Sink to forward to
+            threshold (float): Relative change required to forward a value, 0 forwards any change
+            heartbeat (float): Maximum seconds between forwarded values of a metric
+        """
+        self.sink = sink
+        self.threshold = threshold
+        self.heartbeat = heartbeat
+        self.last = {}
+
+    def log_metric(self, key: str, value: float, timestamp: float = None, step: int = 0):
+        self.log_metrics({key: value}, timestamp, step)
+
+    def log_metrics(self, metrics: dict, timestamp: float = None, step: int = 0):
+        timestamp = timestamp or time()
+        changed = {}
+        for key, value in metrics.items():
+            last = self.last.get(key)
+            if (
+                last is None
+                or abs(value - last[0]) > self.threshold * abs(last[0])
+                or timestamp - last[1] >= self.heartbeat
+            ):
+                changed[key] = value
+                self.last[key] = (value, timestamp)
+        if changed:
+            self.sink.log_metrics(changed, timestamp, step)
+
+
+class P2Quantile:
+    def __init__(self, p: float, exact: int = 64):
+        """
+        Streaming quantile estimate in constant memory (P² algorithm, Jain & Chlamtac 1985).
+        The first `exact` samples are kept so small windows get an exact quantile.
+
+        Args:
+            p (float): Quantile to estimate, e.g. 0.95
+            exact (int, optional): Number of samples to keep before switching to the estimate. Defaults to 64.
+        """
+        self.p = p
+        self.exact = exact
+        self.samples = []
+        self.heights = []
+        self.positions = [0, 1, 2, 3, 4]
+        self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x: float):
+        if self.samples is not None:
+            self.samples.append(x)
+            if len(self.samples) <= self.exact:
+                return
+            samples, self.samples = self.samples, None
+            for sample in samples:
+                self.add(sample)
+            return
+
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            bisect.insort(q, x)
+            return
+
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        # Move the middle markers towards their desired positions
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                h = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+                )
+                if not q[i - 1] < h < q[i + 1]:
+                    h = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = h
+                n[i] += d
+
+    def value(self):
+        """Get the current estimate, exact (nearest rank) while all samples are kept
+
+        Returns:
+            float: Estimated quantile
+        """
+        if self.samples is not None:
+            return sorted(self.samples)[max(math.ceil(self.p * len(self.samples)) - 1, 0)]
+        return self.heights[2]
+
+
+class Rollup:
+    __slots__ = ("start", "count", "min", "max", "total", "quantile")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.total = 0.0
+        self.quantile = P2Quantile(0.95)
+
+    def add(self, value: float):
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.total += value
+        self.quantile.add(value)
+
+
+class RollupSink:
+    def __init__(self, sink, windows: list, raw_sink=None):
+        """
+        Streaming window aggregates of every metric.
+        For each window length, samples are aggregated over windows aligned to the epoch and the
+        min, max, mean, p95 and count of a closed window are logged as `<key>/<window>s/<stat>`,
+        timestamped at the end of the window. Memory use is constant per metric and window.
+
+        Args:
+            sink (MetricSink): Sink to log rollups to
+            windows (list): Window lengths in seconds
+            raw_sink (MetricSink, optional): Sink to forward raw samples to, None drops them. Defaults to None.
+        """
+        self.sink = sink
+        self.raw_sink = raw_sink
+        self.windows = {w: {} for w in windows}
+        self.lock = threading.Lock()
+
+    def log_metric(self, key: str, value: float, timestamp: float = None, step: int = 0):
+        self.log_metrics({key: value}, timestamp, step)
+
+    def log_metrics(self, metrics: dict, timestamp: float = None, step: int = 0):
+        timestamp = timestamp or time()
+        if self.raw_sink is not None:
+            self.raw_sink.log_metrics(metrics, timestamp, step)
+
+        closed = {}
+        with self.lock:
+            for window, rollups in self.windows.items():
+                start = timestamp - timestamp % window
+                for key, value in metrics.items():
+                    if value != value:
+                        # NaN
+                        continue
+                    rollup = rollups.get(key)
+                    if rollup is None or rollup.start != start:
+                        if rollup is not None:
+                            self._summarise(closed, key, window, rollup)
+                        rollup = rollups[key] = Rollup(start)
+                    rollup.add(value)
+        self._log(closed, step)
+
+    def close(self):
+        """Log the partial windows that are still open, the wrapped sinks are not closed"""
+        closed = {}
+        with self.lock:
+            for window, rollups in self.windows.items():
+                for key, rollup in rollups.items():
+                    self._summarise(closed, key, window, rollup)
+                rollups.clear()
+        self._log(closed, 0)
+
+    def _summarise(self, closed: dict, key: str, window: float, rollup: Rollup):
+        m = closed.setdefault(rollup.start + window, {})
+        prefix = f"{key}/{window:g}s"
+        m[f"{prefix}/min"] = rollup.min
+        m[f"{prefix}/max"] = rollup.max
+        m[f"{prefix}/mean"] = rollup.total / rollup.count
+        m[f"{prefix}/p95"] = rollup.quantile.value()
+        m[f"{prefix}/count"] = rollup.count
+
+    def _log(self, closed: dict, step: int):
+        for end, m in closed.items():
+            self.sink.log_metrics(m, end, step)
@@ -0,0 +1,163 @@
+"""Environment snapshots (pip, conda, nvidia-smi) cached per environment fingerprint.
+A snapshot is uploaded by the first run that captures it, later runs reference that artifact."""
+
+import hashlib
+import os
+import site
+import subprocess
+import sys
+from pathlib import Path
+
+from mlflow.tracking import MlflowClient, get_tracking_uri
+
+from .. import constants
+
+
+def snapshot_dir():
+    """Get the directory holding cached snapshots
+
+    Returns:
+        Path: Snapshot directory, RADT_SNAPSHOT_DIR or SNAPSHOT_DIR
+    """
+    return Path(os.getenv("RADT_SNAPSHOT_DIR") or constants.SNAPSHOT_DIR).expanduser()
+
+
+def _listing(directory: Path):
+    """Describe a directory by its mtime and entries, without reading any files"""
+    try:
+        return f"{directory}:{directory.stat().st_mtime_ns}:{','.join(sorted(os.listdir(directory)))}"
+    except OSError:
+        return f"{directory}:missing"
+
+
+def _read(path: str):
+    try:
+        return Path(path).read_text()
+    except OSError:
+        return ""
+
+
+def pip_fingerprint():
+    """Fingerprint of the installed Python packages
+
+    Returns:
+        str: Interpreter prefix and the contents of its site-packages directories
+    """
+    paths = site.getsitepackages() + [site.getusersitepackages()]
+    return "\n".join([sys.prefix] + [_listing(Path(p)) for p in paths])
+
+
+def conda_fingerprint():
+    """Fingerprint of the conda environment
+
+    Returns:
+        str: Environment prefix and its conda-meta directory
+    """
+    prefix = os.getenv("CONDA_PREFIX") or sys.prefix
+    return "\n".join([prefix, _listing(Path(prefix) / "conda-meta")])
+
+
+def smi_fingerprint():
+    """Fingerprint of the GPU setup, renewed on driver changes and reboots
+
+    Returns:
+        str: Driver version and boot id
+    """
+    return _read("/proc/driver/nvidia/version") + _read("/proc/sys/kernel/random/boot_id")
+
+
+SNAPSHOTS = {
+    "pip.txt": ([sys.executable, "-m", "pip", "freeze"], pip_fingerprint),
+    "conda.txt": (["conda", "list"], conda_fingerprint),
+    "smi.txt": (["nvidia-smi"], smi_fingerprint),
+}
+
+
+def snapshot_path(name: str, fingerprint: str):
+    """Get the cache file of a snapshot
+
+    Args:
+        name (str): Artifact name
+        fingerprint (str): Fingerprint of the environment
+
+    Returns:
+        Path: Cached snapshot
+    """
+    key = hashlib.sha1(fingerprint.encode()).hexdigest()[:16]
+    return snapshot_dir() / f"{Path(name).stem}-{key}.txt"
+
+
+def reference_path(path: Path):
+    """Get the file recording the artifact a cached snapshot was uploaded as, per tracking server
+
+    Args:
+        path (Path): Cached snapshot
+
+    Returns:
+        Path: Reference file
+    """
+    server = hashlib.sha1(get_tracking_uri().encode()).hexdigest()[:8]
+    return path.with_name(f"{path.stem}-{server}.run")
+
+
+def snapshot(path: Path, command: list):
+    """Get the output of a snapshot command, from cache if the environment is unchanged
+
+    Args:
+        path (Path): Cached snapshot, see snapshot_path
+        command (list): Command producing the snapshot
+
+    Raises:
+        FileNotFoundError: The command is not available
+
+    Returns:
+        str: Snapshot
+    """
+    if path.exists():
+        return path.read_text()
+
+    result = subprocess.run(command, stdout=subprocess.PIPE, universal_newlines=True)
+    if result.returncode == 0:
+        # Write atomically, concurrent runs may be creating the same snapshot
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(result.stdout)
+        os.replace(tmp, path)
+    return result.stdout
+
+
+def capture(client: MlflowClient, run_id: str):
+    """Log the environment snapshots of a run, meant to run in the background
+
+    Args:
+        client (MlflowClient): Client to log with
+        run_id (str): Run to log to
+    """
+    for name, (command, fingerprint) in SNAPSHOTS.items():
+        tag = f"radt.snapshot.{Path(name).stem}"
+        path = snapshot_path(name, fingerprint())
+        reference = reference_path(path)
+        try:
+            if reference.exists():
+                # Uploaded by an earlier run in the same environment
+                client.set_tag(run_id, tag, reference.read_text())
+                continue
+            text = snapshot(path, command)
+        except FileNotFoundError:
+            continue
+        except Exception as e:
+            print(f"Failed to log {name}:", e)
+            continue
+
+        try:
+            client.log_text(run_id, text, name)
+            uri = f"runs:/{run_id}/{name}"
+            client.set_tag(run_id, tag, uri)
+        except Exception as e:
+            print(f"Failed to log {name}:", e)
+            continue
+        if path.exists():
+            # Only snapshots of successful commands are cached and referenced
+            tmp = reference.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(uri)
+            os.replace(tmp, reference)
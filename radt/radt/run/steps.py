@@ -0,0 +1,132 @@
+"""Step and phase timing for training loops"""
+
+import threading
+from array import array
+from queue import SimpleQueue
+from time import perf_counter_ns, time
+
+
+def percentile(values: list, p: float):
+    """Nearest-rank percentile
+
+    Args:
+        values (list): Sorted values
+        p (float): Percentile between 0 and 100
+
+    Returns:
+        float: Percentile of the values
+    """
+    return values[max(-(-len(values) * p // 100) - 1, 0)]
+
+
+class Phase:
+    __slots__ = ("timer", "name", "started")
+
+    def __init__(self, timer, name: str):
+        """
+        Context manager timing one phase of a step, e.g. "dataload" or "forward".
+        Every use gets its own instance, so phases can be nested or timed from several threads.
+
+        Args:
+            timer (StepTimer): Timer to record into
+            name (str): Phase name
+        """
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.started = perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        phases = self.timer.phases
+        phases[self.name] = phases.get(self.name, 0) + perf_counter_ns() - self.started
+
+
+class StepTimer:
+    def __init__(self, sink, window: int):
+        """
+        Records step times into a preallocated ring buffer of `window` steps.
+        Every full window is handed to a background thread which logs throughput,
+        step time percentiles and the share of every phase.
+
+        Args:
+            sink (MetricSink): Sink to log to
+            window (int): Steps per report
+        """
+        self.sink = sink
+        self.window = window
+        self.durations = array("q", bytes(8 * window))
+        self.index = 0
+        self.steps = 0
+        self.samples = 0
+        self.last = None
+        self.phases = {}
+
+        self.reports = SimpleQueue()
+        self.reporter = threading.Thread(target=self._report, daemon=True)
+        self.reporter.start()
+
+    def phase(self, name: str):
+        """Get a context manager timing a phase
+
+        Args:
+            name (str): Phase name
+
+        Returns:
+            Phase: Context manager
+        """
+        return Phase(self, name)
+
+    def step(self, batch_size: int = 0):
+        """Mark the end of a step, the first call starts the clock
+
+        Args:
+            batch_size (int, optional): Samples processed in the step. Defaults to 0.
+        """
+        now = perf_counter_ns()
+        if self.last is None:
+            self.last = now
+            self.phases = {}
+            return
+        self.durations[self.index] = now - self.last
+        self.last = now
+        self.index += 1
+        self.steps += 1
+        self.samples += batch_size
+        if self.index == self.window:
+            self.flush()
+
+    def flush(self):
+        """Hand the steps recorded since the last report to the reporter"""
+        if self.index:
+            self.reports.put(
+                (self.durations[: self.index], self.samples, self.phases, self.steps, time())
+            )
+        self.index = 0
+        self.samples = 0
+        self.phases = {}
+
+    def close(self):
+        """Report the remaining steps and wait for the reporter to finish"""
+        self.flush()
+        self.reports.put(None)
+        self.reporter.join()
+
+    def _report(self):
+        while (report := self.reports.get()) is not None:
+            durations, samples, phases, step, timestamp = report
+            total = sum(durations) / 1e9
+            durations = sorted(durations)
+            m = {
+                "RADT - steps/steps per s": len(durations) / total,
+                "RADT - steps/step time mean ms": 1000 * total / len(durations),
+                "RADT - steps/step time p50 ms": percentile(durations, 50) / 1e6,
+                "RADT - steps/step time p90 ms": percentile(durations, 90) / 1e6,
+                "RADT - steps/step time p99 ms": percentile(durations, 99) / 1e6,
+            }
+            if samples:
+                m["RADT - steps/samples per s"] = samples / total
+            for name, elapsed in phases.items():
+                m[f"RADT - steps/phase {name} share"] = elapsed / 1e9 / total
+            self.sink.log_metrics(m, timestamp, step)
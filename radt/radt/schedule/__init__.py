@@ -1 +1,11 @@
-from .schedule import start_schedule
+def __getattr__(name):
+    """Import the scheduler on first use, it loads mlflow. Planning does not."""
+    if name == "start_schedule":
+        from .schedule import start_schedule
+
+        return start_schedule
+    if name == "start_plan":
+        from .plan import start_plan
+
+        return start_plan
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
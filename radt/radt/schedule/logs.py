@@ -0,0 +1,174 @@
+"""Run logs spooled to disk and uploaded in compressed chunks while the runs are in progress"""
+
+import gzip
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from queue import Empty, Queue
+
+from mlflow.tracking import MlflowClient
+
+from .. import constants
+
+
+class LogUploader:
+    def __init__(self):
+        """
+        Background thread compressing and uploading log chunks.
+        Uploaded chunks are removed from disk, chunks that fail to upload are kept.
+        In between uploads, it rotates chunks of its spools that have reached their maximum age,
+        so output of quiet runs is uploaded while they are in progress as well.
+        """
+        self.client = MlflowClient()
+        self.queue = Queue()
+        self.spools = []
+        self.failed = 0
+        self.thread = threading.Thread(target=self._upload, daemon=True)
+        self.thread.start()
+
+    def watch(self, spool):
+        """Rotate the chunks of a spool once they reach their maximum age
+
+        Args:
+            spool (LogSpool): Spool uploading through this uploader
+        """
+        self.spools.append(spool)
+
+    def put(self, run_id: str, path: Path, artifact_path: str):
+        """Queue a chunk for upload
+
+        Args:
+            run_id (str): Run to upload to
+            path (Path): Uncompressed chunk
+            artifact_path (str): Artifact directory within the run
+        """
+        self.queue.put((run_id, path, artifact_path))
+
+    def close(self, timeout: float = None):
+        """Wait for all queued chunks to be uploaded
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None.
+        """
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _upload(self):
+        checked = time.monotonic()
+        while True:
+            try:
+                item = self.queue.get(timeout=constants.LOG_ROTATE_CHECK)
+            except Empty:
+                item = ()
+            if time.monotonic() - checked >= constants.LOG_ROTATE_CHECK:
+                for spool in list(self.spools):
+                    spool.expire()
+                checked = time.monotonic()
+            if item is None:
+                return
+            if not item:
+                continue
+
+            run_id, path, artifact_path = item
+            compressed = path.with_name(f"{path.name}.gz")
+            try:
+                with open(path, "rb") as src, gzip.open(compressed, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                path.unlink()
+                self.client.log_artifact(run_id, str(compressed), artifact_path)
+                compressed.unlink()
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed to upload {path.name}, kept in {path.parent}:", e)
+
+
+class LogSpool:
+    def __init__(self, directory: Path, name: str, uploader: LogUploader, artifact_path: str = "logs"):
+        """
+        Log written to disk and rotated into numbered chunks once it reaches
+        RADT_LOG_ROTATE_BYTES or RADT_LOG_ROTATE_INTERVAL seconds.
+        Chunks are uploaded as `<artifact_path>/<name>.<index>.txt.gz` once a run is attached,
+        earlier chunks are held back until then.
+
+        Args:
+            directory (Path): Directory to spool to
+            name (str): Name of the log
+            uploader (LogUploader): Uploader for finished chunks
+            artifact_path (str, optional): Artifact directory within the run. Defaults to "logs".
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.name = name
+        self.uploader = uploader
+        self.artifact_path = artifact_path
+        self.max_bytes = int(os.getenv("RADT_LOG_ROTATE_BYTES") or constants.LOG_ROTATE_BYTES)
+        self.max_age = float(os.getenv("RADT_LOG_ROTATE_INTERVAL") or constants.LOG_ROTATE_INTERVAL)
+
+        self.run_id = None
+        self.held = []
+        self.index = 0
+        self.file = None
+        self.size = 0
+        # The uploader rotates chunks by age from its own thread
+        self.lock = threading.Lock()
+        uploader.watch(self)
+
+    def append(self, line: str):
+        """Write a line
+
+        Args:
+            line (str): Line, including its newline
+        """
+        data = line.encode()
+        with self.lock:
+            if self.file is None:
+                self.index += 1
+                self.path = self.directory / f"{self.name}.{self.index:04d}.txt"
+                self.file = open(self.path, "wb")
+                self.opened = time.monotonic()
+                self.size = 0
+            self.file.write(data)
+            self.size += len(data)
+            if self.size >= self.max_bytes:
+                self._rotate()
+
+    def expire(self):
+        """Finish the current chunk if it has reached its maximum age"""
+        with self.lock:
+            if self.file is not None and time.monotonic() - self.opened >= self.max_age:
+                self._rotate()
+
+    def rotate(self):
+        """Finish the current chunk and upload it"""
+        with self.lock:
+            self._rotate()
+
+    def attach(self, run_id: str):
+        """Set the run to upload chunks to, releasing held back chunks
+
+        Args:
+            run_id (str): Run to upload to
+        """
+        with self.lock:
+            self.run_id = run_id
+            self._release()
+
+    def close(self):
+        """Finish the last chunk"""
+        self.rotate()
+
+    def _rotate(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        self.held.append(self.path)
+        if self.run_id is not None:
+            self._release()
+
+    def _release(self):
+        for path in self.held:
+            self.uploader.put(self.run_id, path, self.artifact_path)
+        self.held = []
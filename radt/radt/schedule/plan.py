@@ -0,0 +1,395 @@
+"""Planning of a schedule: letters, environment and commands of every run, before any device is touched"""
+
+from argparse import Namespace
+from pathlib import Path
+from string import ascii_uppercase
+from time import perf_counter
+
+import numpy as np
+import pandas as pd
+
+from .. import constants
+from ..run.listeners import parse_listener
+from . import sweep
+from .state import ExperimentState, row_keys, state_path
+
+# Plan columns holding environment variables of a run
+ENV_PREFIXES = ("MLFLOW_", "SMI_", "RADT_")
+
+# Listener environment variables, every plan has all of them so plans can be concatenated
+LISTENER_ENV = [
+    f"RADT_LISTENER_{k.upper()}{option}"
+    for k in constants.RUN_LISTENERS
+    for option in ("", "_INTERVAL", "_DEADBAND", "_RAW")
+]
+
+# Plan columns printed by `radt plan`
+SUMMARY_COLUMNS = ["Workload_Unique", "Letter", "Devices", "Collocation", "File", "Params"]
+
+
+def determine_operating_mode(
+    parsed_args: Namespace, file: Path, args_passthrough: list
+):
+    """Determine and initialise whether running a .csv or .py file
+
+    Args:
+        parsed_args (Namespace): Schedule arguments
+        file (Path): Path to file
+        args_passthrough (list): Run arguments
+
+    Returns:
+        pd.DataFrame, pd.Dataframe: Dataframe to run, copy
+    """
+    if file.suffix == ".py":
+        df_raw = None
+        df = pd.DataFrame(np.empty(0, dtype=np.dtype(constants.CSV_FORMAT)))
+
+        if len(args_passthrough):
+            params = " ".join(args_passthrough)
+        else:
+            params = ""
+
+        df.loc[0] = pd.Series(
+            {
+                "Experiment": parsed_args.experiment,
+                "Workload": parsed_args.workload,
+                "Status": "",
+                "Run": "",
+                "Devices": parsed_args.devices,
+                "Collocation": parsed_args.collocation,
+                "Listeners": parsed_args.listeners,
+                "File": str(file),
+                "Params": params,
+            }
+        )
+
+    elif file.suffix == ".csv":
+        df_raw = pd.read_csv(file, delimiter=",", header=0, skipinitialspace=True)
+        df_raw["Collocation"] = df_raw["Collocation"].astype(str)
+        df = df_raw.copy()
+
+    return df, df_raw
+
+
+def plan_listeners(listeners: str, no_raw: list):
+    """Split a listener string into run listeners, a workload listener and environment variables
+
+    Args:
+        listeners (str): Listeners separated by +
+        no_raw (list): Listeners that only log rollups
+
+    Returns:
+        str, str, dict: Run listeners, workload listener template, environment variables
+    """
+    run_listeners = []
+    workload_listener = ""
+    env = {f"RADT_LISTENER_{k.upper()}": "False" for k in constants.RUN_LISTENERS}
+
+    for listener in listeners.split("+"):
+        k, interval, deadband = parse_listener(listener)
+        if k in constants.WORKLOAD_LISTENERS:
+            workload_listener = constants.WORKLOAD_LISTENERS[k]
+            continue
+        run_listeners.append(listener)
+        env[f"RADT_LISTENER_{k.upper()}"] = "True"
+        if interval:
+            env[f"RADT_LISTENER_{k.upper()}_INTERVAL"] = interval
+        if deadband:
+            env[f"RADT_LISTENER_{k.upper()}_DEADBAND"] = deadband
+        if k in no_raw:
+            env[f"RADT_LISTENER_{k.upper()}_RAW"] = "False"
+
+    return "+".join(run_listeners), workload_listener, env
+
+
+def workload_names(df: pd.DataFrame):
+    """Get the workload of every row
+
+    Args:
+        df (pd.DataFrame): Experiment
+
+    Returns:
+        pd.Series: Workload per row, `<experiment>+<workload>` unless given by a Workload_Unique column
+    """
+    if "Workload_Unique" in df:
+        return df["Workload_Unique"]
+    return df["Experiment"].astype(str) + "+" + df["Workload"].astype(str)
+
+
+def make_plan(df: pd.DataFrame, parsed_args: Namespace, stage: Path):
+    """Plan the runs of every workload that has not finished yet, in a single pass over the experiment.
+    Everything that does not depend on the device setup is decided here: letters, colours, project
+    directories, environment variables, listeners, commands and MLproject files.
+
+    Args:
+        df (pd.DataFrame): Experiment
+        parsed_args (Namespace): Schedule arguments
+        stage (Path): Directory to stage the project directories of the runs in
+
+    Returns:
+        pd.DataFrame: Plan, one row per run indexed like the experiment
+        list: Workloads that are skipped
+    """
+    workloads = workload_names(df)
+
+    # Skip workloads that have been finished already
+    # Reruns FAILED workloads when --rerun is specified
+    status = df["Status"].fillna("").astype(str)
+    done = status.str.contains("FINISHED") | (
+        status.str.contains("FAILED") & (not parsed_args.rerun)
+    )
+    done = done.groupby(workloads, sort=False).all()
+    skipped = list(done.index[done])
+    df, workloads = df[~workloads.isin(skipped)], workloads[~workloads.isin(skipped)]
+
+    plan = pd.DataFrame(index=df.index)
+    plan["Workload_Unique"] = workloads
+    plan["Source"] = df["Source"] if "Source" in df else df.index
+    plan["Sweep"] = df["Sweep"] if "Sweep" in df else np.nan
+    plan["Key"] = row_keys(df)
+    plan["Experiment"] = df["Experiment"]
+    plan["Workload"] = df["Workload"]
+    plan["Devices"] = devices = df["Devices"].fillna("").astype(str)
+    plan["Collocation"] = collocation = df["Collocation"].fillna("").astype(str)
+    plan["Params"] = df["Params"].fillna("").astype(str)
+
+    # Runs are lettered by their devices, numbered when several share them, and suffixed by collocation
+    same_devices = plan.groupby(["Workload_Unique", "Devices"], sort=False)["Devices"]
+    number = same_devices.cumcount().map(ascii_uppercase.__getitem__)
+    letters = devices.where(same_devices.transform("size") <= 1, devices + "_" + number)
+    letters = letters.where(
+        collocation.str.strip().isin(["-", "", "nan"]), letters + "_" + collocation
+    )
+    plan["Letter"] = letters
+    plan["Colour"] = [
+        constants.COLOURS[i % 6]
+        for i in plan.groupby("Workload_Unique", sort=False).cumcount()
+    ]
+
+    # Project files
+    files = df["File"].astype(str)
+    unique_files = files.unique()
+    plan["Filepath"] = files.map(
+        dict(zip(unique_files, (str(Path(f).parent.absolute()) for f in unique_files)))
+    )
+    plan["File"] = files.map(dict(zip(unique_files, (Path(f).name for f in unique_files))))
+    plan["Stagepath"] = f"{stage}/" + plan["Workload_Unique"] + "/" + plan["Letter"]
+    plan["Listeners"] = df["Listeners"].astype(str)
+
+    # Listeners, parsed once per distinct listener string
+    no_raw = parsed_args.no_raw.split("+")
+    parsed = {l: plan_listeners(l, no_raw) for l in plan["Listeners"].unique()}
+    plan["RunListeners"] = plan["Listeners"].map({l: p[0] for l, p in parsed.items()})
+    templates = plan["Listeners"].map({l: p[1] for l, p in parsed.items()})
+    plan["WorkloadListener"] = [
+        t.format(Experiment=e, Workload=w, Letter=l) if t else ""
+        for t, e, w, l in zip(templates, plan["Experiment"], plan["Workload"], letters)
+    ]
+
+    # Commands
+    envmanager = "conda" if parsed_args.useconda else "local"
+    plan["Command"] = [
+        constants.COMMAND.format(
+            Stagepath=s, Envmanager=envmanager, Letter=l, Workload=w, Listeners=ls, File=f
+        )
+        for s, l, w, ls, f in zip(
+            plan["Stagepath"], letters, plan["Workload"], plan["Listeners"], plan["File"]
+        )
+    ]
+    head, tail = constants.MLPROJECT_CONTENTS.replace(
+        "<REPLACE_ENV>", "conda_env: conda.yaml" if parsed_args.useconda else ""
+    ).split("<REPLACE_COMMAND>")
+    plan["MLproject"] = [
+        head
+        + constants.MLFLOW_COMMAND.format(
+            Workdir=d, WorkloadListener=wl, Listeners=ls, File=f, Params=p or '""'
+        )
+        + tail
+        for d, wl, ls, f, p in zip(
+            plan["Filepath"],
+            plan["WorkloadListener"],
+            plan["RunListeners"],
+            plan["File"],
+            plan["Params"],
+        )
+    ]
+
+    # Environment, device dependent variables are added when the workload is set up
+    plan["MLFLOW_EXPERIMENT_ID"] = plan["Experiment"].astype(str).str.strip()
+    plan["SMI_GPU_ID"] = devices
+    plan["RADT_MAX_EPOCH"] = str(parsed_args.max_epoch)
+    plan["RADT_MAX_TIME"] = str(parsed_args.max_time * 60)
+    plan["RADT_MANUAL_MODE"] = "True" if parsed_args.manual else "False"
+    plan["RADT_DEADBAND"] = "" if parsed_args.deadband is None else str(parsed_args.deadband)
+    plan["RADT_HEARTBEAT"] = str(parsed_args.heartbeat)
+    plan["RADT_ROLLUP"] = parsed_args.rollup
+    plan["RADT_MLPROJECT"] = plan["Stagepath"] + "/MLproject"
+    listener_env = pd.DataFrame.from_dict(
+        {l: p[2] for l, p in parsed.items()}, orient="index", dtype=object
+    ).reindex(columns=LISTENER_ENV)
+    plan = plan.join(listener_env.loc[plan["Listeners"]].set_axis(plan.index))
+
+    return plan, skipped
+
+
+def plan_batches(
+    df: pd.DataFrame, parsed_args: Namespace, stage: Path, state: ExperimentState = None
+):
+    """Plan the workloads of an experiment in order of execution, a batch of workloads at a time.
+    Rows without sweeps are planned in a single pass, workloads holding sweeps are expanded lazily
+    and planned PLAN_CHUNK_SIZE runs at a time, so memory does not grow with the size of a sweep.
+
+    Args:
+        df (pd.DataFrame): Experiment
+        parsed_args (Namespace): Schedule arguments
+        stage (Path): Directory to stage the project directories of the runs in
+        state (ExperimentState, optional): Journal to skip finished configurations of sweeps. Defaults to None.
+
+    Yields:
+        pd.DataFrame, list: Plan of consecutive workloads, workloads that are skipped
+    """
+    workloads = workload_names(df)
+    swept = set(workloads[sweep.is_sweep(df)])
+    plan, skipped = make_plan(df[~workloads.isin(swept)], parsed_args, stage)
+    positions = plan.groupby("Workload_Unique", sort=False).indices
+    if skipped:
+        yield plan.iloc[:0], skipped
+
+    order = list(pd.unique(workloads))
+    if parsed_args.reorder:
+        # Run workloads with the same device layout back-to-back, in order of first appearance
+        devices = df["Devices"].fillna("").astype(str)
+        collocation = df["Collocation"].fillna("").astype(str).str.strip()
+        layout = (
+            (devices + "\x1f" + collocation)
+            .groupby(workloads, sort=False)
+            .agg(lambda s: "\x1e".join(sorted(s)))
+        )
+        rank = dict(zip(layout.index, pd.factorize(layout)[0]))
+        order.sort(key=rank.get)
+
+    # Workloads without sweeps are batched up to the next workload holding sweeps
+    batch = []
+    for workload in order:
+        if workload in positions:
+            batch.append(positions[workload])
+        elif workload in swept:
+            if batch:
+                yield plan.iloc[np.concatenate(batch)], []
+                batch = []
+            yield from plan_sweep(df[workloads == workload], workload, parsed_args, stage, state)
+    if batch:
+        yield plan.iloc[np.concatenate(batch)], []
+
+
+def plan_sweep(
+    df_workload: pd.DataFrame,
+    workload: str,
+    parsed_args: Namespace,
+    stage: Path,
+    state: ExperimentState = None,
+):
+    """Plan the configurations of a workload holding sweeps, PLAN_CHUNK_SIZE runs at a time
+
+    Args:
+        df_workload (pd.DataFrame): Rows of the workload
+        workload (str): Workload name, configurations are named `<workload>/<digest>`
+        parsed_args (Namespace): Schedule arguments
+        stage (Path): Directory to stage the project directories of the runs in
+        state (ExperimentState, optional): Journal to skip finished configurations. Defaults to None.
+
+    Yields:
+        pd.DataFrame, list: Plan of configurations, configurations that are skipped
+    """
+    for df in sweep.expand(df_workload, constants.PLAN_CHUNK_SIZE):
+        names = workload + "/" + df["Config"]
+        df["Workload_Unique"] = names
+        # The status of the row holding the sweep summarises it, configurations are looked up in the journal
+        df["Status"] = ""
+
+        skipped = []
+        if state is not None:
+            done = pd.Series(
+                state.finished(df.index, row_keys(df), parsed_args.rerun), index=df.index
+            )
+            done = done.groupby(names, sort=False).all()
+            skipped = list(done.index[done])
+            df = df[~names.isin(skipped)]
+        plan, _ = make_plan(df, parsed_args, stage)
+        yield plan, skipped
+
+
+def iter_workloads(
+    df: pd.DataFrame, parsed_args: Namespace, stage: Path, state: ExperimentState = None
+):
+    """Plan the workloads of an experiment in order of execution, see plan_batches
+
+    Args:
+        df (pd.DataFrame): Experiment
+        parsed_args (Namespace): Schedule arguments
+        stage (Path): Directory to stage the project directories of the runs in
+        state (ExperimentState, optional): Journal to skip finished configurations of sweeps. Defaults to None.
+
+    Yields:
+        str, pd.DataFrame: Workload and its plan, None if the workload is skipped
+    """
+    for plan, skipped in plan_batches(df, parsed_args, stage, state):
+        for workload in skipped:
+            yield workload, None
+        # Workloads are only sliced from their batch when they are consumed
+        yield from plan.groupby("Workload_Unique", sort=False)
+
+
+def run_env(row: pd.Series):
+    """Get the planned environment variables of a run
+
+    Args:
+        row (pd.Series): Row of a plan
+
+    Returns:
+        dict: Environment variables
+    """
+    return {
+        k: str(v) for k, v in row.items() if k.startswith(ENV_PREFIXES) and not pd.isna(v)
+    }
+
+
+def start_plan(parsed_args: Namespace, file: Path, args_passthrough: list):
+    """Print or export the plan of a .py or .csv file without running it
+
+    Args:
+        parsed_args (Namespace): Schedule arguments
+        file (Path): Path to file
+        args_passthrough (list): Run arguments
+    """
+    started = perf_counter()
+    df, df_raw = determine_operating_mode(parsed_args, file, args_passthrough)
+    state = None
+    if isinstance(df_raw, pd.DataFrame) and state_path(file).exists():
+        state = ExperimentState(file)
+        if state.restore(df_raw):
+            df["Run"], df["Status"] = df_raw["Run"], df_raw["Status"]
+
+    # Batches are written as they are planned, so sweeps of any size can be inspected
+    runs, workloads, skipped = 0, 0, 0
+    for plan, skipped_workloads in plan_batches(df, parsed_args, Path("<stage>"), state):
+        skipped += len(skipped_workloads)
+        if plan.empty:
+            continue
+        header = runs == 0
+        runs += len(plan)
+        workloads += plan["Workload_Unique"].nunique()
+        if parsed_args.output:
+            plan.to_csv(
+                parsed_args.output, index_label="Row", header=header, mode="w" if header else "a"
+            )
+        else:
+            with pd.option_context("display.max_rows", None, "display.width", None):
+                print(plan[SUMMARY_COLUMNS + ["Command"]].to_string(header=header))
+    if state is not None:
+        state.close()
+
+    print(
+        f"Planned {runs} runs in {workloads} workloads, "
+        f"skipping {skipped} finished workloads ({perf_counter() - started:.3f}s)"
+    )
@@ -1,20 +1,30 @@
+import itertools
 import os
+import selectors
+import shutil
 import sys
+import tempfile
+import threading
 import time
 from argparse import Namespace
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import ExitStack
 from pathlib import Path
-from queue import Empty, Queue
-from string import ascii_uppercase
 from subprocess import PIPE, STDOUT, Popen
-from threading import Thread
 
 import migedit
-import numpy as np
 import pandas as pd
 from mlflow.tracking import MlflowClient
 
 from .. import constants
+from ..run.handshake import LaunchBarrier
+from .logs import LogSpool, LogUploader
+from .plan import determine_operating_mode, iter_workloads, run_env
+from .state import ExperimentState
+from ..run.listeners.daemon import SamplingDaemon
+
+# Serializes device setup and teardown (MIG, DCGM, MPS) between concurrent workloads
+SETUP_LOCK = threading.Lock()
 
 
 def coloured(colour: int, string: str):
@@ -92,43 +102,128 @@ def execute_command(cmd: str, shell: bool = False, vars: dict = {}):
     return result
 
 
-def enqueue_output(out: PIPE, queue: Queue):
-    """Enqueue any output from pipe into queue
+def stage_project(source: Path, target: Path, mlproject: str):
+    """Create an isolated project directory for a run,
+    holding symlinks to the project's files and the run's own MLproject
 
     Args:
-        out (PIPE): Pipe to read from
-        queue (Queue): Queue to write to
+        source (Path): Project directory
+        target (Path): Directory to create
+        mlproject (str): Contents of the MLproject file
     """
-    try:
-        for line in iter(out.readline, b""):
-            queue.put(line)
-    except ValueError:
-        pass
-    out.close()
-
-
-def process_output(popens, log_runs, log, run_ids):
-    for colour, letter, p, q, _ in popens:
-        while True:  # p.poll() is None:
-            try:
-                l = q.get_nowait()
-                if not l.strip() and not "\n" in l:
-                    continue
-            except Empty:
-                break
-            else:
-                log_runs[letter].append(l)
-                log.append(runformat(None, letter, l))
-                print(runformat(colour, letter, l), end="")
+    target.mkdir(parents=True)
+    for entry in source.iterdir():
+        if entry.name != "MLproject":
+            (target / entry.name).symlink_to(entry)
+    (target / "MLproject").write_text(mlproject)
+
+
+class OutputMultiplexer:
+    def __init__(self, log: LogSpool):
+        """
+        Event-driven collection of run output.
+        Sleeps until a run writes output or exits, or until something else registered with `watch` is readable.
+
+        Args:
+            log (LogSpool): Log of all runs, lines are prefixed with their letter
+        """
+        self.selector = selectors.DefaultSelector()
+        self.log = log
+        self.log_runs = {}
+        self.runs = []
+        self.colours = {}
+        self.partial = {}
+
+    def add(self, colour: int, letter: str, p: Popen, log: LogSpool):
+        """Collect the output of a run
+
+        Args:
+            colour (int): Colour of the run's prefix
+            letter (str): Letter of the run
+            p (Popen): Run process, with binary stdout
+            log (LogSpool): Log of the run
+        """
+        self.runs.append((letter, p))
+        self.colours[letter] = colour
+        self.log_runs[letter] = log
+        self.partial[letter] = b""
+        os.set_blocking(p.stdout.fileno(), False)
+        self.selector.register(p.stdout, selectors.EVENT_READ, (self._read, colour, letter))
+        if hasattr(os, "pidfd_open"):
+            # Readable once the process exits, even if a child still holds its stdout
+            pidfd = os.pidfd_open(p.pid)
+            self.selector.register(pidfd, selectors.EVENT_READ, (self._exited, p, None))
+
+    def watch(self, fileobj, callback):
+        """Wake up and call `callback` when a file becomes readable
+
+        Args:
+            fileobj (object): File object or descriptor
+            callback (callable): Called without arguments
+        """
+        self.selector.register(fileobj, selectors.EVENT_READ, (lambda *_: callback(), None, None))
+
+    def running(self):
+        """Check whether any run is still running
+
+        Returns:
+            bool: Any run still running
+        """
+        return any(p.poll() is None for _, p in self.runs)
+
+    def wait(self, timeout: float = None):
+        """Handle events, waiting for at most `timeout` seconds
+
+        Args:
+            timeout (float, optional): Maximum seconds to wait. Defaults to None.
+        """
+        if not hasattr(os, "pidfd_open"):
+            # Without process descriptors, check for exited runs every second
+            timeout = 1.0 if timeout is None else min(timeout, 1.0)
+        for key, _ in self.selector.select(timeout):
+            callback, arg, letter = key.data
+            callback(key.fileobj, arg, letter)
+
+    def drain(self):
+        """Collect the output that is left without waiting"""
+        while ready := [k for k, _ in self.selector.select(0) if k.data[0] == self._read]:
+            for key in ready:
+                self._read(key.fileobj, *key.data[1:])
+        for letter, _ in self.runs:
+            if self.partial[letter]:
+                self._line(self.colours[letter], letter, self.partial[letter] + b"\n")
+                self.partial[letter] = b""
+
+    def close(self):
+        for key in list(self.selector.get_map().values()):
+            self.selector.unregister(key.fileobj)
+            if isinstance(key.fileobj, int) and key.data[0] == self._exited:
+                os.close(key.fileobj)
+        self.selector.close()
+
+    def _exited(self, pidfd: int, p: Popen, _):
+        self.selector.unregister(pidfd)
+        os.close(pidfd)
+        p.poll()
+
+    def _read(self, stdout, colour: int, letter: str):
+        try:
+            data = os.read(stdout.fileno(), 65536)
+        except BlockingIOError:
+            return
+        if not data:
+            self.selector.unregister(stdout)
+            return
 
-                if run_ids[letter]:
-                    continue
+        *lines, self.partial[letter] = (self.partial[letter] + data).split(b"\n")
+        for line in lines:
+            self._line(colour, letter, line + b"\n")
 
-                if "in run with ID '" in l:
-                    run_ids[letter] = (
-                        l.split("in run with ID '")[-1].split("'")[0].strip()
-                    )
-                    print(runformat(colour, letter, f"MAPPED TO {run_ids[letter]}"))
+    def _line(self, colour: int, letter: str, line: bytes):
+        l = line.decode(errors="replace")
+        self.log_runs[letter].append(l)
+        self.log.append(runformat(None, letter, l))
+        print(runformat(colour, letter, l), end="")
 
 
 def execute_workload(cmds: list, timeout: float):
@@ -144,22 +239,30 @@ def execute_workload(cmds: list, timeout: float):
 
     terminate = False
 
-    log = []
+    # Logs are spooled to disk and uploaded in chunks while the runs are in progress
+    log_dir = Path(tempfile.mkdtemp(prefix="radt-logs-"))
+    uploader = LogUploader()
+    log = LogSpool(log_dir / "workload", "log_workload", uploader, "logs/workload")
     log_runs = {}
     popens = []
     returncodes = {}
 
     start_time = time.time()
 
-    # Remove MLprojects
-    for _, _, _, _, _, _, filepath, _ in cmds:
-        while (Path(filepath) / "MLproject").is_file():
-            (Path(filepath) / "MLproject").unlink()
-            time.sleep(2)
+    # Runs report their id over this socket once started and wait to be released together
+    socket_path = (
+        Path(tempfile.gettempdir()) / f"radt-launch-{os.getpid()}-{threading.get_ident()}.sock"
+    )
+    socket_path.unlink(missing_ok=True)
 
-    with ExitStack() as stack:
+    # The barrier is closed first so runs that were never released can exit
+    with ExitStack() as stack, LaunchBarrier(str(socket_path)) as barrier:
+        output = OutputMultiplexer(log)
+        stack.callback(output.close)
+        output.watch(barrier, barrier.clear)
         try:
-            for id, colour, letter, vars, cmd, mlproject, filepath, _ in cmds:
+            # Every run has its own project directory, so all runs are started at once
+            for id, colour, letter, vars, cmd, mlproject, filepath, row in cmds:
                 print(
                     runformat(
                         colour,
@@ -171,43 +274,40 @@ def execute_workload(cmds: list, timeout: float):
                 env = os.environ.copy()
                 for k, v in vars.items():
                     env[k] = str(v)
+                env["RADT_LAUNCH_SOCKET"] = str(socket_path)
+                env["RADT_LAUNCH_LETTER"] = letter
 
-                # Write run blocker
-                with open(Path(filepath) / "radtlock", "w") as lock:
-                    lock.write("")
-
-                # Write mlflow mlproject
-                with open(Path(filepath) / "MLproject", "w") as project_file:
-                    project_file.write(mlproject)
+                stage_project(Path(filepath), Path(row["Stagepath"]), mlproject)
 
                 stack.enter_context(
                     p := Popen(
                         cmd,
                         stdout=PIPE,
                         stderr=STDOUT,
-                        bufsize=1,
+                        bufsize=0,
                         env=env,
-                        universal_newlines=True,
                     )
                 )
 
-                q = Queue()
-                t = Thread(target=enqueue_output, args=(p.stdout, q))
-                t.daemon = True
-                t.start()
-
-                popens.append((colour, letter, p, q, t))
-                log_runs[letter] = []
+                log_runs[letter] = LogSpool(log_dir / letter, "log", uploader)
+                output.add(colour, letter, p, log_runs[letter])
+                popens.append((colour, letter, p))
                 run_ids[letter] = False
 
-                time.sleep(3)
-
-                # Wait for MLproject to be cleared
-                while (Path(filepath) / "MLproject").is_file() or run_ids[
-                    letter
-                ] == False:
-                    process_output(popens, log_runs, log, run_ids)
-                    time.sleep(2)
+            # Wait for all runs to report their id, or to exit before doing so
+            while not barrier.wait(list(log_runs), 0):
+                if all(
+                    p.poll() is not None
+                    for _, letter, p in popens
+                    if barrier.run_id(letter) is None
+                ):
+                    break
+                output.wait()
+            for colour, letter, _ in popens:
+                if run_id := barrier.run_id(letter):
+                    run_ids[letter] = run_id
+                    log_runs[letter].attach(run_id)
+                    print(runformat(colour, letter, f"MAPPED TO {run_id}"))
 
             # Group runs into workload children
             # And add experiment/workload to name
@@ -224,57 +324,44 @@ def execute_workload(cmds: list, timeout: float):
 
                         if not parent_id:
                             parent_id = run_id
+                            log.attach(parent_id)
                         elif parent_id != run_id:
                             client.set_tag(run_id, "mlflow.parentRunId", parent_id)
 
-            # Remove run blockers to start synchronised runs
-            for _, _, _, _, _, _, filepath, _ in cmds:
-                if (Path(filepath) / "radtlock").is_file():
-                    (Path(filepath) / "radtlock").unlink()
-
-            while True:
-
-                # Stop on timeout (failsafe)
-                if time.time() - start_time > timeout + 60:
-                    break
+            # Start synchronised runs
+            barrier.release()
 
-                # Stop once all processes have finished
-                for _, _, p, _, _ in popens:
-                    # Check if process is alive
-                    if p.poll() is None:
-                        break
-                else:
-                    break
-
-                process_output(popens, log_runs, log, run_ids)
+            # Sleep until output arrives, a run exits, or the timeout (failsafe) is reached
+            deadline = start_time + timeout + 60
+            while output.running() and time.time() < deadline:
+                output.wait(deadline - time.time())
+            output.drain()
 
         except KeyboardInterrupt:
             try:
                 sysprint("Interrupting runs... Please wait")
                 terminate = True
 
-                time.sleep(1)
-                for colour, letter, p, q, t in popens:
-                    last_update = time.time()
-                    while time.time() - last_update < 1.0 or p.poll() is None:
-                        try:
-                            l = q.get_nowait()
-                            if not l.strip() and not "\n" in l:
-                                continue
-                        except Empty:
-                            pass
-                        else:
-                            last_update = time.time()
-                            log_runs[letter].append(l)
-                            log.append(runformat(None, letter, l))
-                            print(runformat(colour, letter, l), end="")
+                # Runs receive the interrupt as well, collect their output until they have stopped
+                while output.running():
+                    output.wait()
+                output.drain()
             except KeyboardInterrupt:
                 pass
 
-        for _, letter, p, _, _ in popens:
+        for _, letter, p in popens:
             returncodes[letter] = p.returncode
 
     sysprint("Sending logs to server.")
+    log.close()
+    for run_log in log_runs.values():
+        run_log.close()
+    uploader.close()
+    if uploader.failed or any(l.held for l in [log, *log_runs.values()]):
+        sysprint(f"Not all logs could be uploaded, they are kept in {log_dir}")
+    else:
+        shutil.rmtree(log_dir, ignore_errors=True)
+
     results = []
 
     for id, _, letter, _, _, _, filepath, row in cmds:
@@ -291,8 +378,9 @@ def execute_workload(cmds: list, timeout: float):
                         run.info.status,
                     )
                 )
-                client.log_text(run_id, "".join(log_runs[letter]), f"log_{run_id}.txt")
-                client.log_text(run_id, "".join(log), f"log_workload.txt")
+                # The workload log is uploaded once, to the first run of the workload
+                if log.run_id:
+                    client.set_tag(run_id, "radt.workload_log", f"runs:/{log.run_id}/logs/workload")
 
                 if row["WorkloadListener"]:
                     try:
@@ -324,66 +412,60 @@ def get_gpu_ids():
     return gpus
 
 
-def make_dcgm_groups(dev_table: pd.DataFrame):
-    """Removes old DCGM groups and make a DCGM group with the required devices.
+def remove_dcgm_groups(group_ids: set = None):
+    """Remove DCGM groups
 
     Args:
-        dev_table (pd.DataFrame): Run to device mapping table.
+        group_ids (set, optional): Groups to remove. Defaults to all groups but the protected ones.
 
     Raises:
-        ValueError: Group could not be created
-
-    Returns:
-        bool: Whether DCGMI is available.
-        pd.DataFrame: Run to id mapping table.
+        ValueError: Group could not be deleted
     """
-
     try:
-        # Grab existing groups
-        result = [l for l in execute_command("dcgmi group -l") if "Group ID" in l]
-        group_ids = [int(l.split("|")[-2]) for l in result]
+        if group_ids is None:
+            # Grab existing groups
+            result = [l for l in execute_command("dcgmi group -l") if "Group ID" in l]
+            group_ids = [int(l.split("|")[-2]) for l in result]
 
         # Delete groups. First two are protected and shouldn't be deleted
-        if len(group_ids) > 1:
-            for i in group_ids:
-                if i in (0, 1):
-                    continue
-
-                result = "".join(execute_command(f"dcgmi group -d {i}")).lower()
-                if "error" in result:
-                    raise ValueError(
-                        "DCGMI group index not found. Could not be deleted"
-                    )
+        for i in group_ids:
+            if i in (0, 1):
+                continue
 
-        set_ids = {}
-        for i, s in enumerate(dev_table.sort_values().unique()):
-            # Create a new group
-            result = "".join(execute_command(f"dcgmi group -c mldnn_{i}")).lower()
+            result = "".join(execute_command(f"dcgmi group -d {i}")).lower()
             if "error" in result:
-                raise ValueError("DCGMI group could not be created.")
-            group_id = int(result.split("group id of ")[1].split()[0])
+                raise ValueError("DCGMI group index not found. Could not be deleted")
+    except FileNotFoundError:
+        # DCGMI not found, continue
+        pass
 
-            gpu_ids = ",".join(list(s))
 
-            # Add the gpu ids to the new group
-            result = "".join(
-                execute_command(f"dcgmi group -g {group_id} -a {gpu_ids}")
-            ).lower()
-            if "error" in result:
-                raise ValueError("DCGMI group could not be set up with required GPUs.")
+def make_dcgm_group(entities: frozenset):
+    """Make a DCGM group with the required devices.
 
-            set_ids[s] = group_id
+    Args:
+        entities (frozenset): GPU or MIG entity ids
 
-        dcgmi_table = {}
-        for i, v in dev_table.items():
-            dcgmi_table[i] = set_ids[v]
-        return True, dcgmi_table
-    except (FileNotFoundError, ValueError) as e:
-        sysprint(f"DCGMI not found or unreachable. Continuing without DCGMI. ({e})")
-        dcgmi_table = {}
-        for i, v in dev_table.items():
-            dcgmi_table[i] = ""
-        return False, dcgmi_table
+    Raises:
+        ValueError: Group could not be created
+
+    Returns:
+        int: Group id
+    """
+    # Create a new group
+    result = "".join(execute_command(f"dcgmi group -c mldnn")).lower()
+    if "error" in result:
+        raise ValueError("DCGMI group could not be created.")
+    group_id = int(result.split("group id of ")[1].split()[0])
+
+    gpu_ids = ",".join(sorted(entities))
+
+    # Add the gpu ids to the new group
+    result = "".join(execute_command(f"dcgmi group -g {group_id} -a {gpu_ids}")).lower()
+    if "error" in result:
+        raise ValueError("DCGMI group could not be set up with required GPUs.")
+
+    return group_id
 
 
 def make_mps(df_workload: pd.DataFrame, gpu_uuids: dict):
@@ -418,6 +500,24 @@ def make_mps(df_workload: pd.DataFrame, gpu_uuids: dict):
             )
 
 
+def remove_mig_devices(gpus: set, disable: bool = True):
+    """Remove the MIG compute and GPU instances of specific GPUs
+
+    Args:
+        gpus (set): GPU indices
+        disable (bool, optional): Whether to disable MIG mode as well. Defaults to True.
+    """
+    try:
+        for gpu in sorted(gpus):
+            execute_command(f"nvidia-smi mig -dci -i {gpu}")
+            execute_command(f"nvidia-smi mig -dgi -i {gpu}")
+            if disable:
+                execute_command(f"nvidia-smi -i {gpu} -mig 0")
+    except FileNotFoundError:
+        # SMI not found, continue
+        pass
+
+
 def remove_mps():
     """Remove MPS"""
     execute_command(["echo quit | nvidia-cuda-mps-control"], shell=True)
@@ -428,209 +528,366 @@ def clear_page_cache():
     execute_command(['sudo sh -c "/bin/echo 3 > /proc/sys/vm/drop_caches"'], shell=True)
 
 
-def determine_operating_mode(
-    parsed_args: Namespace, file: Path, args_passthrough: list
+class DeviceState:
+    def __init__(self):
+        """
+        Device setup (MIG instances, MPS daemon, DCGM groups) left behind by previous workloads.
+        Workloads only change what differs from the setup they need, so consecutive workloads
+        with the same layout reuse it.
+        """
+        self.mig = {}  # Devices -> (profiles, migedit results)
+        self.mps = frozenset()  # GPU UUIDs served by the MPS daemon
+        self.groups = {}  # DCGM entities -> (group id, GPUs)
+
+    def reset(self):
+        """Remove all MIG devices, MPS and DCGM groups, the state of the node is unknown at start"""
+        try:
+            migedit.remove_mig_devices()
+        except FileNotFoundError:
+            # SMI not found, continue
+            pass
+        remove_mps()
+        try:
+            remove_dcgm_groups()
+        except ValueError as e:
+            sysprint(f"DCGMI groups could not be removed. ({e})")
+        self.mig, self.mps, self.groups = {}, frozenset(), {}
+
+    def close(self):
+        """Stop MPS after the last workload, MIG devices and DCGM groups are kept as before"""
+        if self.mps:
+            remove_mps()
+            self.mps = frozenset()
+
+    def remove_mig(self, gpus: set, keep: set = set()):
+        """Remove the MIG devices of GPUs along with the DCGM groups that refer to them
+
+        Args:
+            gpus (set): GPU indices
+            keep (set, optional): GPUs that stay in MIG mode. Defaults to none.
+        """
+        for devices in [d for d in self.mig if gpus & set(d.split("+"))]:
+            gpus = gpus | set(devices.split("+"))
+            del self.mig[devices]
+        remove_mig_devices(gpus & keep, disable=False)
+        remove_mig_devices(gpus - keep)
+        self.remove_groups([e for e, (_, g) in self.groups.items() if gpus & g])
+
+    def remove_groups(self, entities: list):
+        """Remove DCGM groups
+
+        Args:
+            entities (list): Entity sets of the groups to remove
+        """
+        try:
+            remove_dcgm_groups({self.groups[e][0] for e in entities})
+        except ValueError as e:
+            sysprint(f"DCGMI groups could not be removed. ({e})")
+        for e in entities:
+            del self.groups[e]
+
+    def apply(self, df_workload: pd.DataFrame):
+        """Set up the devices of a workload, changing only what differs from the current setup.
+        Only devices claimed by the workload are touched.
+
+        Args:
+            df_workload (pd.DataFrame): Workload to run
+
+        Returns:
+            pd.DataFrame: Run to CUDA device mapping table.
+            bool: Whether DCGMI is available.
+            dict: Run to DCGM group id mapping table.
+        """
+        dev_table = df_workload["Devices"].astype(str).str.split("+").apply(frozenset)
+        mig_table, entity_table = dev_table.copy(), dev_table.copy()
+        claims = set().union(*dev_table)
+
+        # MIG devices, one set of instances per device string with the profiles in row order
+        mig = {}
+        for i, row in df_workload.iterrows():
+            if "g" in str(row["Collocation"]):  # TODO: fix
+                mig.setdefault(str(row["Devices"]), []).append((i, row["Collocation"]))
+
+        stale = set()
+        for devices, (profiles, _) in self.mig.items():
+            wanted = tuple(p for _, p in mig.get(devices, []))
+            if claims & set(devices.split("+")) and wanted != profiles:
+                stale |= set(devices.split("+"))
+        for devices in mig:
+            if devices not in self.mig:
+                # GPUs of new MIG devices may still be split up differently
+                stale |= {d for d in devices.split("+") if any(d in k.split("+") for k in self.mig)}
+        if stale:
+            self.remove_mig(stale, {d for devices in mig for d in devices.split("+")})
+
+        for devices, rows in mig.items():
+            if devices not in self.mig:
+                profiles = tuple(p for _, p in rows)
+                self.mig[devices] = (
+                    profiles,
+                    [migedit.make_mig_devices(devices, [p], remove_old=False) for p in profiles],
+                )
+            else:
+                sysprint(f"Reusing MIG devices on {devices}")
+            for (i, _), result in zip(rows, self.mig[devices][1]):
+                mig_table.loc[i] = frozenset([y for x in result for y in x[4]])
+                entity_table.loc[i] = frozenset([x[3] for x in result])
+
+        gpu_uuids = get_gpu_ids()
+        for i, v in mig_table.items():
+            s = set()
+            for device in v:
+                device = device.strip()
+                if device in gpu_uuids:
+                    device = gpu_uuids[device]
+                s.add(device)
+            mig_table[i] = frozenset(s)
+
+        # MPS, any running daemon is used by every CUDA process on the node
+        mps = frozenset(
+            gpu_uuids.get(str(d), str(d))
+            for d in df_workload[df_workload["Collocation"].str.strip().str.lower() == "mps"][
+                "Devices"
+            ]
+        )
+        if mps != self.mps:
+            if self.mps:
+                remove_mps()
+                self.mps = frozenset()
+            make_mps(df_workload, gpu_uuids)
+            self.mps = mps
+
+        # DCGM groups, one per distinct set of entities
+        self.remove_groups(
+            [e for e, (_, g) in self.groups.items() if g & claims and e not in set(entity_table)]
+        )
+        dcgmi_table = {}
+        try:
+            for i, entities in entity_table.items():
+                if entities not in self.groups:
+                    self.groups[entities] = (make_dcgm_group(entities), dev_table[i])
+                dcgmi_table[i] = self.groups[entities][0]
+            return mig_table, True, dcgmi_table
+        except (FileNotFoundError, ValueError, IndexError) as e:
+            sysprint(f"DCGMI not found or unreachable. Continuing without DCGMI. ({e})")
+            return mig_table, False, {i: "" for i in entity_table.index}
+
+
+def run_workload(
+    parsed_args: Namespace,
+    workload: str,
+    df_workload: pd.DataFrame,
+    devices: DeviceState,
+    concurrent: bool = False,
+    daemon_socket: str = None,
 ):
-    """Determine and initialise whether running a .csv or .py file
+    """Set up the devices of a workload and execute it
 
     Args:
         parsed_args (Namespace): Schedule arguments
-        file (Path): Path to file
-        args_passthrough (list): Run arguments
+        workload (str): Workload name
+        df_workload (pd.DataFrame): Plan of the workload
+        devices (DeviceState): Current device setup, updated for this workload
+        concurrent (bool, optional): Whether other workloads run at the same time, the page
+            cache is then only cleared before the first workload. Defaults to False.
+        daemon_socket (str, optional): Socket of the node's sampling daemon. Defaults to None.
 
     Returns:
-        pd.DataFrame, pd.Dataframe: Dataframe to run, copy
+        list: Run results to write back to df
     """
-    if file.suffix == ".py":
-        df_raw = None
-        df = pd.DataFrame(np.empty(0, dtype=constants.CSV_FORMAT))
-
-        if len(args_passthrough):
-            params = " ".join(args_passthrough)
-        else:
-            params = ""
-
-        df.loc[0] = pd.Series(
-            {
-                "Experiment": parsed_args.experiment,
-                "Workload": parsed_args.workload,
-                "Status": "",
-                "Run": "",
-                "Devices": parsed_args.devices,
-                "Collocation": parsed_args.collocation,
-                "Listeners": parsed_args.listeners,
-                "File": str(file),
-                "Params": params,
-            }
+    # Device setup is not safe to run in parallel
+    with SETUP_LOCK:
+        if not concurrent:
+            clear_page_cache()
+        mig_table, dcgmi_enabled, dcgmi_table = devices.apply(df_workload)
+        dcgmi_entities = {group: entities for entities, (group, _) in devices.groups.items()}
+
+    # Share machine-wide sampling between all runs on the node
+    daemon_vars = {"RADT_DAEMON_SOCKET": daemon_socket} if daemon_socket else {}
+
+    commands = []
+    for id, row in df_workload.iterrows():
+        vars = run_env(row) | {
+            "CUDA_VISIBLE_DEVICES": ",".join(map(str, mig_table[id])),
+            "RADT_DCGMI_GROUP": str(dcgmi_table[id]),
+            "RADT_DCGMI_ENTITIES": ",".join(sorted(dcgmi_entities.get(dcgmi_table[id], ()))),
+        }
+        if not dcgmi_enabled:
+            vars["RADT_LISTENER_DCGMI"] = "False"
+
+        commands.append(
+            (
+                id,
+                row["Colour"],
+                row["Letter"],
+                vars | daemon_vars,
+                row["Command"].split() + ["-P", f"workload_listener={row['WorkloadListener']}"],
+                row["MLproject"],
+                row["Filepath"],
+                row,
+            )
         )
 
-    elif file.suffix == ".csv":
-        df_raw = pd.read_csv(file, delimiter=",", header=0, skipinitialspace=True)
-        df_raw["Collocation"] = df_raw["Collocation"].astype(str)
-        df = df_raw.copy()
+    # Format and run the row
+    sysprint(f"RUNNING WORKLOAD: {workload}")
+    try:
+        results = execute_workload(commands, parsed_args.max_time * 60)
+    finally:
+        shutil.rmtree(Path(df_workload["Stagepath"].iloc[0]).parent, ignore_errors=True)
 
-    return df, df_raw
+    return results
 
 
-def start_schedule(parsed_args: Namespace, file: Path, args_passthrough: list):
-    """Schedule (execute) a .py or .csv file via RADT
+def workload_claims(df_workload: pd.DataFrame):
+    """Devices claimed by a workload. MPS is node-wide, so MPS workloads claim every device ("*").
 
     Args:
-        parsed_args (Namespace): Schedule arguments
-        file (Path): Path to file
-        args_passthrough (list): Run arguments
-    """
-    df, df_raw = determine_operating_mode(parsed_args, file, args_passthrough)
+        df_workload (pd.DataFrame): Workload to run
 
-    df["Workload_Unique"] = (
-        df["Experiment"].astype(str) + "+" + df["Workload"].astype(str)
+    Returns:
+        frozenset: Claimed device indices
+    """
+    if (df_workload["Collocation"].astype(str).str.strip().str.lower() == "mps").any():
+        return frozenset("*")
+    return frozenset(
+        device.strip()
+        for devices in df_workload["Devices"].astype(str)
+        for device in devices.split("+")
     )
 
-    for workload in df["Workload_Unique"].unique():
-        df_workload = df[df["Workload_Unique"] == workload].copy()
 
-        df_workload["Letter"] = "-"
-        df_workload["Number"] = -1
+def claims_conflict(a: frozenset, b: frozenset):
+    """Whether two sets of device claims overlap
 
-        for i, (id, row) in enumerate(df_workload.iterrows()):
-            # Skip workloads that have been finished already
-            # Reruns FAILED workloads when --rerun is specified
-            if not (
-                "FINISHED" in str(row["Status"]).strip()
-                or ("FAILED" in str(row["Status"]).strip() and (not parsed_args.rerun))
-            ):
-                break
-        else:
-            sysprint(f"SKIPPING Workload: {workload}")
-            continue
+    Args:
+        a (frozenset): Device claims
+        b (frozenset): Device claims
 
-        assigned = []
-        for i, row in df_workload.iterrows():
-            if row["Devices"] not in assigned:
-                assigned.append(row["Devices"])
-            letter = row["Devices"]
-            df_workload.loc[i, "Letter"] = letter
-            df_workload.loc[i, "Number"] = ascii_uppercase[
-                (df_workload["Letter"].value_counts()[letter] - 1)
-            ]
+    Returns:
+        bool: Whether the claims overlap
+    """
+    if not a or not b:
+        return False
+    return "*" in a or "*" in b or bool(a & b)
 
-        letter_quants = df_workload["Letter"].value_counts()
-        for i, row in df_workload.iterrows():
-            if letter_quants[row["Letter"]] > 1:
-                df_workload.loc[i, "Letter"] = f'{row["Letter"]}_{row["Number"]}'
-            if str(row["Collocation"]).strip() not in ("-", "", "nan"):
-                df_workload.loc[i, "Letter"] = (
-                    f'{df_workload.loc[i, "Letter"]}_{df_workload.loc[i, "Collocation"]}'
-                )
 
-        # Set devices string and DCGMI group
+def schedule_concurrent(workloads, run):
+    """Run workloads concurrently while keeping workloads that share a device serialized.
+    Workloads are started in order as soon as their devices are free, but never before an
+    earlier workload that claims one of the same devices. Workloads are taken from the iterable
+    as needed, looking ahead at most RADT_SCHEDULE_WINDOW workloads.
+
+    Args:
+        workloads (iterable): (name, df_workload) tuples in schedule order
+        run (callable): Executes a workload, called as run(name, df_workload)
+    """
+    window = int(os.getenv("RADT_SCHEDULE_WINDOW") or constants.SCHEDULE_WINDOW)
+    workloads = iter(workloads)
+    pending = []
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=window) as pool:
         try:
-            migedit.remove_mig_devices()
-        except FileNotFoundError:
-            # SMI not found, continue
-            pass
+            while True:
+                while len(pending) < window and (item := next(workloads, None)):
+                    name, df_workload = item
+                    pending.append((name, df_workload, workload_claims(df_workload)))
+                if not pending and not running:
+                    break
 
-        dev_table = df_workload["Devices"].astype(str).str.split("+").apply(frozenset)
-        mig_table, entity_table = dev_table.copy(), dev_table.copy()
+                busy = frozenset().union(*running.values())
+                blocked = frozenset()
+                for item in list(pending):
+                    name, df_workload, claims = item
+                    if claims_conflict(claims, busy) or claims_conflict(claims, blocked):
+                        blocked |= claims
+                        continue
+                    pending.remove(item)
+                    running[pool.submit(run, name, df_workload)] = claims
+                    busy |= claims
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del running[future]
+                    future.result()
+        except KeyboardInterrupt:
+            try:
+                # Runs receive the interrupt as well, wait for their workloads to wrap up
+                sysprint("Interrupting workloads... Please wait")
+                pending.clear()
+                wait(running)
+            except KeyboardInterrupt:
+                pass
+            sys.exit()
 
-        for i, row in df_workload.iterrows():
-            remove_mps()
-            clear_page_cache()
 
-            if "g" in str(row["Collocation"]):  # TODO: fix
-                result = migedit.make_mig_devices(
-                    row["Devices"], [row["Collocation"]], remove_old=False
-                )
-                mig_table.loc[i] = frozenset([y for x in result for y in x[4]])
-                entity_table.loc[i] = frozenset([x[3] for x in result])
+def start_schedule(parsed_args: Namespace, file: Path, args_passthrough: list):
+    """Schedule (execute) a .py or .csv file via RADT
 
-        gpu_uuids = get_gpu_ids()
-        for i, v in mig_table.items():
-            s = set()
-            for device in v:
-                device = device.strip()
-                if device in gpu_uuids:
-                    device = gpu_uuids[device]
-                s.add(device)
-            mig_table[i] = frozenset(s)
+    Args:
+        parsed_args (Namespace): Schedule arguments
+        file (Path): Path to file
+        args_passthrough (list): Run arguments
+    """
+    # A single sampling daemon serves every workload. It is forked before the scheduler starts
+    # any thread, as forking a process with running threads can deadlock the child.
+    sampling_daemon, daemon_socket = None, None
+    if parsed_args.daemon:
+        daemon_socket = str(Path(tempfile.gettempdir()) / f"radt-{os.getpid()}.sock")
+        Path(daemon_socket).unlink(missing_ok=True)
+        sampling_daemon = SamplingDaemon(daemon_socket)
+        sampling_daemon.start()
 
-        dcgmi_enabled, dcgmi_table = make_dcgm_groups(entity_table)
+    df, df_raw = determine_operating_mode(parsed_args, file, args_passthrough)
 
-        make_mps(df_workload, gpu_uuids)
+    # Results are journaled next to the .csv, which is regenerated from the journal
+    state = None
+    if isinstance(df_raw, pd.DataFrame):
+        state = ExperimentState(file)
+        if restored := state.restore(df_raw):
+            sysprint(f"Restored {restored} rows from {state.path.name}")
+            df["Run"], df["Status"] = df_raw["Run"], df_raw["Status"]
 
-        commands = []
+    stage = Path(tempfile.mkdtemp(prefix="radt-stage-"))
 
-        for i, (id, row) in enumerate(df_workload.iterrows()):
-            row = row.copy()
-            row["Filepath"] = str(Path(row["File"]).parent.absolute())
-            row["File"] = str(Path(row["File"]).name)
-            row["Envmanager"] = "conda" if parsed_args.useconda else "local"
+    def pending():
+        for workload, plan in iter_workloads(df, parsed_args, stage, state):
+            if plan is None:
+                sysprint(f"SKIPPING Workload: {workload}")
+            else:
+                yield workload, plan
 
-            # Workload Listener
-            listeners = row["Listeners"].split("+")
-            row["WorkloadListener"] = ""
-            listener_env_vars = {k: "False" for k in constants.RUN_LISTENERS}
+    workloads = pending()
+    concurrent = parsed_args.concurrent
 
-            for listener in listeners:
-                if (k := listener.strip()) in constants.WORKLOAD_LISTENERS:
-                    row["WorkloadListener"] = constants.WORKLOAD_LISTENERS[k].format(
-                        **row
-                    )
-                    listeners.remove(listener)
-                else:
-                    if k.upper() == "DCGMI" and not dcgmi_enabled:
-                        continue
-                    listener_env_vars[f"RADT_LISTENER_{k.upper()}"] = "True"
-
-            listeners = "+".join(listeners)
-
-            commands.append(
-                (
-                    id,
-                    constants.COLOURS[i % 6],
-                    row["Letter"],
-                    {
-                        "MLFLOW_EXPERIMENT_ID": str(row["Experiment"]).strip(),
-                        "CUDA_VISIBLE_DEVICES": ",".join(map(str, mig_table[id])),
-                        "RADT_DCGMI_GROUP": str(dcgmi_table[id]),
-                        "SMI_GPU_ID": str(row["Devices"]),
-                        "RADT_MAX_EPOCH": str(parsed_args.max_epoch),
-                        "RADT_MAX_TIME": str(parsed_args.max_time * 60),
-                        "RADT_MANUAL_MODE": "True" if parsed_args.manual else "False",
-                    }
-                    | listener_env_vars,
-                    constants.COMMAND.format(**row).split()
-                    + ["-P", f"workload_listener={row['WorkloadListener']}"],
-                    constants.MLPROJECT_CONTENTS.replace(
-                        "<REPLACE_COMMAND>",
-                        constants.MLFLOW_COMMAND.format(
-                            WorkloadListener=row["WorkloadListener"],
-                            Listeners=listeners,
-                            File=row["File"],
-                            Params=row["Params"] or '""',
-                        ),
-                    ).replace(
-                        "<REPLACE_ENV>",
-                        "conda_env: conda.yaml" if parsed_args.useconda else "",
-                    ),
-                    row["Filepath"],
-                    row,
-                )
-            )
+    def run(workload: str, df_workload: pd.DataFrame):
+        started = time.time()
+        results = run_workload(
+            parsed_args, workload, df_workload, devices, concurrent, daemon_socket
+        )
 
-        # Format and run the row
-        sysprint(f"RUNNING WORKLOAD: {workload}")
-        results = execute_workload(commands, parsed_args.max_time * 60)
-        remove_mps()
+        # Record if .csv, as soon as the workload has finished
+        if state is not None:
+            state.record(df_raw, df_workload, results, started, time.time())
 
-        # Write if .csv
-        if isinstance(df_raw, pd.DataFrame):
-            for id, letter, returncode, run_id, run_name, status in results:
-                df_raw.loc[id, "Run"] = run_id
-                df_raw.loc[id, "Status"] = f"{status} {run_name} ({letter})"
-
-            # Write the result of the run to the csv
-            target = Path("result.csv")
-            df_raw.to_csv(target, index=False)
-            file.unlink()
-            target.rename(file)
+    # The node is reset once, workloads then only change what differs from the previous setup
+    devices = DeviceState()
+    if first := next(workloads, None):
+        devices.reset()
+        workloads = itertools.chain([first], workloads)
+    try:
+        if concurrent:
+            clear_page_cache()
+            schedule_concurrent(workloads, run)
+        else:
+            for workload, df_workload in workloads:
+                run(workload, df_workload)
+    finally:
+        devices.close()
+        shutil.rmtree(stage, ignore_errors=True)
+        if state is not None:
+            state.export(df_raw)
+            state.close()
+        if sampling_daemon is not None:
+            sampling_daemon.terminate()
+            sampling_daemon.join(constants.SINK_FLUSH_TIMEOUT)
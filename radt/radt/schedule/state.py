@@ -0,0 +1,277 @@
+"""Journaled state of a CSV experiment, the CSV itself is regenerated from it"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from .. import constants
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    run TEXT,
+    status TEXT,
+    returncode INTEGER,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS sweeps (
+    source TEXT PRIMARY KEY,
+    total INTEGER NOT NULL,
+    finished INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# Columns identifying the configuration of a row, rows are only restored when these are unchanged
+KEY_COLUMNS = ["Experiment", "Workload", "Devices", "Collocation", "Listeners", "File", "Params"]
+
+
+def state_path(file: Path):
+    """Get the state file of an experiment
+
+    Args:
+        file (Path): Experiment CSV
+
+    Returns:
+        Path: State file next to the CSV
+    """
+    return file.with_name(f"{file.stem}.state.db")
+
+
+def outcome(status: str):
+    """Classify a recorded status
+
+    Args:
+        status (str): Status of a row
+
+    Returns:
+        tuple: Whether the row finished, whether it failed
+    """
+    status = str(status)
+    return int("FINISHED" in status), int("FAILED" in status)
+
+
+def summary(total: int, finished: int, failed: int):
+    """Status of a row holding a sweep
+
+    Args:
+        total (int): Configurations
+        finished (int): Finished configurations
+        failed (int): Failed configurations
+
+    Returns:
+        str: Status
+    """
+    return f"SWEEP {finished}/{total} finished, {failed} failed"
+
+
+def row_keys(df: pd.DataFrame):
+    """Fingerprint the configuration of every row
+
+    Args:
+        df (pd.DataFrame): Experiment
+
+    Returns:
+        pd.Series: Key per row
+    """
+    # Blank cells are keyed as "nan", as astype(str) did before pandas 3, so journals stay valid
+    return pd.Series(
+        [
+            hashlib.sha1("\x1f".join(row).encode()).hexdigest()
+            for row in df[KEY_COLUMNS].fillna("nan").astype(str).values.tolist()
+        ],
+        index=df.index,
+        dtype=object,
+    )
+
+
+class ExperimentState:
+    def __init__(self, file: Path):
+        """
+        SQLite journal of the run status, run id and timings of every row of a CSV experiment.
+        Results are recorded with a single durable upsert each, the CSV is regenerated from the
+        journal every RADT_STATE_EXPORT_INTERVAL seconds and at the end of the schedule.
+        Safe to share between threads.
+
+        Args:
+            file (Path): Experiment CSV
+        """
+        self.file = Path(file)
+        self.path = state_path(self.file)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.executescript(SCHEMA)
+
+        self.export_interval = float(
+            os.getenv("RADT_STATE_EXPORT_INTERVAL") or constants.STATE_EXPORT_INTERVAL
+        )
+        self.exported = time.monotonic()
+
+    def restore(self, df: pd.DataFrame):
+        """Apply the journal to an experiment, rows whose configuration changed are left as is
+
+        Args:
+            df (pd.DataFrame): Experiment, updated in place
+
+        Returns:
+            int: Rows restored
+        """
+        with self.lock:
+            df["Run"] = df["Run"].astype(object)
+            df["Status"] = df["Status"].astype(object)
+
+            journal = pd.read_sql_query("SELECT id, key, run, status FROM rows", self.db)
+            if journal.empty:
+                return 0
+
+            rows = pd.Series(df.index, index=df.index.astype(str))
+            journal = journal[journal["id"].isin(rows.index)]
+            journal.index = rows[journal["id"]].values
+            journal = journal[journal["key"].values == row_keys(df).loc[journal.index].values]
+
+            df.loc[journal.index, "Run"] = journal["run"]
+            df.loc[journal.index, "Status"] = journal["status"]
+
+            # Rows holding sweeps get a summary of their configurations
+            sweeps = pd.read_sql_query("SELECT * FROM sweeps", self.db)
+            sweeps = sweeps[sweeps["source"].isin(rows.index)]
+            df.loc[rows[sweeps["source"]].values, "Status"] = [
+                summary(*counts) for counts in sweeps[["total", "finished", "failed"]].values
+            ]
+            return len(journal) + len(sweeps)
+
+    def finished(self, ids: list, keys: list, rerun: bool = False):
+        """Which rows have finished, with an unchanged configuration
+
+        Args:
+            ids (list): Row ids
+            keys (list): Row keys, see row_keys
+            rerun (bool, optional): Whether failed rows are to be rerun. Defaults to False.
+
+        Returns:
+            list: Whether each row finished, or failed when not rerunning
+        """
+        with self.lock:
+            ids = [str(id) for id in ids]
+            recorded = {}
+            # Older SQLite versions allow at most 999 parameters per statement
+            for start in range(0, len(ids), 999):
+                batch = ids[start : start + 999]
+                recorded.update(
+                    (id, (key, status))
+                    for id, key, status in self.db.execute(
+                        f"SELECT id, key, status FROM rows WHERE id IN ({','.join('?' * len(batch))})",
+                        batch,
+                    )
+                )
+
+            done = []
+            for id, key in zip(ids, keys):
+                if id not in recorded or recorded[id][0] != key:
+                    done.append(False)
+                    continue
+                finished, failed = outcome(recorded[id][1])
+                done.append(bool(finished or (failed and not rerun)))
+            return done
+
+    def record(
+        self, df: pd.DataFrame, plan: pd.DataFrame, results: list, started: float, finished: float
+    ):
+        """Durably record the results of a workload
+
+        Args:
+            df (pd.DataFrame): Experiment, updated in place
+            plan (pd.DataFrame): Plan of the workload
+            results (list): Run results of execute_workload
+            started (float): Start of the workload in seconds since epoch
+            finished (float): End of the workload in seconds since epoch
+        """
+        if not results:
+            return
+        with self.lock:
+            rows, sweeps = [], {}
+            with self.db:
+                for id, letter, returncode, run_id, run_name, status in results:
+                    status = f"{status} {run_name} ({letter})"
+                    rows.append(
+                        (str(id), plan.at[id, "Key"], run_id, status, returncode, started, finished)
+                    )
+                    if pd.isna(plan.at[id, "Sweep"]):
+                        df.loc[id, "Run"] = run_id
+                        df.loc[id, "Status"] = status
+                        continue
+
+                    # Count configurations of sweeps, replacing the outcome of earlier attempts
+                    source = plan.at[id, "Source"]
+                    previous = self.db.execute(
+                        "SELECT status FROM rows WHERE id = ?", (str(id),)
+                    ).fetchone()
+                    old, new = outcome(previous[0] if previous else ""), outcome(status)
+                    self.db.execute(
+                        "INSERT INTO sweeps (source, total) VALUES (?, ?) "
+                        "ON CONFLICT (source) DO UPDATE SET total = excluded.total",
+                        (str(source), int(plan.at[id, "Sweep"])),
+                    )
+                    self.db.execute(
+                        "UPDATE sweeps SET finished = finished + ?, failed = failed + ? WHERE source = ?",
+                        (new[0] - old[0], new[1] - old[1], str(source)),
+                    )
+                    sweeps[source] = str(source)
+
+                self.db.executemany("INSERT OR REPLACE INTO rows VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                for source, key in sweeps.items():
+                    counts = self.db.execute(
+                        "SELECT total, finished, failed FROM sweeps WHERE source = ?", (key,)
+                    ).fetchone()
+                    df.loc[source, "Status"] = summary(*counts)
+
+            if time.monotonic() - self.exported > self.export_interval:
+                self.export(df)
+
+    def export(self, df: pd.DataFrame):
+        """Atomically rewrite the CSV
+
+        Args:
+            df (pd.DataFrame): Experiment
+        """
+        with self.lock:
+            target = self.file.with_name(f".{self.file.name}.tmp")
+            with open(target, "w") as f:
+                df.to_csv(f, index=False)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(target, self.file)
+            self.exported = time.monotonic()
+
+    def close(self):
+        """Close the journal"""
+        with self.lock:
+            self.db.close()
+
+
+def export(file: Path):
+    """Regenerate an experiment CSV from its journal
+
+    Args:
+        file (Path): Experiment CSV
+
+    Returns:
+        int: Rows restored from the journal
+    """
+    df = pd.read_csv(file, delimiter=",", header=0, skipinitialspace=True)
+    state = ExperimentState(file)
+    try:
+        restored = state.restore(df)
+        state.export(df)
+    finally:
+        state.close()
+    return restored
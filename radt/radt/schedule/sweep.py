@@ -0,0 +1,121 @@
+"""Parameter sweeps: cells such as `--batch-size {64,128,256}` expand into one configuration per value"""
+
+import hashlib
+import itertools
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+# Brace groups of alternatives (`{a,b,c}`) or integer ranges (`{start..end}`, `{start..end..step}`).
+# Braces holding spaces, quotes or colons, e.g. JSON, are passed through verbatim.
+PATTERN = re.compile(r"\{([^{}\s:\"']*(?:,|\.\.)[^{}\s:\"']*)\}")
+RANGE = re.compile(r"(-?\d+)\.\.(-?\d+)(?:\.\.(-?\d+))?")
+
+# Columns that may hold sweeps, the first varies slowest so configurations sharing devices are adjacent
+COLUMNS = ["Devices", "Collocation", "Params"]
+
+
+def alternatives(group: str):
+    """Get the values of a brace group
+
+    Args:
+        group (str): Contents of the group, e.g. `64,128` or `1..8..2`
+
+    Returns:
+        list: Values, ranges include their end
+    """
+    if m := RANGE.fullmatch(group):
+        start, end = int(m[1]), int(m[2])
+        step = abs(int(m[3] or 1)) or 1
+        if end < start:
+            step = -step
+        return [str(v) for v in range(start, end + (1 if step > 0 else -1), step)]
+    return group.split(",")
+
+
+def is_sweep(df: pd.DataFrame):
+    """Find rows holding sweeps
+
+    Args:
+        df (pd.DataFrame): Experiment
+
+    Returns:
+        pd.Series: Whether each row holds a sweep
+    """
+    mask = pd.Series(False, index=df.index)
+    for column in COLUMNS:
+        mask |= df[column].fillna("").astype(str).map(lambda value: PATTERN.search(value) is not None)
+    return mask
+
+
+def dimensions(df_workload: pd.DataFrame):
+    """Find the sweeps of a workload
+
+    Args:
+        df_workload (pd.DataFrame): Rows of the workload
+
+    Returns:
+        list, list: Cells holding sweeps as (position, column, parts), values of every brace group
+    """
+    cells, dims = [], []
+    for column in COLUMNS:
+        for position, value in enumerate(df_workload[column].fillna("").astype(str)):
+            parts = PATTERN.split(value)
+            if len(parts) > 1:
+                cells.append((position, column, parts))
+                dims.extend(alternatives(group) for group in parts[1::2])
+    return cells, dims
+
+
+def fill(parts: list, values: tuple):
+    """Substitute values for the brace groups of a cell
+
+    Args:
+        parts (list): Cell split by PATTERN, brace groups at odd positions
+        values (tuple): Value of every brace group
+
+    Returns:
+        str: Cell of the configuration
+    """
+    filled = list(parts)
+    filled[1::2] = values
+    return "".join(filled)
+
+
+def expand(df_workload: pd.DataFrame, batch_size: int):
+    """Lazily expand a workload into one workload per configuration, a batch at a time.
+    Configurations are identified by a digest of their values, which stays the same when values
+    are added to or reordered within a sweep.
+
+    Args:
+        df_workload (pd.DataFrame): Rows of the workload
+        batch_size (int): Rows per batch, at least one configuration
+
+    Yields:
+        pd.DataFrame: Rows of the configurations indexed as `<row>/<digest>`, with a Source column
+            holding the original row, Sweep the number of configurations and Config the digest
+    """
+    cells, dims = dimensions(df_workload)
+    total = math.prod(len(values) for values in dims)
+    rows = len(df_workload)
+    df_workload = df_workload.astype({column: object for _, column, _ in cells})
+    columns = [df_workload.columns.get_loc(column) for _, column, _ in cells]
+
+    # The values of a cell are a slice of the values of a configuration
+    stops = list(itertools.accumulate(len(parts) // 2 for _, _, parts in cells))
+    starts = [0] + stops[:-1]
+
+    configurations = itertools.product(*dims)
+    while choices := list(itertools.islice(configurations, max(batch_size // rows, 1))):
+        digests = [hashlib.sha1("\x1f".join(c).encode()).hexdigest()[:10] for c in choices]
+        df = df_workload.iloc[np.tile(np.arange(rows), len(choices))]
+        for (position, _, parts), column, start, stop in zip(cells, columns, starts, stops):
+            df.iloc[position::rows, column] = [fill(parts, c[start:stop]) for c in choices]
+
+        df["Source"] = np.tile(df_workload.index, len(choices))
+        df["Sweep"] = total
+        df["Config"] = np.repeat(digests, rows)
+        df.index = [f"{i}/{digest}" for digest in digests for i in df_workload.index]
+        yield df